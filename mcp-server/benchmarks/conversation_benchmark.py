@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Conversation Benchmark
+Per-message overhead of the conversation hot path.
+
+Two measurements, written as JSON:
+
+- timestamps: the timestamp work of one add_message and of one duration
+  calculation, done the way it was before epoch timestamps (two
+  datetime.now().isoformat() calls per message, fromisoformat() parsing for
+  the duration) and the way it is now (one time.time_ns(), an integer
+  subtraction).
+- add_message: end-to-end ConversationManager.add_message cost per message
+  for each conversation store, plus the cost of generate_summary on the
+  resulting conversation.
+
+    python benchmarks/conversation_benchmark.py --messages 100000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+# Add src directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from conversation_manager import ConversationManager
+from conversation_store import CONVERSATION_STORES, ConversationArchive, create_conversation_store
+from timestamps import NS_PER_SECOND, now_ns
+
+BENCHMARK_VERSION = 1
+
+
+def _ns_per_call(function, iterations: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def _iso_message_timestamps() -> None:
+    # Message timestamp and conversation updated_at, as add_message formatted them
+    datetime.now(timezone.utc).isoformat()
+    datetime.now(timezone.utc).isoformat()
+
+
+def _epoch_message_timestamps() -> None:
+    now_ns()
+
+
+def measure_timestamps(iterations: int) -> Dict[str, Any]:
+    """Timestamp cost per message and per duration, ISO strings against epoch nanoseconds."""
+    created_iso, updated_iso = datetime.now(timezone.utc).isoformat(), datetime.now(timezone.utc).isoformat()
+    created_ns, updated_ns = now_ns(), now_ns()
+
+    def iso_duration() -> float:
+        start = datetime.fromisoformat(created_iso.replace('Z', '+00:00'))
+        end = datetime.fromisoformat(updated_iso.replace('Z', '+00:00'))
+        return (end - start).total_seconds() / 60
+
+    def epoch_duration() -> float:
+        return (updated_ns - created_ns) / (60 * NS_PER_SECOND)
+
+    iso_message = _ns_per_call(_iso_message_timestamps, iterations)
+    epoch_message = _ns_per_call(_epoch_message_timestamps, iterations)
+    iso_duration_ns = _ns_per_call(iso_duration, iterations)
+    epoch_duration_ns = _ns_per_call(epoch_duration, iterations)
+    return {
+        'iterations': iterations,
+        'per_message_ns': {
+            'iso': round(iso_message, 1),
+            'epoch_ns': round(epoch_message, 1),
+            'speedup': round(iso_message / epoch_message, 2)
+        },
+        'per_duration_ns': {
+            'iso': round(iso_duration_ns, 1),
+            'epoch_ns': round(epoch_duration_ns, 1),
+            'speedup': round(iso_duration_ns / epoch_duration_ns, 2)
+        }
+    }
+
+
+async def measure_add_message(store: str, messages: int) -> Dict[str, Any]:
+    """End-to-end add_message and generate_summary cost on one store."""
+    with tempfile.TemporaryDirectory() as directory:
+        manager = ConversationManager(
+            create_conversation_store(store, str(Path(directory) / 'conversations.sqlite')),
+            archive=ConversationArchive(Path(directory) / 'archive'),
+            # Measure the message path, not the background sweep
+            idle_ttl=0,
+            compact_threshold=0
+        )
+        conversation = await manager.start_conversation('Benchmark conversation')
+        metadata = ({'type': 'configuration'}, {}, {}, {})
+
+        start = time.perf_counter()
+        for i in range(messages):
+            await manager.add_message(conversation['id'], 'user', f'message {i}', dict(metadata[i % 4]))
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        summary = await manager.generate_summary(conversation['id'])
+        summary_seconds = time.perf_counter() - start
+        await manager.close()
+
+    return {
+        'store': store,
+        'messages': messages,
+        'us_per_message': round(elapsed / messages * 1e6, 2),
+        'messages_per_second': round(messages / elapsed, 1),
+        'summary_ms': round(summary_seconds * 1000, 3),
+        'key_decisions': len(summary['key_decisions'])
+    }
+
+
+async def run_benchmark(
+    messages: int = 10000,
+    stores: Sequence[str] = CONVERSATION_STORES,
+    iterations: int = 200000
+) -> Dict[str, Any]:
+    """Run the timestamp comparison and the add_message pass for every store."""
+    return {
+        'benchmark': 'conversation',
+        'benchmark_version': BENCHMARK_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine()
+        },
+        'parameters': {
+            'messages': messages,
+            'stores': list(stores),
+            'iterations': iterations
+        },
+        'timestamps': measure_timestamps(iterations),
+        'add_message': [await measure_add_message(store, messages) for store in stores]
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark per-message conversation overhead.')
+    parser.add_argument('--messages', type=int, default=10000, help='messages added per store')
+    parser.add_argument('--stores', nargs='+', default=list(CONVERSATION_STORES), choices=CONVERSATION_STORES)
+    parser.add_argument('--iterations', type=int, default=200000, help='timestamp micro-benchmark iterations')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(args.messages, stores=args.stores, iterations=args.iterations))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Retrieval Benchmark
+Reproducible benchmark of the knowledge base path over synthetic corpora.
+
+For every index type and quantization mode it ingests a generated corpus
+through KnowledgeBaseManager, builds the index, and measures ingest
+throughput, build time, memory footprint, query latency/QPS, approximate
+recall against exact search and recall/MRR/nDCG against the known source
+document of each query. Results are written as JSON so runs of different
+versions can be diffed.
+
+    python benchmarks/retrieval_benchmark.py --chunks 10000 100000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Add src directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from knowledge_base import KnowledgeBaseManager, direct_source
+from vector_index import QUANTIZATION_TYPES
+
+BENCHMARK_VERSION = 1
+
+# Documents drawn per random block; part of the corpus definition for a seed
+_CORPUS_BLOCK_SIZE = 10000
+
+
+class SyntheticCorpus:
+    """Deterministic topic-clustered documents, one chunk each.
+
+    Words mix a per-topic vocabulary with a Zipf-distributed shared one, so
+    similar documents cluster like real text. Queries are word samples of
+    chosen documents, which are the labeled relevant results.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        query_count: int = 100,
+        seed: int = 0,
+        topics: int = 256,
+        vocabulary_size: int = 20000,
+        words_per_document: int = 40,
+        words_per_query: int = 6
+    ):
+        self.count = count
+        self.seed = seed
+        self.topics = topics
+        self.vocabulary_size = vocabulary_size
+        self.words_per_document = words_per_document
+        self.words_per_query = words_per_query
+        rng = np.random.default_rng(seed)
+        self.query_documents = np.sort(rng.choice(count, min(query_count, count), replace=False))
+        self._query_set = set(self.query_documents.tolist())
+        self._query_texts: Dict[int, str] = {}
+
+    def documents(self) -> Iterator[str]:
+        """Generate the documents lazily, block by block."""
+        rng = np.random.default_rng(self.seed + 1)
+        ranks = np.arange(1, self.vocabulary_size + 1, dtype=np.float64)
+        zipf = 1.0 / ranks
+        zipf /= zipf.sum()
+        topic_words = self.vocabulary_size // self.topics
+
+        for start in range(0, self.count, _CORPUS_BLOCK_SIZE):
+            size = min(_CORPUS_BLOCK_SIZE, self.count - start)
+            topics = rng.integers(0, self.topics, size)
+            shared = rng.choice(self.vocabulary_size, (size, self.words_per_document), p=zipf)
+            local = topics[:, np.newaxis] * topic_words + rng.integers(0, topic_words, (size, self.words_per_document))
+            words = np.where(rng.random((size, self.words_per_document)) < 0.6, local, shared)
+            for offset in range(size):
+                # The document number keeps every text, and so every source, unique
+                text = f"doc{start + offset} topic{topics[offset]} " + ' '.join(f"w{word}" for word in words[offset])
+                if start + offset in self._query_set:
+                    self._query_texts[start + offset] = text
+                yield text
+
+    def queries(self) -> List[Dict[str, str]]:
+        """Queries with the source key of their relevant document; run after documents()."""
+        rng = np.random.default_rng(self.seed + 2)
+        queries = []
+        for document in self.query_documents.tolist():
+            text = self._query_texts[document]
+            words = text.split()[2:]
+            picked = rng.choice(len(words), min(self.words_per_query, len(words)), replace=False)
+            queries.append({'query': ' '.join(words[i] for i in sorted(picked)), 'source': direct_source(text)})
+        return queries
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process so far."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _directory_bytes(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+
+async def run_case(
+    corpus: SyntheticCorpus,
+    index_type: str,
+    quantization: str,
+    dimensions: int,
+    top_k: int = 10,
+    nlist: Optional[int] = None,
+    nprobe: int = 8,
+    nprobe_sweep: Optional[Sequence[int]] = None
+) -> Dict[str, Any]:
+    """Ingest, index and query one corpus with one index configuration."""
+    with tempfile.TemporaryDirectory() as storage_dir:
+        manager = KnowledgeBaseManager(storage_dir=storage_dir)
+        # Measure the index, not the caches
+        manager.embedding_cache_bytes = 0
+        manager.retrieval_cache.max_entries = 0
+        try:
+            # Stream the corpus; process_documents would keep every document summary
+            kb_id = None
+            chunk_count = token_count = 0
+            started = time.perf_counter()
+            async for event in manager.stream_documents(
+                corpus.documents(), {'embedding_provider': 'local', 'dimensions': dimensions}
+            ):
+                kb_id = event['knowledge_base_id']
+                if event['event'] == 'document':
+                    chunk_count += event['document']['chunk_count']
+                    token_count += event['document']['token_count']
+            ingest_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            created = await manager.create_knowledge_base({
+                'knowledge_base_id': kb_id,
+                'index_type': index_type,
+                'quantization': quantization,
+                'nlist': nlist,
+                'nprobe': nprobe,
+                'top_k': top_k,
+                'threshold': 0.0
+            })
+            build_time = time.perf_counter() - started
+
+            queries = corpus.queries()
+            documents = manager.store.read_documents(kb_id)
+            chunks = manager.chunks[kb_id]
+            labels = [[chunks[row]['id'] for row in documents[query['source']]['rows']] for query in queries]
+            texts = [query['query'] for query in queries]
+
+            tested = await manager.test_retrieval(kb_id, texts, {
+                'top_k': top_k,
+                'threshold': 0.0,
+                'relevant_chunk_ids': labels,
+                'nprobe_sweep': list(nprobe_sweep) if nprobe_sweep else None
+            })
+
+            started = time.perf_counter()
+            await manager.search_batch(kb_id, texts, top_k, 0.0)
+            batch_time = time.perf_counter() - started
+
+            metrics = tested['metrics']
+            index_stats = created['index_stats']
+            return {
+                'index_type': index_stats['index_type'],
+                'requested_index_type': index_type,
+                'quantization': quantization,
+                'chunks': chunk_count,
+                'ingest': {
+                    'time': ingest_time,
+                    'chunks_per_second': chunk_count / ingest_time if ingest_time else 0.0,
+                    'tokens': token_count
+                },
+                'build_time': build_time,
+                'memory': {
+                    'index_bytes': index_stats['memory_bytes'],
+                    'full_precision_bytes': index_stats['full_precision_bytes'],
+                    'compression_ratio': index_stats['compression_ratio'],
+                    'disk_bytes': _directory_bytes(manager.store.path(kb_id)),
+                    'peak_rss_bytes': _peak_rss_bytes()
+                },
+                'query': {
+                    'count': len(texts),
+                    'latency': metrics['latency'],
+                    'qps': len(texts) / metrics['total_response_time'] if metrics['total_response_time'] else 0.0,
+                    'batch_qps': len(texts) / batch_time if batch_time else 0.0,
+                    'avg_rows_scanned': metrics['index_scans']['avg_rows_scanned'],
+                    'scan_fraction': metrics['index_scans']['scan_fraction']
+                },
+                'recall': {
+                    'approximate_recall_at_k': tested['recall_report']['recall_at_k'],
+                    'nprobe_sweep': tested['recall_report']['settings'],
+                    **metrics.get('relevance', {})
+                }
+            }
+        finally:
+            await manager.close()
+
+
+async def run_benchmark(
+    chunk_counts: Sequence[int],
+    dimensions: int = 384,
+    index_types: Sequence[str] = ('flat', 'ivf'),
+    quantizations: Sequence[str] = QUANTIZATION_TYPES,
+    query_count: int = 100,
+    top_k: int = 10,
+    seed: int = 0,
+    nlist: Optional[int] = None,
+    nprobe: int = 8,
+    nprobe_sweep: Optional[Sequence[int]] = None
+) -> Dict[str, Any]:
+    """Run every corpus size against every index configuration."""
+    results = []
+    for count in chunk_counts:
+        for index_type in index_types:
+            for quantization in quantizations:
+                corpus = SyntheticCorpus(count, query_count=query_count, seed=seed)
+                results.append(await run_case(
+                    corpus, index_type, quantization, dimensions, top_k, nlist, nprobe, nprobe_sweep
+                ))
+
+    return {
+        'benchmark': 'retrieval',
+        'benchmark_version': BENCHMARK_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine()
+        },
+        'parameters': {
+            'chunk_counts': list(chunk_counts),
+            'dimensions': dimensions,
+            'index_types': list(index_types),
+            'quantizations': list(quantizations),
+            'query_count': query_count,
+            'top_k': top_k,
+            'seed': seed,
+            'nlist': nlist,
+            'nprobe': nprobe,
+            'nprobe_sweep': list(nprobe_sweep) if nprobe_sweep else None
+        },
+        'results': results
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark knowledge base retrieval on synthetic corpora.')
+    parser.add_argument('--chunks', type=int, nargs='+', default=[10000], help='corpus sizes in chunks')
+    parser.add_argument('--dimensions', type=int, default=384)
+    parser.add_argument('--index-types', nargs='+', default=['flat', 'ivf'], choices=['flat', 'ivf', 'auto'])
+    parser.add_argument('--quantization', nargs='+', default=list(QUANTIZATION_TYPES), choices=QUANTIZATION_TYPES)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, help='IVF buckets (default: about 4 * sqrt(chunks))')
+    parser.add_argument('--nprobe', type=int, default=8, help='IVF buckets probed per query')
+    parser.add_argument('--nprobe-sweep', type=int, nargs='*', help='nprobe values for the recall report')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_benchmark(
+        args.chunks,
+        dimensions=args.dimensions,
+        index_types=args.index_types,
+        quantizations=args.quantization,
+        query_count=args.queries,
+        top_k=args.top_k,
+        seed=args.seed,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        nprobe_sweep=args.nprobe_sweep
+    ))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ from fastmcp import FastMCP
 
 # Import our custom modules
 from src.conversation_manager import ConversationManager
+from src.timestamps import to_iso
 from src.rag_processor import RAGProcessor
 from src.knowledge_base import KnowledgeBaseManager
 from src.agent_generator import RAGAgentGenerator
@@ -141,38 +142,40 @@ async def continue_conversation(
     try:
         logger.info(f"Continuing conversation {conversation_id}")
         
-        # Add user message
-        await conversation_manager.add_message(
-            conversation_id,
-            'user',
-            user_message,
-            metadata={'type': message_type}
-        )
-        
-        # Get conversation context
-        conversation = await conversation_manager.get_conversation(conversation_id)
-        
-        # Process the message based on conversation state
-        response = await rag_processor.process_conversation_message(
-            conversation,
-            user_message,
-            message_type
-        )
-        
-        # Add system response
-        await conversation_manager.add_message(
-            conversation_id,
-            'assistant',
-            response['message'],
-            metadata=response.get('metadata', {})
-        )
-        
-        # Check if we need to update conversation state
-        if response.get('state_update'):
-            await conversation_manager.update_conversation_state(
+        # The reply is computed from the conversation as read, so hold it until the state is written
+        async with conversation_manager.lock(conversation_id):
+            # Add user message
+            await conversation_manager.add_message(
                 conversation_id,
-                response['state_update']
+                'user',
+                user_message,
+                metadata={'type': message_type}
             )
+            
+            # Get conversation context
+            conversation = await conversation_manager.get_conversation(conversation_id)
+            
+            # Process the message based on conversation state
+            response = await rag_processor.process_conversation_message(
+                conversation,
+                user_message,
+                message_type
+            )
+            
+            # Add system response
+            await conversation_manager.add_message(
+                conversation_id,
+                'assistant',
+                response['message'],
+                metadata=response.get('metadata', {})
+            )
+            
+            # Check if we need to update conversation state
+            if response.get('state_update'):
+                await conversation_manager.update_conversation_state(
+                    conversation_id,
+                    response['state_update']
+                )
         
         return {
             'success': True,
@@ -215,9 +218,9 @@ async def get_conversation_summary(
             'current_state': conversation['state'],
             'progress': conversation.get('metadata', {}).get('progress', {}),
             'requirements': conversation.get('metadata', {}).get('requirements', {}),
-            'message_count': len(conversation['messages']),
-            'created_at': conversation['created_at'],
-            'updated_at': conversation['updated_at']
+            'message_count': summary['message_count'],
+            'created_at': to_iso(conversation['created_at']),
+            'updated_at': to_iso(conversation['updated_at'])
         }
         
     except Exception as e:
@@ -338,7 +341,8 @@ async def estimate_rag_costs(
     Args:
         conversation_id: ID of the conversation
         template_selection: Selected template name
-        knowledge_base_size: Estimated knowledge base size and complexity
+        knowledge_base_size: Estimated knowledge base size and complexity;
+            defaults to the size measured by process_documents
         
     Returns:
         Detailed cost breakdown and estimates
@@ -349,7 +353,7 @@ async def estimate_rag_costs(
         cost_estimate = await cost_calculator.calculate_rag_costs(
             conversation=conversation,
             template_selection=template_selection,
-            knowledge_base_size=knowledge_base_size
+            knowledge_base_size=knowledge_base_size or conversation['metadata'].get('knowledge_base_size')
         )
         
         return {
@@ -386,7 +390,8 @@ async def process_documents(
     Args:
         conversation_id: ID of the conversation
         document_sources: List of document paths, URLs, or content
-        processing_options: Options for document processing
+        processing_options: Options for document processing; pass
+            knowledge_base_id to re-sync an existing knowledge base
         
     Returns:
         Processing results and knowledge base preparation status
@@ -394,9 +399,23 @@ async def process_documents(
     try:
         logger.info(f"Processing {len(document_sources)} documents for conversation {conversation_id}")
         
+        def log_progress(event: Dict[str, Any]) -> None:
+            if event['event'] in ('batch', 'complete'):
+                logger.info(
+                    f"Knowledge base {event['knowledge_base_id']}: {event['chunks_indexed']} chunks indexed "
+                    f"from {event['documents_processed']} documents"
+                )
+        
+        # Embed with the settings chosen through configure_embeddings
+        conversation = await conversation_manager.get_conversation(conversation_id)
+        options = dict(processing_options or {})
+        if 'embedding_config' in conversation['metadata']:
+            options.setdefault('embedding_config', conversation['metadata']['embedding_config'])
+        
         processing_result = await knowledge_base_manager.process_documents(
             document_sources,
-            options=processing_options or {}
+            options=options,
+            progress_callback=log_progress
         )
         
         # Update conversation with processing results
@@ -407,11 +426,21 @@ async def process_documents(
             metadata={'document_processing': processing_result}
         )
         
+        # Measured token counts feed later cost estimates
+        await conversation_manager.update_conversation_state(
+            conversation_id,
+            {'knowledge_base_size': processing_result['knowledge_base_size']}
+        )
+        
         return {
             'success': True,
             'processed_count': processing_result['processed_count'],
             'total_chunks': processing_result['total_chunks'],
             'total_tokens': processing_result['total_tokens'],
+            'knowledge_base_size': processing_result['knowledge_base_size'],
+            'skipped_count': processing_result['skipped_count'],
+            'updated_count': processing_result['updated_count'],
+            'deleted_count': processing_result['deleted_count'],
             'processing_errors': processing_result['errors'],
             'knowledge_base_id': processing_result['knowledge_base_id'],
             'embedding_config': processing_result['embedding_config'],
@@ -491,16 +520,34 @@ async def configure_embeddings(
         Embedding configuration results
     """
     try:
-        result = await knowledge_base_manager.configure_embeddings(
-            config=embedding_config
-        )
+        # Hold the conversation from reading its size to storing the configuration
+        async with conversation_manager.lock(conversation_id):
+            conversation = await conversation_manager.get_conversation(conversation_id)
+            knowledge_base_size = conversation['metadata'].get('knowledge_base_size')
+            
+            # Price the documents actually processed unless told otherwise
+            config = dict(embedding_config)
+            if 'estimated_tokens' not in config and 'knowledge_base_id' not in config and knowledge_base_size:
+                config['estimated_tokens'] = knowledge_base_size['estimated_tokens']
+            
+            result = await knowledge_base_manager.configure_embeddings(
+                config=config
+            )
+            
+            await conversation_manager.update_conversation_state(
+                conversation_id,
+                {'embedding_config': result['config']}
+            )
         
         return {
             'success': True,
             'embedding_model': result['model'],
             'vector_dimensions': result['dimensions'],
             'cost_per_token': result['cost_per_token'],
+            'estimated_tokens': result['estimated_tokens'],
             'estimated_cost': result['estimated_total_cost'],
+            'estimated_cost_without_cache': result['estimated_cost_without_cache'],
+            'cache_stats': result['cache_stats'],
             'configuration': result['config'],
             'timestamp': datetime.now(timezone.utc).isoformat()
         }
@@ -525,7 +572,10 @@ async def test_retrieval(
     Args:
         conversation_id: ID of the conversation
         test_queries: List of test queries
-        retrieval_config: Optional retrieval configuration
+        retrieval_config: Optional retrieval configuration (top_k, threshold,
+            strategy, and metadata filters such as {'source_type': 'web'}).
+            relevant_chunk_ids, one list per query, adds recall@k, MRR and
+            nDCG to the metrics; batch=True scores all queries together
         
     Returns:
         Retrieval test results and performance metrics
@@ -584,23 +634,29 @@ async def generate_rag_agent(
     try:
         logger.info(f"Generating RAG agent for conversation {conversation_id} with template {template}")
         
-        conversation = await conversation_manager.get_conversation(conversation_id)
-        
-        # Generate agent
-        agent_config = await agent_generator.generate_rag_agent(
-            conversation=conversation,
-            template_name=template,
-            customizations=customizations
-        )
-        
-        # Update conversation with agent config
-        await conversation_manager.update_conversation_state(
-            conversation_id,
-            {
-                'agent_config': agent_config,
-                'state': 'agent_generated'
-            }
-        )
+        # Hold the conversation while the agent generated from it is stored
+        async with conversation_manager.lock(conversation_id):
+            conversation = await conversation_manager.get_conversation(conversation_id)
+            
+            # Generate agent
+            agent_config = await agent_generator.generate_rag_agent(
+                conversation=conversation,
+                template_name=template,
+                customizations=customizations
+            )
+            
+            # The template's retrieval settings (e.g. hybrid search) apply to the knowledge base
+            if agent_config['knowledge_base_id']:
+                await knowledge_base_manager.apply_rag_config(agent_config['knowledge_base_id'], agent_config['rag_config'])
+            
+            # Update conversation with agent config
+            await conversation_manager.update_conversation_state(
+                conversation_id,
+                {
+                    'agent_config': agent_config,
+                    'state': 'agent_generated'
+                }
+            )
         
         return {
             'success': True,
@@ -753,7 +809,7 @@ async def calculate_deployment_cost(
         deployment_cost = await cost_calculator.calculate_rag_costs(
             conversation=conversation,
             template_selection=agent_config.get('template'),
-            knowledge_base_size=None  # Would be derived from conversation metadata
+            knowledge_base_size=conversation['metadata'].get('knowledge_base_size')
         )
         
         return {
@@ -845,50 +901,52 @@ async def deploy_rag_agent(
         Deployment results and agent information
     """
     try:
-        conversation = await conversation_manager.get_conversation(conversation_id)
-        agent_config = conversation.get('metadata', {}).get('agent_config', {})
-        user_id = conversation.get('user_id')
-        
-        if not agent_config:
-            return {
-                'success': False,
-                'error': 'No agent configuration found',
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }
-        
-        if not user_id:
-            return {
-                'success': False,
-                'error': 'User ID required for deployment',
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }
-        
-        # Validate before deployment
-        validation = await validate_agent_config(conversation_id)
-        if not validation.get('ready_for_deployment', False):
-            return {
-                'success': False,
-                'error': 'Agent configuration validation failed',
-                'validation_issues': validation.get('issues', []),
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }
-        
-        # Deploy via TrustStream
-        deployment_result = await truststream_integrator.deploy_rag_agent(
-            agent_config=agent_config,
-            user_id=user_id,
-            deployment_options=deployment_config
-        )
-        
-        if deployment_result['success']:
-            # Update conversation state
-            await conversation_manager.update_conversation_state(
-                conversation_id,
-                {
-                    'deployment': deployment_result['deployment'],
-                    'state': 'deployed'
+        # One deployment at a time per conversation
+        async with conversation_manager.lock(conversation_id):
+            conversation = await conversation_manager.get_conversation(conversation_id)
+            agent_config = conversation.get('metadata', {}).get('agent_config', {})
+            user_id = conversation.get('user_id')
+            
+            if not agent_config:
+                return {
+                    'success': False,
+                    'error': 'No agent configuration found',
+                    'timestamp': datetime.now(timezone.utc).isoformat()
+                }
+            
+            if not user_id:
+                return {
+                    'success': False,
+                    'error': 'User ID required for deployment',
+                    'timestamp': datetime.now(timezone.utc).isoformat()
+                }
+            
+            # Validate before deployment
+            validation = await validate_agent_config(conversation_id)
+            if not validation.get('ready_for_deployment', False):
+                return {
+                    'success': False,
+                    'error': 'Agent configuration validation failed',
+                    'validation_issues': validation.get('issues', []),
+                    'timestamp': datetime.now(timezone.utc).isoformat()
                 }
+            
+            # Deploy via TrustStream
+            deployment_result = await truststream_integrator.deploy_rag_agent(
+                agent_config=agent_config,
+                user_id=user_id,
+                deployment_options=deployment_config
             )
+            
+            if deployment_result['success']:
+                # Update conversation state
+                await conversation_manager.update_conversation_state(
+                    conversation_id,
+                    {
+                        'deployment': deployment_result['deployment'],
+                        'state': 'deployed'
+                    }
+                )
         
         return {
             'success': deployment_result['success'],
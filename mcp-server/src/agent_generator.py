@@ -81,6 +81,7 @@ class RAGAgentGenerator:
             'documentation_qa': {
                 'similarity_top_k': 7,
                 'similarity_threshold': 0.75,
+                'retrieval_strategy': 'hybrid',
                 'multi_query': True,
                 'code_extraction': True,
                 'api_reference_priority': True
@@ -259,6 +260,7 @@ class RAGAgentGenerator:
         env_vars = {
             'OPENAI_API_KEY': 'your-openai-api-key',
             'KNOWLEDGE_BASE_ID': 'auto-generated',
+            'KB_STORAGE_DIR': './kb_storage',
             'RAG_TEMPLATE': template_name,
             'SIMILARITY_THRESHOLD': '0.7',
             'MAX_CONTEXT_LENGTH': '4000'
@@ -303,6 +305,9 @@ from typing import Any, Dict, List, Optional, Union
 import httpx
 from fastmcp import FastMCP
 
+# Retrieval module of the chat-to-RAG server (mcp-server/src); it must be on PYTHONPATH
+from knowledge_base import KnowledgeBaseManager
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -317,12 +322,23 @@ mcp = FastMCP("{template_name.title()} RAG Agent")
 KNOWLEDGE_BASE_ID = os.getenv(\'KNOWLEDGE_BASE_ID\')
 SIMILARITY_THRESHOLD = float(os.getenv(\'SIMILARITY_THRESHOLD\', \'0.7\'))
 MAX_CONTEXT_LENGTH = int(os.getenv(\'MAX_CONTEXT_LENGTH\', \'4000\'))
+KB_STORAGE_DIR = os.getenv(\'KB_STORAGE_DIR\', \'./kb_storage\')
+
+# Opened on first search; knowledge base indexes are mmap'd from KB_STORAGE_DIR
+_knowledge_base_manager: Optional[KnowledgeBaseManager] = None
+
+def _get_knowledge_base_manager() -> KnowledgeBaseManager:
+    global _knowledge_base_manager
+    if _knowledge_base_manager is None:
+        _knowledge_base_manager = KnowledgeBaseManager(storage_dir=KB_STORAGE_DIR)
+    return _knowledge_base_manager
 
 @mcp.tool
 async def search_knowledge_base(
     query: str,
     top_k: int = 5,
-    threshold: Optional[float] = None
+    threshold: Optional[float] = None,
+    filters: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
     """
     Search the knowledge base for relevant information.
@@ -331,35 +347,27 @@ async def search_knowledge_base(
         query: Search query
         top_k: Number of results to return
         threshold: Similarity threshold
+        filters: Metadata filters applied before scoring, e.g.
+            {{\'source_type\': \'web\', \'modified_at\': {{\'gte\': \'2024-01-01\'}}}}
         
     Returns:
         Search results with relevance scores
     """
     try:
-        # Mock knowledge base search (replace with actual vector DB query)
-        results = [
-            {{
-                \'content\': f\'Relevant information for: {{query}}\',
-                \'score\': 0.85,
-                \'source\': \'document_1.pdf\',
-                \'metadata\': {{\'page\': 1}}
-            }},
-            {{
-                \'content\': f\'Additional context for: {{query}}\',
-                \'score\': 0.78,
-                \'source\': \'document_2.pdf\',
-                \'metadata\': {{\'page\': 3}}
-            }}
-        ]
-        
-        threshold = threshold or SIMILARITY_THRESHOLD
-        filtered_results = [r for r in results if r[\'score\'] >= threshold]
+        # Filters are evaluated on the knowledge base's metadata posting lists before scoring
+        results = await _get_knowledge_base_manager().search(
+            KNOWLEDGE_BASE_ID,
+            query,
+            top_k=top_k,
+            threshold=threshold if threshold is not None else SIMILARITY_THRESHOLD,
+            filters=filters
+        )
         
         return {{
             \'success\': True,
             \'query\': query,
-            \'results\': filtered_results[:top_k],
-            \'total_results\': len(filtered_results),
+            \'results\': results,
+            \'total_results\': len(results),
             \'timestamp\': datetime.now(timezone.utc).isoformat()
         }}
         
@@ -0,0 +1,264 @@
+"""
+Chunking
+Offset-based document chunking for knowledge base ingestion.
+
+Chunks reference their document text by character offsets instead of
+copying it; the chunk text is only sliced out when it is read.
+"""
+
+import bisect
+import hashlib
+import logging
+import re
+from array import array
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is a declared dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\S+')
+
+# Fallback token pattern when no BPE encoding is available
+_APPROX_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+class Tokenizer:
+    """Token counting and token offsets for an embedding model.
+    
+    Backed by tiktoken when its encoding can be loaded; otherwise falls
+    back to a word/punctuation approximation and reports `exact = False`.
+    """
+
+    def __init__(self, encoding: Any = None):
+        self.encoding = encoding
+        self.exact = encoding is not None
+        self.name = encoding.name if encoding is not None else 'approximate'
+
+    def count(self, text: str) -> int:
+        """Number of tokens in text."""
+        if self.encoding is not None:
+            return len(self.encoding.encode_ordinary(text))
+        return sum(1 for _ in _APPROX_TOKEN_RE.finditer(text))
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """Token counts for several texts, encoded in one batch."""
+        if self.encoding is not None:
+            return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+        return [self.count(text) for text in texts]
+
+    def token_starts(self, text: str) -> array:
+        """Character offset at which each token of text starts."""
+        if self.encoding is not None:
+            _, offsets = self.encoding.decode_with_offsets(self.encoding.encode_ordinary(text))
+            return array('q', offsets)
+        return array('q', (match.start() for match in _APPROX_TOKEN_RE.finditer(text)))
+
+    def token_starts_batch(self, texts: Sequence[str]) -> List[array]:
+        """Token start offsets for several texts, encoded in one batch."""
+        if self.encoding is not None:
+            return [
+                array('q', self.encoding.decode_with_offsets(tokens)[1])
+                for tokens in self.encoding.encode_ordinary_batch(list(texts))
+            ]
+        return [self.token_starts(text) for text in texts]
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str = 'text-embedding-ada-002') -> Tokenizer:
+    """Load the tokenizer for a model once per process."""
+    if tiktoken is None:
+        return Tokenizer()
+
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        # Encodings are downloaded on first use, which fails offline
+        logger.warning(f"tiktoken encoding for {model} unavailable, approximating tokens: {e}")
+        return Tokenizer()
+
+    return Tokenizer(encoding)
+
+
+def count_tokens_in_range(token_starts: Sequence[int], start: int, end: int) -> int:
+    """Number of tokens starting inside the character range [start, end)."""
+    return bisect.bisect_left(token_starts, end) - bisect.bisect_left(token_starts, start)
+
+
+def chunk_id(namespace: str, start: int, text: str) -> str:
+    """Deterministic chunk ID derived from the document key, chunk offset and chunk content.
+
+    The offset keeps repeated passages of one document apart.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(namespace.encode('utf-8'))
+    digest.update(b'\x00%d\x00' % start)
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Chunk:
+    """A window of a document, stored as offsets into the shared document text."""
+
+    __slots__ = (
+        'document', 'start', 'end', '_id', 'word_count', 'token_count', 'start_index', 'end_index',
+        'source', 'source_type', 'page'
+    )
+
+    def __init__(
+        self,
+        document: str,
+        start: int,
+        end: int,
+        start_index: int,
+        end_index: int,
+        source: str = '',
+        source_type: Optional[str] = None,
+        page: Optional[int] = None
+    ):
+        self.document = document
+        self.start = start
+        self.end = end
+        self.start_index = start_index
+        self.end_index = end_index
+        self.word_count = end_index - start_index
+        self.token_count: Optional[int] = None
+        self.source = source
+        self.source_type = source_type
+        self.page = page
+        self._id: Optional[str] = None
+
+    @property
+    def id(self) -> str:
+        """Content-derived ID, hashed on first access."""
+        if self._id is None:
+            self._id = chunk_id(self.source, self.start, self.text)
+        return self._id
+
+    @property
+    def text(self) -> str:
+        """Chunk text, sliced from the document on access."""
+        return self.document[self.start:self.end]
+
+    def metadata(self) -> Dict[str, Any]:
+        """Fields persisted alongside the chunk text."""
+        return {
+            'id': self.id,
+            'source': self.source,
+            'source_type': self.source_type,
+            'page': self.page,
+            'start_char': self.start,
+            'end_char': self.end,
+            'token_count': self.token_count
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Materialise the chunk as a plain record."""
+        return {
+            **self.metadata(),
+            'text': self.text,
+            'word_count': self.word_count,
+            'start_index': self.start_index,
+            'end_index': self.end_index
+        }
+
+
+class WordChunker:
+    """Splits text into overlapping windows of whitespace-delimited words."""
+
+    def chunk(
+        self,
+        text: str,
+        chunk_size: int,
+        overlap: int,
+        source: str = '',
+        source_type: Optional[str] = None,
+        page: Optional[int] = None
+    ) -> List[Chunk]:
+        """Split text into chunks of chunk_size words sharing overlap words."""
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+
+        # One pass records word boundaries; no per-word strings are kept
+        starts = array('q')
+        ends = array('q')
+        for match in _WORD_RE.finditer(text):
+            starts.append(match.start())
+            ends.append(match.end())
+
+        word_count = len(starts)
+        step = max(1, chunk_size - overlap)
+        chunks = []
+
+        for i in range(0, word_count, step):
+            end_index = min(i + chunk_size, word_count)
+            chunks.append(Chunk(
+                text,
+                starts[i],
+                ends[end_index - 1],
+                i,
+                end_index,
+                source=source,
+                source_type=source_type,
+                page=page
+            ))
+
+            if i + chunk_size >= word_count:
+                break
+
+        return chunks
+
+
+class TokenChunker:
+    """Splits text into overlapping windows of model tokens."""
+
+    def chunk(
+        self,
+        text: str,
+        token_starts: Sequence[int],
+        chunk_size: int,
+        overlap: int,
+        source: str = '',
+        source_type: Optional[str] = None,
+        page: Optional[int] = None
+    ) -> List[Chunk]:
+        """Split text into chunks of chunk_size tokens sharing overlap tokens.
+        
+        token_starts are the character offsets of the text's tokens, as
+        returned by Tokenizer.token_starts.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+
+        token_count = len(token_starts)
+        step = max(1, chunk_size - overlap)
+        chunks = []
+
+        for i in range(0, token_count, step):
+            end_index = min(i + chunk_size, token_count)
+            end = token_starts[end_index] if end_index < token_count else len(text)
+            chunk = Chunk(
+                text,
+                token_starts[i],
+                end,
+                i,
+                end_index,
+                source=source,
+                source_type=source_type,
+                page=page
+            )
+            chunk.word_count = len(_WORD_RE.findall(chunk.text))
+            chunk.token_count = end_index - i
+            chunks.append(chunk)
+
+            if i + chunk_size >= token_count:
+                break
+
+        return chunks
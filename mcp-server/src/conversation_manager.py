@@ -3,16 +3,131 @@ Conversation Manager
 Handles conversational flow and state management for RAG agent creation.
 """
 
+import asyncio
 import json
+import logging
+import os
 import uuid
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-class ConversationManager:
-    """Manages conversations for RAG agent creation."""
+try:
+    from .conversation_store import ConversationArchive, ConversationStore, create_conversation_store
+    from .message_log import Message, MessageLog
+    from .timestamps import NS_PER_SECOND, now_ns, to_epoch_ns, to_iso
+except ImportError:
+    from conversation_store import ConversationArchive, ConversationStore, create_conversation_store
+    from message_log import Message, MessageLog
+    from timestamps import NS_PER_SECOND, now_ns, to_epoch_ns, to_iso
+
+logger = logging.getLogger(__name__)
+
+# Message types reported as key decisions in summaries
+KEY_DECISION_TYPES = ('template_selection', 'configuration', 'deployment')
+
+# Type of the record that replaces compacted messages
+COMPACTED_HISTORY_TYPE = 'compacted_history'
+
+
+class _ConversationLock:
+    """asyncio.Lock that the task holding it may re-enter."""
+    
+    __slots__ = ('lock', 'owner', 'users')
     
     def __init__(self):
-        self.conversations: Dict[str, Dict] = {}
+        self.lock = asyncio.Lock()
+        self.owner: Optional[asyncio.Task] = None
+        # Holders and waiters; the entry is dropped when this reaches 0
+        self.users = 0
+
+
+class ConversationManager:
+    """Manages conversations for RAG agent creation.
+    
+    Conversations live in a ConversationStore (see conversation_store);
+    the most recently used cache_size of them are also kept in memory.
+    Every change is written through to the store, so idle conversations
+    can be evicted from memory and loaded again on demand. Replicas sharing
+    one store should use cache_size=0 so every access reads the store.
+    The memory store holds the same objects as the working set, so there
+    cache_size frees nothing; bound it with the store's max_entries instead.
+    
+    conversation['messages'] is an append-only MessageLog (see message_log)
+    indexed by message type. created_at, updated_at and message timestamps
+    are epoch nanoseconds (see timestamps); summaries render them as ISO.
+    
+    A background sweep, started with the first conversation, archives
+    conversations idle for longer than idle_ttl seconds to compressed cold
+    storage, and compacts histories longer than compact_threshold messages
+    into a summary record plus the compact_keep most recent messages.
+    Archived conversations are restored transparently when accessed.
+    
+    Each manager method that changes a conversation holds that
+    conversation's lock; callers that read a conversation, await other
+    work and then write back wrap the sequence in lock(conversation_id).
+    Different conversations never wait on each other.
+    """
+    
+    def __init__(
+        self,
+        store: Optional[ConversationStore] = None,
+        cache_size: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        archive: Optional[ConversationArchive] = None,
+        compact_threshold: Optional[int] = None,
+        compact_keep: Optional[int] = None,
+        sweep_interval: Optional[float] = None
+    ):
+        self.store = store or create_conversation_store()
+        self.cache_size = cache_size if cache_size is not None else int(os.getenv('CONVERSATION_CACHE_SIZE', '1000'))
+        # In-memory working set, least recently used first
+        self.conversations: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.evictions = 0
+        
+        # Expiry and compaction; 0 disables either
+        self.idle_ttl = idle_ttl if idle_ttl is not None else float(os.getenv('CONVERSATION_IDLE_TTL', '86400'))
+        self.compact_threshold = (
+            compact_threshold if compact_threshold is not None
+            else int(os.getenv('CONVERSATION_COMPACT_THRESHOLD', '500'))
+        )
+        self.compact_keep = compact_keep if compact_keep is not None else int(os.getenv('CONVERSATION_COMPACT_KEEP', '50'))
+        self.sweep_interval = (
+            sweep_interval if sweep_interval is not None else float(os.getenv('CONVERSATION_SWEEP_INTERVAL', '60'))
+        )
+        self.archive = archive or ConversationArchive(Path(os.getenv('CONVERSATION_ARCHIVE_DIR', './conversation_archive')))
+        self.counters = {'expired': 0, 'restored': 0, 'compactions': 0, 'compacted_messages': 0}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._locks: Dict[str, _ConversationLock] = {}
+    
+    @asynccontextmanager
+    async def lock(self, conversation_id: str) -> AsyncIterator[None]:
+        """Hold a conversation exclusively.
+        
+        Re-entrant within one task, so manager methods can be called while
+        holding it; tasks spawned inside the block must not take it again.
+        """
+        task = asyncio.current_task()
+        entry = self._locks.get(conversation_id)
+        if entry is not None and entry.owner is task:
+            yield
+            return
+        if entry is None:
+            entry = self._locks[conversation_id] = _ConversationLock()
+        
+        entry.users += 1
+        try:
+            async with entry.lock:
+                entry.owner = task
+                try:
+                    yield
+                finally:
+                    entry.owner = None
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[conversation_id]
     
     async def start_conversation(
         self,
@@ -21,14 +136,16 @@ class ConversationManager:
         context: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """Start a new conversation."""
+        self._start_sweeper()
         conversation_id = str(uuid.uuid4())
+        now = now_ns()
         
         conversation = {
             'id': conversation_id,
             'user_id': user_id,
             'initial_description': user_description,
             'state': 'started',
-            'messages': [],
+            'messages': MessageLog(),
             'metadata': {
                 'context': context or {},
                 'progress': {
@@ -39,11 +156,12 @@ class ConversationManager:
                     'deployed': False
                 }
             },
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'updated_at': datetime.now(timezone.utc).isoformat()
+            'created_at': now,
+            'updated_at': now
         }
         
-        self.conversations[conversation_id] = conversation
+        await self.store.save(conversation)
+        self._cache(conversation)
         
         # Add initial message
         await self.add_message(
@@ -56,10 +174,23 @@ class ConversationManager:
         return conversation
     
     async def get_conversation(self, conversation_id: str) -> Dict[str, Any]:
-        """Get conversation by ID."""
-        if conversation_id not in self.conversations:
-            raise ValueError(f"Conversation {conversation_id} not found")
-        return self.conversations[conversation_id]
+        """Get conversation by ID, loading it from the store when not in memory."""
+        conversation = self.conversations.get(conversation_id)
+        if conversation is not None:
+            self.conversations.move_to_end(conversation_id)
+            return conversation
+        
+        self._start_sweeper()
+        # Serialised so concurrent misses share one loaded (or restored) object
+        async with self.lock(conversation_id):
+            conversation = self.conversations.get(conversation_id)
+            if conversation is not None:
+                return conversation
+            conversation = await self.store.load(conversation_id)
+            if conversation is None:
+                conversation = await self._restore(conversation_id)
+            self._cache(conversation)
+            return conversation
     
     async def add_message(
         self,
@@ -68,19 +199,15 @@ class ConversationManager:
         content: str,
         metadata: Optional[Dict[str, Any]] = None
     ) -> None:
-        """Add message to conversation."""
-        conversation = await self.get_conversation(conversation_id)
-        
-        message = {
-            'id': str(uuid.uuid4()),
-            'role': role,
-            'content': content,
-            'metadata': metadata or {},
-            'timestamp': datetime.now(timezone.utc).isoformat()
-        }
-        
-        conversation['messages'].append(message)
-        conversation['updated_at'] = datetime.now(timezone.utc).isoformat()
+        """Append a message to the conversation's log."""
+        async with self.lock(conversation_id):
+            conversation = await self.get_conversation(conversation_id)
+            
+            message = Message(str(uuid.uuid4()), role, content, metadata or {}, now_ns())
+            
+            seq = conversation['messages'].append(message)
+            conversation['updated_at'] = message.timestamp
+            await self.store.append_message(conversation, message.to_dict(), seq)
     
     async def update_conversation_state(
         self,
@@ -88,21 +215,111 @@ class ConversationManager:
         state_updates: Dict[str, Any]
     ) -> None:
         """Update conversation state and metadata."""
-        conversation = await self.get_conversation(conversation_id)
-        
-        # Update state
-        if 'state' in state_updates:
-            conversation['state'] = state_updates['state']
-        
-        # Update metadata
-        for key, value in state_updates.items():
-            if key != 'state':
-                if key in conversation['metadata']:
-                    conversation['metadata'][key].update(value if isinstance(value, dict) else {key: value})
-                else:
-                    conversation['metadata'][key] = value
+        async with self.lock(conversation_id):
+            conversation = await self.get_conversation(conversation_id)
+            
+            # Update state
+            if 'state' in state_updates:
+                conversation['state'] = state_updates['state']
+            
+            # Update metadata
+            for key, value in state_updates.items():
+                if key != 'state':
+                    if key in conversation['metadata']:
+                        conversation['metadata'][key].update(value if isinstance(value, dict) else {key: value})
+                    else:
+                        conversation['metadata'][key] = value
+            
+            conversation['updated_at'] = now_ns()
+            await self.store.save(conversation)
+    
+    async def sweep(self) -> Dict[str, int]:
+        """Archive idle conversations and compact long histories in memory."""
+        expired = await self.expire_idle() if self.idle_ttl > 0 else 0
+        compacted = 0
+        if self.compact_threshold > 0:
+            for conversation in list(self.conversations.values()):
+                if len(conversation['messages']) > self.compact_threshold:
+                    compacted += await self.compact_conversation(conversation['id'])
+        return {'expired': expired, 'compacted_messages': compacted}
+    
+    async def expire_idle(self) -> int:
+        """Move conversations idle for longer than idle_ttl to the archive."""
+        cutoff = now_ns() - int(self.idle_ttl * NS_PER_SECOND)
+        expired = 0
+        for conversation_id in await self.store.list_idle(cutoff):
+            async with self.lock(conversation_id):
+                conversation = self.conversations.get(conversation_id) or await self.store.load(conversation_id)
+                # Skip conversations deleted or used since they were listed
+                if conversation is None or conversation['updated_at'] >= cutoff:
+                    continue
+                record = {**conversation, 'messages': conversation['messages'].to_list(),
+                          'first_message_seq': conversation['messages'].first_seq}
+                await asyncio.to_thread(self.archive.put, record)
+                await self.store.delete(conversation_id)
+                self.conversations.pop(conversation_id, None)
+                expired += 1
+        self.counters['expired'] += expired
+        return expired
+    
+    async def compact_conversation(self, conversation_id: str) -> int:
+        """Move all but the compact_keep latest messages to cold storage behind a summary record.
         
-        conversation['updated_at'] = datetime.now(timezone.utc).isoformat()
+        Returns the number of messages compacted.
+        """
+        async with self.lock(conversation_id):
+            conversation = await self.get_conversation(conversation_id)
+            log = conversation['messages']
+            count = len(log) - self.compact_keep
+            if count < 2:
+                return 0
+            
+            removed = log[:count]
+            previous = [message for message in removed if message.type == COMPACTED_HISTORY_TYPE]
+            archived = [message.to_dict() for message in removed if message.type != COMPACTED_HISTORY_TYPE]
+            compacted = len(archived) + sum(message.metadata['compacted_messages'] for message in previous)
+            decisions = [decision for message in previous for decision in message.metadata['key_decisions']]
+            decisions.extend(self._decision(message) for message in removed if message.type in KEY_DECISION_TYPES)
+            summary = Message(
+                str(uuid.uuid4()),
+                'system',
+                f"{compacted} earlier messages moved to cold storage",
+                {'type': COMPACTED_HISTORY_TYPE, 'compacted_messages': compacted, 'key_decisions': decisions},
+                removed[-1].timestamp
+            )
+            
+            await asyncio.to_thread(self.archive.append_messages, conversation_id, archived)
+            seq = log.compact(count, summary)
+            await self.store.compact_messages(conversation, summary.to_dict(), seq)
+        self.counters['compactions'] += 1
+        self.counters['compacted_messages'] += len(archived)
+        return len(archived)
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Memory usage, eviction, expiry and compaction counts."""
+        return {
+            'conversations_in_memory': len(self.conversations),
+            'messages_in_memory': sum(len(conversation['messages']) for conversation in self.conversations.values()),
+            'memory_bytes': sum(conversation['messages'].memory_bytes() for conversation in self.conversations.values()),
+            'cache_size': self.cache_size,
+            'evictions': self.evictions,
+            'idle_ttl': self.idle_ttl,
+            'compact_threshold': self.compact_threshold,
+            **self.counters,
+            'store': await self.store.stats(),
+            'archive': await asyncio.to_thread(self.archive.stats)
+        }
+    
+    async def close(self) -> None:
+        """Stop the background sweep and close the conversation store."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        await self.store.close()
     
     async def generate_summary(self, conversation_id: str) -> Dict[str, Any]:
         """Generate conversation summary."""
@@ -112,7 +329,7 @@ class ConversationManager:
             'conversation_id': conversation_id,
             'initial_description': conversation['initial_description'],
             'current_state': conversation['state'],
-            'message_count': len(conversation['messages']),
+            'message_count': self._message_count(conversation),
             'progress': conversation['metadata']['progress'],
             'key_decisions': self._extract_key_decisions(conversation),
             'requirements': self._extract_requirements(conversation),
@@ -121,19 +338,62 @@ class ConversationManager:
         
         return summary
     
-    def _extract_key_decisions(self, conversation: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Extract key decisions from conversation messages."""
-        decisions = []
-        
-        for message in conversation['messages']:
-            if message.get('metadata', {}).get('type') in ['template_selection', 'configuration', 'deployment']:
-                decisions.append({
-                    'timestamp': message['timestamp'],
-                    'type': message['metadata']['type'],
-                    'decision': message['content'][:200] + '...' if len(message['content']) > 200 else message['content']
-                })
+    def _start_sweeper(self) -> None:
+        """Start the background sweep on the running loop, once."""
+        if self._sweeper is None and (self.idle_ttl > 0 or self.compact_threshold > 0):
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+    
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Conversation sweep failed: {e}")
+    
+    async def _restore(self, conversation_id: str) -> Dict[str, Any]:
+        """Bring an archived conversation back into the store."""
+        conversation = await asyncio.to_thread(self.archive.take, conversation_id)
+        if conversation is None:
+            raise ValueError(f"Conversation {conversation_id} not found")
         
-        return decisions
+        log = MessageLog.from_list(conversation.pop('messages'), conversation.pop('first_message_seq', 0))
+        conversation['messages'] = log
+        conversation['created_at'] = to_epoch_ns(conversation['created_at'])
+        conversation['updated_at'] = now_ns()
+        await self.store.save(conversation)
+        for seq, message in enumerate(log, log.first_seq):
+            await self.store.append_message(conversation, message.to_dict(), seq)
+        self.counters['restored'] += 1
+        return conversation
+    
+    def _cache(self, conversation: Dict[str, Any]) -> None:
+        """Keep a conversation in memory, evicting the least recently used."""
+        self.conversations[conversation['id']] = conversation
+        self.conversations.move_to_end(conversation['id'])
+        while len(self.conversations) > self.cache_size:
+            # Already persisted by the write-through, so eviction only frees memory
+            self.conversations.popitem(last=False)
+            self.evictions += 1
+    
+    def _extract_key_decisions(self, conversation: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Extract key decisions from the message type index and compacted history."""
+        log = conversation['messages']
+        decisions = [decision for message in log.of_type(COMPACTED_HISTORY_TYPE) for decision in message.metadata['key_decisions']]
+        decisions.extend(self._decision(message) for message in log.of_type(*KEY_DECISION_TYPES))
+        return [{**decision, 'timestamp': to_iso(to_epoch_ns(decision['timestamp']))} for decision in decisions]
+    
+    def _decision(self, message: Message) -> Dict[str, Any]:
+        return {
+            'timestamp': message.timestamp,
+            'type': message.type,
+            'decision': message.content[:200] + '...' if len(message.content) > 200 else message.content
+        }
+    
+    def _message_count(self, conversation: Dict[str, Any]) -> int:
+        """Messages in the conversation, counting compacted ones instead of their summary."""
+        log = conversation['messages']
+        return len(log) + sum(message.metadata['compacted_messages'] - 1 for message in log.of_type(COMPACTED_HISTORY_TYPE))
     
     def _extract_requirements(self, conversation: Dict[str, Any]) -> Dict[str, Any]:
         """Extract structured requirements from conversation."""
@@ -157,7 +417,4 @@ class ConversationManager:
         if not conversation['messages']:
             return 0
         
-        start_time = datetime.fromisoformat(conversation['created_at'].replace('Z', '+00:00'))
-        end_time = datetime.fromisoformat(conversation['updated_at'].replace('Z', '+00:00'))
-        
-        return (end_time - start_time).total_seconds() / 60
+        return (conversation['updated_at'] - conversation['created_at']) / (60 * NS_PER_SECOND)
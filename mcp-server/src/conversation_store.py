@@ -0,0 +1,395 @@
+"""
+Conversation Store
+Storage backends for ConversationManager.
+
+A store persists conversation records by ID. ConversationManager keeps
+recently used conversations in memory and loads the rest from its store on
+demand, so a durable store bounds memory and survives restarts. Messages
+are appended one at a time with append_message; save() writes only the
+conversation header.
+
+- MemoryConversationStore: process-local, optionally LRU-bounded; beyond
+  max_entries the least recently used conversations are spilled to a
+  ConversationArchive and loaded back on demand.
+- SQLiteConversationStore: embedded SQLite database in WAL mode; several
+  server processes on one host can share the file.
+
+ConversationArchive is the compressed cold storage behind both: expired
+conversations and messages compacted out of long histories.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    from .message_log import MessageLog
+    from .timestamps import to_epoch_ns
+except ImportError:
+    from message_log import MessageLog
+    from timestamps import to_epoch_ns
+
+CONVERSATION_STORES = ('memory', 'sqlite')
+
+
+class ConversationStore:
+    """Base class: async load/save/delete of conversation records."""
+
+    async def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """The stored conversation, or None."""
+        raise NotImplementedError
+
+    async def save(self, conversation: Dict[str, Any]) -> None:
+        """Insert or replace a conversation's header (everything but its messages)."""
+        raise NotImplementedError
+    
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, Any], seq: int) -> None:
+        """Append message number seq to a saved conversation and record its updated_at."""
+        raise NotImplementedError
+
+    async def delete(self, conversation_id: str) -> bool:
+        """Remove a conversation; False when it was not stored."""
+        raise NotImplementedError
+
+    async def compact_messages(self, conversation: Dict[str, Any], summary: Dict[str, Any], seq: int) -> None:
+        """Replace messages up to and including seq with a summary record stored at seq."""
+        raise NotImplementedError
+    
+    async def list_ids(self) -> List[str]:
+        """IDs of every stored conversation."""
+        raise NotImplementedError
+    
+    async def list_idle(self, updated_before: int) -> List[str]:
+        """IDs of conversations last updated before an epoch-nanosecond timestamp."""
+        raise NotImplementedError
+    
+    async def stats(self) -> Dict[str, Any]:
+        """Backend name and size."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Release the store's resources."""
+
+
+class MemoryConversationStore(ConversationStore):
+    """Conversations kept in this process, least recently used spilled to disk first.
+
+    The stored record is the manager's own object, so appends need no copy.
+    With max_entries, conversations beyond it are written to spill (a
+    ConversationArchive, by default under CONVERSATION_ARCHIVE_DIR/evicted)
+    and read back when loaded; only their IDs and updated_at stay in memory.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, spill: Optional['ConversationArchive'] = None):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.spill = spill
+        if spill is None and max_entries is not None:
+            archive_dir = Path(os.getenv('CONVERSATION_ARCHIVE_DIR', './conversation_archive'))
+            self.spill = ConversationArchive(archive_dir / 'evicted')
+        self._conversations: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        # Spilled conversation ID -> updated_at
+        self._spilled: Dict[str, int] = {}
+
+    async def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+        if conversation_id not in self._spilled:
+            return None
+
+        record = await asyncio.to_thread(self.spill.take, conversation_id)
+        del self._spilled[conversation_id]
+        if record is None:
+            return None
+        record['messages'] = MessageLog.from_list(record.pop('messages'), record.pop('first_message_seq', 0))
+        await self.save(record)
+        return record
+
+    async def save(self, conversation: Dict[str, Any]) -> None:
+        if self._spilled.pop(conversation['id'], None) is not None:
+            # The caller's copy is newer than the spilled one
+            await asyncio.to_thread(self.spill.discard, conversation['id'])
+        self._conversations[conversation['id']] = conversation
+        self._conversations.move_to_end(conversation['id'])
+        while self.max_entries is not None and len(self._conversations) > self.max_entries:
+            _, evicted = self._conversations.popitem(last=False)
+            record = {**evicted, 'messages': evicted['messages'].to_list(),
+                      'first_message_seq': evicted['messages'].first_seq}
+            await asyncio.to_thread(self.spill.put, record)
+            self._spilled[evicted['id']] = evicted['updated_at']
+            self.evictions += 1
+
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, Any], seq: int) -> None:
+        # The caller's object already holds the message; take it back if it was spilled meanwhile
+        if conversation['id'] in self._conversations:
+            self._conversations.move_to_end(conversation['id'])
+        elif conversation['id'] in self._spilled:
+            await self.save(conversation)
+
+    async def compact_messages(self, conversation: Dict[str, Any], summary: Dict[str, Any], seq: int) -> None:
+        if conversation['id'] in self._spilled:
+            await self.save(conversation)
+
+    async def delete(self, conversation_id: str) -> bool:
+        if self._spilled.pop(conversation_id, None) is not None:
+            return await asyncio.to_thread(self.spill.discard, conversation_id)
+        return self._conversations.pop(conversation_id, None) is not None
+
+    async def list_ids(self) -> List[str]:
+        return list(self._conversations) + list(self._spilled)
+
+    async def list_idle(self, updated_before: int) -> List[str]:
+        updated = {
+            conversation_id: conversation['updated_at'] for conversation_id, conversation in self._conversations.items()
+        }
+        updated.update(self._spilled)
+        return [conversation_id for conversation_id, updated_at in updated.items() if updated_at < updated_before]
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'conversations': len(self._conversations),
+            'memory_bytes': sum(
+                conversation['messages'].memory_bytes() for conversation in self._conversations.values()
+            ),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions,
+            'spilled': len(self._spilled)
+        }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversations as JSON rows in an SQLite database (WAL mode).
+
+    The header is one row of conversations; each message is one row of
+    messages keyed by (conversation_id, seq), so adding a message is an
+    insert and an updated_at update rather than a rewrite. Queries run in
+    a worker thread so the event loop is never blocked.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            'id TEXT PRIMARY KEY, user_id TEXT, state TEXT, updated_ns INTEGER, data TEXT NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS conversations_user ON conversations (user_id)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS conversations_updated_ns ON conversations (updated_ns)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL, '
+            'PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID'
+        )
+        self._connection.commit()
+
+    async def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._load, conversation_id)
+
+    async def save(self, conversation: Dict[str, Any]) -> None:
+        # Serialise on the loop so later in-memory edits cannot race the write
+        header = {key: value for key, value in conversation.items() if key != 'messages'}
+        row = (
+            conversation['id'],
+            conversation.get('user_id'),
+            conversation.get('state'),
+            conversation.get('updated_at'),
+            json.dumps(header, default=str)
+        )
+        await asyncio.to_thread(self._save, row)
+
+    async def append_message(self, conversation: Dict[str, Any], message: Dict[str, Any], seq: int) -> None:
+        row = (conversation['id'], seq, json.dumps(message, default=str))
+        await asyncio.to_thread(self._append_message, row, conversation.get('updated_at'))
+
+    async def compact_messages(self, conversation: Dict[str, Any], summary: Dict[str, Any], seq: int) -> None:
+        row = (conversation['id'], seq, json.dumps(summary, default=str))
+        await asyncio.to_thread(self._compact_messages, row)
+
+    async def delete(self, conversation_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, conversation_id)
+
+    async def list_ids(self) -> List[str]:
+        return await asyncio.to_thread(self._list_ids)
+
+    async def list_idle(self, updated_before: int) -> List[str]:
+        return await asyncio.to_thread(self._list_idle, updated_before)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._stats)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._close)
+
+    def _load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT data, updated_ns FROM conversations WHERE id = ?', (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conversation = json.loads(row[0])
+            messages = self._connection.execute(
+                'SELECT seq, data FROM messages WHERE conversation_id = ? ORDER BY seq', (conversation_id,)
+            ).fetchall()
+        # updated_ns is kept current by appends without rewriting the header
+        conversation['updated_at'] = row[1]
+        conversation['created_at'] = to_epoch_ns(conversation['created_at'])
+        conversation['messages'] = MessageLog.from_list(
+            (json.loads(message[1]) for message in messages),
+            messages[0][0] if messages else 0
+        )
+        return conversation
+
+    def _save(self, row: tuple) -> None:
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO conversations (id, user_id, state, updated_ns, data) VALUES (?, ?, ?, ?, ?)',
+                row
+            )
+            self._connection.commit()
+
+    def _append_message(self, row: tuple, updated_at: int) -> None:
+        with self._lock:
+            self._connection.execute('INSERT INTO messages (conversation_id, seq, data) VALUES (?, ?, ?)', row)
+            self._connection.execute('UPDATE conversations SET updated_ns = ? WHERE id = ?', (updated_at, row[0]))
+            self._connection.commit()
+
+    def _compact_messages(self, row: tuple) -> None:
+        with self._lock:
+            self._connection.execute('DELETE FROM messages WHERE conversation_id = ? AND seq <= ?', row[:2])
+            self._connection.execute('INSERT INTO messages (conversation_id, seq, data) VALUES (?, ?, ?)', row)
+            self._connection.commit()
+
+    def _delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            deleted = self._connection.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,)).rowcount
+            self._connection.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+            self._connection.commit()
+        return deleted > 0
+
+    def _list_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute('SELECT id FROM conversations')]
+
+    def _list_idle(self, updated_before: int) -> List[str]:
+        with self._lock:
+            return [
+                row[0] for row in
+                self._connection.execute('SELECT id FROM conversations WHERE updated_ns < ?', (updated_before,))
+            ]
+
+    def _stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conversations = self._connection.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+            messages = self._connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'conversations': conversations,
+            'messages': messages,
+            'size_bytes': self.path.stat().st_size
+        }
+
+    def _close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class ConversationArchive:
+    """Gzip-compressed cold storage in a directory.
+
+    An expired conversation is archived whole as {id}.json.gz and removed
+    again when it is restored. Messages compacted out of a live conversation
+    are appended to {id}.messages.jsonl.gz, one gzip member per compaction.
+    Methods are blocking; async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, directory: Path, compresslevel: int = 6):
+        self.directory = Path(directory)
+        self.compresslevel = compresslevel
+
+    def put(self, conversation: Dict[str, Any]) -> None:
+        """Archive a whole conversation; messages must already be plain dicts."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._conversation_path(conversation['id'])
+        temporary = path.with_suffix('.tmp')
+        with gzip.open(temporary, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as f:
+            json.dump(conversation, f, default=str)
+        temporary.replace(path)
+
+    def take(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Remove and return an archived conversation, or None."""
+        path = self._conversation_path(conversation_id)
+        if not path.exists():
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            conversation = json.load(f)
+        path.unlink()
+        return conversation
+
+    def discard(self, conversation_id: str) -> bool:
+        """Remove an archived conversation without reading it; False when there was none."""
+        path = self._conversation_path(conversation_id)
+        if not path.exists():
+            return False
+        path.unlink()
+        return True
+
+    def append_messages(self, conversation_id: str, records: List[Dict[str, Any]]) -> None:
+        """Append compacted messages to a conversation's cold history."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self._messages_path(conversation_id), 'at', encoding='utf-8', compresslevel=self.compresslevel) as f:
+            for record in records:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def load_messages(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """Compacted messages of a conversation, oldest first."""
+        path = self._messages_path(conversation_id)
+        if not path.exists():
+            return []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def stats(self) -> Dict[str, Any]:
+        """Archived conversation and cold history counts and their compressed size."""
+        conversations = histories = size = 0
+        if self.directory.exists():
+            for path in self.directory.iterdir():
+                if path.name.endswith('.messages.jsonl.gz'):
+                    histories += 1
+                elif path.name.endswith('.json.gz'):
+                    conversations += 1
+                else:
+                    continue
+                size += path.stat().st_size
+        return {'conversations': conversations, 'message_histories': histories, 'size_bytes': size}
+
+    def _conversation_path(self, conversation_id: str) -> Path:
+        return self.directory / f'{conversation_id}.json.gz'
+
+    def _messages_path(self, conversation_id: str) -> Path:
+        return self.directory / f'{conversation_id}.messages.jsonl.gz'
+
+
+def create_conversation_store(backend: Optional[str] = None, path: Optional[str] = None) -> ConversationStore:
+    """Create the store named by backend or CONVERSATION_STORE (default 'memory')."""
+    backend = backend or os.getenv('CONVERSATION_STORE', 'memory')
+    if backend == 'memory':
+        max_entries = os.getenv('CONVERSATION_MEMORY_LIMIT')
+        return MemoryConversationStore(int(max_entries) if max_entries else None)
+    if backend == 'sqlite':
+        return SQLiteConversationStore(Path(path or os.getenv('CONVERSATION_STORE_PATH', './conversations.sqlite')))
+    raise ValueError(f"Unsupported conversation store: {backend}")
@@ -0,0 +1,130 @@
+"""
+Document Loaders
+Text extraction for local document sources.
+
+Loader functions run inside worker processes, so they must remain
+module-level and picklable. PDF, DOCX and HTML parsing use the optional
+PyPDF2, python-docx and beautifulsoup4 packages; a source whose parser is
+not installed fails with an ImportError naming the package.
+"""
+
+import re
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import docx
+except ImportError:
+    docx = None
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+# Formats whose parsing is CPU-bound and is sent to the process pool
+PROCESS_POOL_EXTENSIONS = {'.pdf', '.docx', '.html', '.htm'}
+
+# Pages per worker task; larger PDFs are split across workers
+PDF_PAGES_PER_TASK = 8
+
+PAGE_SEPARATOR = '\n\n'
+
+# Elements whose text is not document content
+_HTML_SKIPPED_TAGS = ('script', 'style', 'noscript', 'template', 'head')
+
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+def needs_process_pool(path: str) -> bool:
+    """Check whether a file should be parsed in a worker process."""
+    return Path(path).suffix.lower() in PROCESS_POOL_EXTENSIONS
+
+
+def is_pdf(path: str) -> bool:
+    """Check whether a file is parsed page by page."""
+    return Path(path).suffix.lower() == '.pdf'
+
+
+def _require(module: object, package: str, path: str) -> None:
+    if module is None:
+        raise ImportError(f"{package} is required to parse {Path(path).name} (pip install {package})")
+
+
+def _open_pdf(path: str) -> 'PdfReader':
+    _require(PdfReader, 'PyPDF2', path)
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        # Many PDFs are encrypted with an empty user password
+        reader.decrypt('')
+    return reader
+
+
+def pdf_page_count(path: str) -> int:
+    """Number of pages in a PDF."""
+    return len(_open_pdf(path).pages)
+
+
+def load_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF."""
+    reader = _open_pdf(path)
+    return [reader.pages[page].extract_text() or '' for page in range(start, min(end, len(reader.pages)))]
+
+
+def join_pages(pages: Sequence[str]) -> Tuple[str, List[int]]:
+    """Concatenate page texts; returns the text and each page's start offset."""
+    page_starts = []
+    offset = 0
+    for page in pages:
+        page_starts.append(offset)
+        offset += len(page) + len(PAGE_SEPARATOR)
+    return PAGE_SEPARATOR.join(pages), page_starts
+
+
+def load_docx(path: str) -> str:
+    """Extract paragraph and table text from a Word document."""
+    _require(docx, 'python-docx', path)
+    document = docx.Document(path)
+    blocks = [paragraph.text for paragraph in document.paragraphs if paragraph.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                blocks.append(' | '.join(cells))
+    return '\n'.join(blocks)
+
+
+def load_html(path: str) -> str:
+    """Extract the visible text of an HTML file."""
+    _require(BeautifulSoup, 'beautifulsoup4', path)
+    return html_to_text(Path(path).read_text(encoding='utf-8', errors='replace'))
+
+
+def html_to_text(html: str) -> str:
+    """Visible text of an HTML document."""
+    if BeautifulSoup is None:
+        raise ImportError("beautifulsoup4 is required to parse HTML (pip install beautifulsoup4)")
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(_HTML_SKIPPED_TAGS):
+        element.decompose()
+    text = soup.get_text('\n')
+    return _BLANK_LINES_RE.sub('\n\n', '\n'.join(line.strip() for line in text.splitlines())).strip()
+
+
+def load_file(path: str) -> str:
+    """Extract the text content of a local file."""
+    suffix = Path(path).suffix.lower()
+
+    if suffix == '.pdf':
+        return join_pages(load_pdf_pages(path, 0, pdf_page_count(path)))[0]
+    if suffix == '.docx':
+        return load_docx(path)
+    if suffix in ('.html', '.htm'):
+        return load_html(path)
+
+    return Path(path).read_text(encoding='utf-8', errors='replace')
@@ -0,0 +1,183 @@
+"""
+Embedding Cache
+Disk-backed embedding cache shared by all knowledge bases.
+
+Vectors are stored in SQLite keyed by a hash of (model, dimensions, text),
+so identical chunks are embedded once across knowledge bases and
+re-ingestions. The cache is capped in bytes and evicts least recently used
+entries.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# SQLite limits the number of bound parameters per statement
+_MAX_PARAMS = 500
+
+# What a lookup embeds; hit rates are also counted per purpose
+LOOKUP_PURPOSES = ('ingest', 'query')
+
+
+def cache_key(model: str, dimensions: int, text: str) -> bytes:
+    """Cache key for a text embedded by a model."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{model}\x00{dimensions}\x00'.encode('utf-8'))
+    digest.update(text.encode('utf-8'))
+    return digest.digest()
+
+
+class EmbeddingCache:
+    """LRU embedding cache in a SQLite database.
+
+    Methods are blocking and thread-safe; async callers run them with
+    asyncio.to_thread.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 1024 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.purpose_counts = {purpose: {'hits': 0, 'misses': 0} for purpose in LOOKUP_PURPOSES}
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)')
+        self._connection.commit()
+        self._size_bytes = self._connection.execute(
+            'SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings'
+        ).fetchone()[0]
+
+    def get_many(
+        self,
+        model: str,
+        dimensions: int,
+        texts: Sequence[str],
+        purpose: str = 'ingest'
+    ) -> List[Optional[np.ndarray]]:
+        """Look up cached vectors; misses are returned as None.
+        
+        purpose ('ingest' or 'query') selects which per-purpose counters
+        the lookup is added to.
+        """
+        keys = [cache_key(model, dimensions, text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                batch = keys[start:start + _MAX_PARAMS]
+                rows = self._connection.execute(
+                    f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(batch))})',
+                    batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+
+            if found:
+                now = time.time()
+                self._connection.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE key = ?',
+                    [(now, key) for key in found]
+                )
+                self._connection.commit()
+
+            vectors = [found.get(key) for key in keys]
+            hits = sum(1 for vector in vectors if vector is not None)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            counts = self.purpose_counts[purpose]
+            counts['hits'] += hits
+            counts['misses'] += len(keys) - hits
+
+        return vectors
+
+    def put_many(self, model: str, dimensions: int, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """Store vectors, evicting least recently used entries beyond max_bytes."""
+        if self.max_bytes <= 0:
+            return
+
+        now = time.time()
+        rows = [
+            (cache_key(model, dimensions, text), np.ascontiguousarray(vector, dtype=np.float32).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)', rows
+            )
+            inserted = self._connection.total_changes - before
+            # Rows for one call share a model and size, so they are equally long
+            self._size_bytes += inserted * (len(rows[0][1]) if rows else 0)
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and cache size."""
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'by_purpose': {
+                purpose: {
+                    **counts,
+                    'hit_rate': counts['hits'] / (counts['hits'] + counts['misses'])
+                    if counts['hits'] + counts['misses'] else 0.0
+                }
+                for purpose, counts in self.purpose_counts.items()
+            },
+            'evictions': self.evictions,
+            'entries': entries,
+            'size_bytes': self._size_bytes,
+            'max_bytes': self.max_bytes
+        }
+
+    def clear(self) -> None:
+        """Remove every cached embedding."""
+        with self._lock:
+            self._connection.execute('DELETE FROM embeddings')
+            self._connection.commit()
+            self._size_bytes = 0
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries down to 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        while self._size_bytes > target:
+            rows = self._connection.execute(
+                'SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT ?', (_MAX_PARAMS,)
+            ).fetchall()
+            if not rows:
+                self._size_bytes = 0
+                return
+
+            evicted = []
+            for key, size in rows:
+                if self._size_bytes <= target:
+                    break
+                evicted.append((key,))
+                self._size_bytes -= size
+            self._connection.executemany('DELETE FROM embeddings WHERE key = ?', evicted)
+            self.evictions += len(evicted)
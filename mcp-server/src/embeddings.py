@@ -0,0 +1,327 @@
+"""
+Embeddings
+Embedding providers used to vectorise knowledge base chunks and queries.
+
+Providers pack texts into token-budgeted batches, send a bounded number of
+batch requests concurrently and retry transient failures with jittered
+exponential backoff. With an EmbeddingCache, only texts that have not been
+embedded before are sent.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+try:
+    from .chunking import get_tokenizer
+    from .embedding_cache import EmbeddingCache
+except ImportError:
+    from chunking import get_tokenizer
+    from embedding_cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+EMBEDDING_PROVIDERS = ('local', 'openai')
+
+DEFAULT_EMBEDDING_CONFIG = {
+    'provider': 'local',
+    'model': 'text-embedding-ada-002',
+    'dimensions': 1536,
+    'batch_size': 100,
+    # Well below the per-request token limit of hosted embedding APIs
+    'max_batch_tokens': 50000,
+    'max_concurrency': 4,
+    'timeout': 30,
+    'retry_count': 3
+}
+
+# Models that accept a `dimensions` request parameter
+_VARIABLE_DIMENSION_MODELS = ('text-embedding-3-small', 'text-embedding-3-large')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokenizer shared by the local embedding and lexical paths."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+@lru_cache(maxsize=65536)
+def _hash_token(token: str, dimensions: int) -> Tuple[int, float]:
+    """Map a token to a stable (bucket, sign) pair."""
+    digest = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest % dimensions, (1.0 if (digest >> 63) & 1 else -1.0)
+
+
+def pack_batches(token_counts: Sequence[int], max_items: int, max_tokens: int) -> List[Tuple[int, int]]:
+    """Split consecutive texts into [start, end) batches within both budgets.
+    
+    A text larger than max_tokens is sent on its own.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for position, count in enumerate(token_counts):
+        if position > start and (position - start >= max_items or tokens + count > max_tokens):
+            batches.append((start, position))
+            start = position
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+class EmbeddingRequestError(Exception):
+    """An embedding request failed; retryable failures are retried with backoff."""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class EmbeddingProvider:
+    """Base class for embedding providers.
+    
+    Subclasses implement _embed_batch for a single request; embed handles
+    batching, concurrency and retries.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        dimensions: int,
+        batch_size: int = 100,
+        max_batch_tokens: int = 50000,
+        max_concurrency: int = 4,
+        timeout: float = 30,
+        retry_count: int = 3,
+        backoff_base: float = 0.5,
+        max_backoff: float = 20.0,
+        cache: Optional[EmbeddingCache] = None
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = max(1, batch_size)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.retry_count = max(0, retry_count)
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'texts': 0, 'tokens': 0}
+
+    async def embed(
+        self,
+        texts: List[str],
+        token_counts: Optional[Sequence[int]] = None,
+        purpose: str = 'ingest'
+    ) -> np.ndarray:
+        """Embed texts into an (n, dimensions) float32 matrix.
+        
+        token_counts, when already known, avoids re-tokenizing the texts.
+        purpose ('ingest' or 'query') is recorded with the cache lookup.
+        """
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        if self.cache is None:
+            return await self._embed_uncached(texts, token_counts)
+
+        cached = await asyncio.to_thread(self.cache.get_many, self.model, self.dimensions, texts, purpose)
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        # Texts missing from the cache, each embedded once however often it repeats
+        missing: Dict[str, List[int]] = {}
+        for position, vector in enumerate(cached):
+            if vector is None:
+                missing.setdefault(texts[position], []).append(position)
+            else:
+                vectors[position] = vector
+
+        if missing:
+            pending = list(missing)
+            pending_counts = [token_counts[missing[text][0]] for text in pending] if token_counts else None
+            embedded = await self._embed_uncached(pending, pending_counts)
+            for text, vector in zip(pending, embedded):
+                vectors[missing[text]] = vector
+            await asyncio.to_thread(self.cache.put_many, self.model, self.dimensions, pending, embedded)
+
+        return vectors
+
+    async def _embed_uncached(self, texts: List[str], token_counts: Optional[Sequence[int]]) -> np.ndarray:
+        """Embed texts through the provider in batches."""
+        if token_counts is None:
+            token_counts = get_tokenizer(self.model).count_batch(texts)
+
+        batches = pack_batches(token_counts, self.batch_size, self.max_batch_tokens)
+        results = await asyncio.gather(*(
+            self._embed_with_retry(texts[start:end], sum(token_counts[start:end]))
+            for start, end in batches
+        ))
+        return results[0] if len(results) == 1 else np.concatenate(results)
+
+    async def close(self) -> None:
+        """Release provider resources."""
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch in a single request."""
+        raise NotImplementedError
+
+    async def _embed_with_retry(self, texts: List[str], token_count: int) -> np.ndarray:
+        """Send one batch, retrying transient failures with jittered backoff."""
+        for attempt in range(self.retry_count + 1):
+            try:
+                async with self._semaphore:
+                    self.stats['requests'] += 1
+                    vectors = await self._embed_batch(texts)
+            except EmbeddingRequestError as e:
+                if not e.retryable or attempt == self.retry_count:
+                    self.stats['failures'] += 1
+                    raise
+                delay = e.retry_after if e.retry_after is not None else self._backoff(attempt)
+                logger.warning(f"Embedding request failed ({e}); retrying in {delay:.2f}s")
+                self.stats['retries'] += 1
+                await asyncio.sleep(delay)
+                continue
+
+            if vectors.shape != (len(texts), self.dimensions):
+                self.stats['failures'] += 1
+                raise EmbeddingRequestError(
+                    f"Expected {len(texts)} x {self.dimensions} embeddings, got {vectors.shape}"
+                )
+            self.stats['texts'] += len(texts)
+            self.stats['tokens'] += token_count
+            return vectors
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff delay."""
+        return random.uniform(0, min(self.max_backoff, self.backoff_base * 2 ** attempt))
+
+
+class LocalHashEmbeddingProvider(EmbeddingProvider):
+    """Deterministic feature-hashing embedder that needs no network access.
+    
+    Stands in for a hosted model when running or benchmarking offline.
+    """
+
+    def __init__(self, dimensions: int = 1536, model: str = 'local-hash', **kwargs: Any):
+        super().__init__(model, dimensions, **kwargs)
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an (n, dimensions) float32 matrix of unit vectors."""
+        if len(texts) == 1:
+            return self.embed_sync(texts)
+        return await asyncio.to_thread(self.embed_sync, texts)
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        """Synchronous variant of embed for CPU-bound callers."""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                bucket, sign = _hash_token(token, self.dimensions)
+                matrix[row, bucket] += sign
+
+        # Sub-linear term frequency, then L2 normalisation
+        magnitudes = np.abs(matrix)
+        np.log1p(magnitudes, out=magnitudes)
+        matrix = np.sign(matrix) * magnitudes
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (matrix / norms).astype(np.float32, copy=False)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI-compatible embeddings API client sharing one pooled HTTP client."""
+
+    def __init__(
+        self,
+        model: str = 'text-embedding-ada-002',
+        dimensions: int = 1536,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        **kwargs: Any
+    ):
+        super().__init__(model, dimensions, **kwargs)
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
+        self.base_url = (base_url or os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')).rstrip('/')
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def close(self) -> None:
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, sized to the request concurrency."""
+        if self._client is None:
+            if not self.api_key:
+                raise EmbeddingRequestError('OPENAI_API_KEY is not configured')
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={'Authorization': f'Bearer {self.api_key}'},
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+        return self._client
+
+    async def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch with a single API request."""
+        payload: Dict[str, Any] = {'model': self.model, 'input': texts}
+        if self.model in _VARIABLE_DIMENSION_MODELS:
+            payload['dimensions'] = self.dimensions
+
+        try:
+            response = await self._get_client().post('/embeddings', json=payload)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise EmbeddingRequestError(f'{type(e).__name__}: {e}', retryable=True)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get('retry-after')
+            raise EmbeddingRequestError(
+                f'HTTP {response.status_code}',
+                retryable=True,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        if response.status_code != 200:
+            raise EmbeddingRequestError(f'HTTP {response.status_code}: {response.text[:200]}')
+
+        data = sorted(response.json()['data'], key=lambda item: item['index'])
+        return np.asarray([item['embedding'] for item in data], dtype=np.float32)
+
+
+def create_embedding_provider(
+    config: Dict[str, Any],
+    cache: Optional[EmbeddingCache] = None
+) -> EmbeddingProvider:
+    """Create the embedding provider described by an embedding config."""
+    config = {**DEFAULT_EMBEDDING_CONFIG, **config}
+    provider = config['provider']
+    settings = {
+        'cache': cache,
+        'batch_size': config['batch_size'],
+        'max_batch_tokens': config['max_batch_tokens'],
+        'max_concurrency': config['max_concurrency'],
+        'timeout': config['timeout'],
+        'retry_count': config['retry_count']
+    }
+
+    if provider == 'local':
+        return LocalHashEmbeddingProvider(config['dimensions'], **settings)
+    if provider == 'openai':
+        return OpenAIEmbeddingProvider(config['model'], config['dimensions'], **settings)
+    raise ValueError(f"Unsupported embedding provider: {provider}")
@@ -3,54 +3,181 @@ Knowledge Base Manager
 Handles document processing and vector database management for RAG.
 """
 
+import asyncio
+import bisect
 import hashlib
 import json
 import os
+import time
 import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import numpy as np
+
+try:
+    from .chunking import Chunk, TokenChunker, WordChunker, count_tokens_in_range, get_tokenizer
+    from .document_loaders import (
+        PDF_PAGES_PER_TASK, html_to_text, is_pdf, join_pages, load_file, load_pdf_pages, needs_process_pool,
+        pdf_page_count
+    )
+    from .embedding_cache import EmbeddingCache
+    from .embeddings import DEFAULT_EMBEDDING_CONFIG, EMBEDDING_PROVIDERS, EmbeddingProvider, create_embedding_provider
+    from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+    from .metadata_index import MetadataIndex
+    from .reranking import CallableReranker, LexicalReranker, Reranker, rerank_hits
+    from .retrieval_cache import RetrievalCache
+    from .retrieval_metrics import latency_percentiles, ranking_quality
+    from .vector_index import FlatVectorIndex, create_index
+    from .vector_store import ChunkTable, KnowledgeBaseStore
+    from .web_fetcher import HTML_CONTENT_TYPES, ResponseCache, WebFetcher
+except ImportError:
+    from chunking import Chunk, TokenChunker, WordChunker, count_tokens_in_range, get_tokenizer
+    from document_loaders import (
+        PDF_PAGES_PER_TASK, html_to_text, is_pdf, join_pages, load_file, load_pdf_pages, needs_process_pool,
+        pdf_page_count
+    )
+    from embedding_cache import EmbeddingCache
+    from embeddings import DEFAULT_EMBEDDING_CONFIG, EMBEDDING_PROVIDERS, EmbeddingProvider, create_embedding_provider
+    from lexical_index import LexicalIndex, reciprocal_rank_fusion
+    from metadata_index import MetadataIndex
+    from reranking import CallableReranker, LexicalReranker, Reranker, rerank_hits
+    from retrieval_cache import RetrievalCache
+    from retrieval_metrics import latency_percentiles, ranking_quality
+    from vector_index import FlatVectorIndex, create_index
+    from vector_store import ChunkTable, KnowledgeBaseStore
+    from web_fetcher import HTML_CONTENT_TYPES, ResponseCache, WebFetcher
+
+# Sentinel closing a pipeline queue
+_END_OF_STREAM = object()
+
+# similarity: vector search; keyword: BM25; hybrid: both, fused by reciprocal rank
+RETRIEVAL_STRATEGIES = ('similarity', 'keyword', 'hybrid')
+
+# Direct content is keyed by its hash; the text itself is stored once, in chunks.bin
+DIRECT_SOURCE_PREFIX = 'direct:'
+
+
+def direct_source(content: str) -> str:
+    """Source key of a direct-content document."""
+    return DIRECT_SOURCE_PREFIX + hashlib.md5(content.encode()).hexdigest()
+
+
+async def _run_stage(stage: Awaitable[None], downstream: asyncio.Queue) -> None:
+    """Run a pipeline stage, always closing its output queue.
+    
+    Failures are forwarded downstream so the consumer raises instead of
+    waiting forever.
+    """
+    try:
+        await stage
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await downstream.put(('failed', e))
+    await downstream.put(_END_OF_STREAM)
 
 class KnowledgeBaseManager:
     """Manages knowledge base creation and operations."""
     
-    def __init__(self):
+    def __init__(self, storage_dir: Optional[str] = None):
         self.knowledge_bases: Dict[str, Dict] = {}
         self.default_chunk_size = 1000
         self.default_overlap = 100
+        self.default_max_concurrency = 8
+        self.default_embedding_model = DEFAULT_EMBEDDING_CONFIG['model']
+        self.default_embedding_provider = os.getenv('EMBEDDING_PROVIDER', DEFAULT_EMBEDDING_CONFIG['provider'])
+        self.chunker = WordChunker()
+        self.token_chunker = TokenChunker()
+        
+        # Process pool for CPU-bound parsing, created on first use
+        self.parse_workers = int(os.getenv('KB_PARSE_WORKERS', os.cpu_count() or 1))
+        self._parse_executor: Optional[ProcessPoolExecutor] = None
+        
+        # On-disk knowledge bases, opened lazily with mmap
+        self.storage_dir = Path(storage_dir or os.getenv('KB_STORAGE_DIR', './kb_storage'))
+        self.store = KnowledgeBaseStore(self.storage_dir)
+        
+        # Vector indexes and the chunk records aligned with their rows
+        self.indexes: Dict[str, FlatVectorIndex] = {}
+        self.chunks: Dict[str, Sequence[Dict[str, Any]]] = {}
+        
+        # BM25 indexes over the same rows, opened on first keyword or hybrid search
+        self.lexical_indexes: Dict[str, LexicalIndex] = {}
+        
+        # Metadata posting lists for filtered retrieval, built on first filtered search
+        self.metadata_indexes: Dict[str, MetadataIndex] = {}
+        
+        # Second-stage rerankers by name; model hooks are added with register_reranker
+        self.rerankers: Dict[str, Reranker] = {LexicalReranker.name: LexicalReranker()}
+        self.rerank_stats = {'queries': 0, 'reranked': 0, 'fallbacks': 0, 'total_time': 0.0}
+        
+        # Recent search results, dropped per knowledge base when it changes
+        self.retrieval_cache = RetrievalCache(
+            max_entries=int(os.getenv('KB_RETRIEVAL_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('KB_RETRIEVAL_CACHE_TTL', '300'))
+        )
+        
+        # Embedding providers, shared by every knowledge base with the same settings
+        self.embedding_providers: Dict[str, EmbeddingProvider] = {}
+        
+        # Embeddings cached across knowledge bases, opened on first use
+        self.embedding_cache_bytes = int(float(os.getenv('KB_EMBEDDING_CACHE_MB', '1024')) * 1024 * 1024)
+        self._embedding_cache: Optional[EmbeddingCache] = None
+        
+        # Web sources share one pooled HTTP client and a conditional-request cache, opened on first use
+        self.web_max_connections = int(os.getenv('KB_WEB_MAX_CONNECTIONS', '32'))
+        self.web_per_host_limit = int(os.getenv('KB_WEB_PER_HOST_LIMIT', '4'))
+        self.web_http2 = os.getenv('KB_WEB_HTTP2', 'true').lower() not in ('0', 'false', 'no')
+        self.web_cache_bytes = int(float(os.getenv('KB_WEB_CACHE_MB', '256')) * 1024 * 1024)
+        self._web_fetcher: Optional[WebFetcher] = None
     
     async def process_documents(
         self,
-        document_sources: List[str],
-        options: Optional[Dict[str, Any]] = None
+        document_sources: Iterable[str],
+        options: Optional[Dict[str, Any]] = None,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[str, Any]:
         """Process documents and prepare them for knowledge base."""
         
         options = options or {}
         chunk_size = options.get('chunk_size', self.default_chunk_size)
         overlap = options.get('overlap', self.default_overlap)
+        embedding_config = self._embedding_settings(options)
+        tokenizer = get_tokenizer(embedding_config['model'])
         
         processed_documents = []
+        skipped_documents = []
+        deleted_documents = []
         total_chunks = 0
         total_tokens = 0
+        total_bytes = 0
+        reused_chunks = 0
         errors = []
+        kb_id = None
         
-        for source in document_sources:
-            try:
-                doc_result = await self._process_single_document(
-                    source, chunk_size, overlap
-                )
-                processed_documents.append(doc_result)
-                total_chunks += doc_result['chunk_count']
-                total_tokens += doc_result['token_count']
-            except Exception as e:
-                errors.append({
-                    'source': source,
-                    'error': str(e)
-                })
-        
-        # Create knowledge base ID
-        kb_id = str(uuid.uuid4())
+        async for event in self.stream_documents(document_sources, options):
+            kb_id = event['knowledge_base_id']
+            if event['event'] == 'document':
+                processed_documents.append(event['document'])
+                total_chunks += event['document']['chunk_count']
+                total_tokens += event['document']['token_count']
+                total_bytes += event['document']['size_bytes']
+                reused_chunks += event['document']['reused_chunks']
+            elif event['event'] == 'skipped':
+                skipped_documents.append(event['document'])
+                total_bytes += event['document']['size_bytes']
+            elif event['event'] == 'deleted':
+                deleted_documents.append(event['document'])
+            elif event['event'] == 'error':
+                errors.append(event['error'])
+            
+            if progress_callback:
+                progress_callback(event)
         
         result = {
             'knowledge_base_id': kb_id,
@@ -59,16 +186,277 @@ class KnowledgeBaseManager:
             'total_tokens': total_tokens,
             'processed_documents': processed_documents,
             'errors': errors,
+            'added_count': sum(1 for document in processed_documents if document['status'] == 'added'),
+            'updated_count': sum(1 for document in processed_documents if document['status'] == 'updated'),
+            'skipped_count': len(skipped_documents),
+            'deleted_count': len(deleted_documents),
+            'embedded_chunks': total_chunks - reused_chunks,
+            'reused_chunks': reused_chunks,
+            'knowledge_base_size': {
+                'document_count': len(processed_documents) + len(skipped_documents),
+                'total_size_mb': total_bytes / (1024 * 1024),
+                'estimated_tokens': total_tokens + sum(document['token_count'] for document in skipped_documents)
+            },
+            'embedding_cache': self.get_embedding_cache_stats(),
+            'web_fetch': self.get_web_fetch_stats(),
             'embedding_config': {
-                'model': 'text-embedding-ada-002',
-                'dimensions': 1536,
+                **embedding_config,
                 'chunk_size': chunk_size,
-                'overlap': overlap
+                'overlap': overlap,
+                'chunk_unit': options.get('chunk_unit', 'words'),
+                'token_count_method': 'tiktoken' if tokenizer.exact else 'approximate'
             }
         }
         
         return result
     
+    async def stream_documents(
+        self,
+        document_sources: Iterable[str],
+        options: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream documents through read -> chunk -> embed -> index stages.
+        
+        Stages are connected by bounded queues, so a slow stage applies
+        back-pressure upstream and only a few batches are in memory at once.
+        Chunks are embedded with the provider described by the embedding
+        options (see _embedding_settings), with up to max_concurrency batches
+        in flight. Embedded chunks are appended to the knowledge base's staging area and
+        indexed by create_knowledge_base. Yields 'document', 'error' and
+        'batch' progress events, then a final 'complete' event.
+        
+        document_sources may be any iterable, e.g. a generator over a large
+        corpus; it is consumed once.
+        
+        Documents are tokenized with the embedding model's tokenizer; with
+        chunk_unit='tokens', chunk_size and overlap count tokens, not words.
+        
+        With options['knowledge_base_id'] naming a stored knowledge base, the
+        run is an incremental sync: documents whose content hash is unchanged
+        are skipped ('skipped' events), only chunks not already indexed are
+        embedded, and documents missing from document_sources are tombstoned
+        ('deleted' events) unless remove_missing is False. The changes are
+        applied to the index before the 'complete' event.
+        """
+        
+        options = options or {}
+        chunk_size = options.get('chunk_size', self.default_chunk_size)
+        overlap = options.get('overlap', self.default_overlap)
+        queue_size = options.get('queue_size', 4)
+        max_concurrency = max(1, options.get('max_concurrency', self.default_max_concurrency))
+        chunk_unit = options.get('chunk_unit', 'words')
+        if chunk_unit not in ('words', 'tokens'):
+            raise ValueError(f"Unsupported chunk_unit: {chunk_unit}")
+        
+        kb_id = options.get('knowledge_base_id')
+        known_documents: Dict[str, Dict[str, Any]] = {}
+        if kb_id:
+            await self._ensure_loaded(kb_id)
+            if kb_id not in self.indexes:
+                raise ValueError(f"Knowledge base {kb_id} not found")
+            # New chunks must be embedded like the ones already indexed
+            indexed_config = self.knowledge_bases[kb_id]['embedding_config']
+            embedding_config = self._embedding_settings(options, indexed_config)
+            embedding_config.update({key: indexed_config[key] for key in ('provider', 'model') if key in indexed_config})
+            embedding_config['dimensions'] = self.indexes[kb_id].dimensions
+            known_documents = await asyncio.to_thread(self.store.read_documents, kb_id)
+        else:
+            kb_id = str(uuid.uuid4())
+            embedding_config = self._embedding_settings(options)
+        
+        batch_size = embedding_config['batch_size']
+        tokenizer = get_tokenizer(embedding_config['model'])
+        embedder = self._get_embedder(embedding_config)
+        writer = await asyncio.to_thread(self.store.open_staging, kb_id, embedding_config['dimensions'])
+        writer.embedding_config = embedding_config
+        
+        documents: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        batches: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        embedded: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        
+        pending_sources = iter(document_sources)
+        # Sources are consumed once, so a sync remembers them to find removed documents
+        seen_sources: set = set()
+        
+        async def read_worker() -> None:
+            # Workers share one iterator, so at most max_concurrency reads are in flight
+            for source in pending_sources:
+                if known_documents:
+                    seen_sources.add(source)
+                try:
+                    document = await self._read_document(source)
+                except Exception as e:
+                    await documents.put(('error', {'source': source, 'error': str(e)}))
+                    continue
+                if known_documents:
+                    seen_sources.add(document['source'])
+                await documents.put(('document', document))
+        
+        async def read() -> None:
+            # Sources of unknown length, e.g. generators, get every worker
+            sized = hasattr(document_sources, '__len__')
+            worker_count = (min(max_concurrency, len(document_sources)) if sized else max_concurrency) or 1
+            await asyncio.gather(*(read_worker() for _ in range(worker_count)))
+        
+        async def chunk() -> None:
+            batch: List[Chunk] = []
+            staged_count = 0
+            finished = False
+            while not finished:
+                # Tokenize every document that is already waiting in one batch
+                ready = [await documents.get()]
+                while not documents.empty():
+                    ready.append(documents.get_nowait())
+                finished = ready[-1] is _END_OF_STREAM
+                if finished:
+                    ready.pop()
+                
+                for kind, payload in ready:
+                    if kind == 'document' and 'content_hash' not in payload:
+                        payload['content_hash'] = self._content_hash(payload['content'])
+                
+                changed = [
+                    payload for kind, payload in ready
+                    if kind == 'document' and not self._is_unchanged(payload, known_documents)
+                ]
+                token_starts = await asyncio.to_thread(
+                    tokenizer.token_starts_batch, [payload['content'] for payload in changed]
+                )
+                starts_by_document = {id(payload): starts for payload, starts in zip(changed, token_starts)}
+                
+                for kind, payload in ready:
+                    if kind == 'document' and id(payload) not in starts_by_document:
+                        previous = known_documents[payload['source']]
+                        await batches.put(('skipped', self._summarize_document(
+                            payload, len(previous['rows']), previous['token_count'], status='unchanged'
+                        )))
+                        continue
+                    
+                    if kind == 'document':
+                        starts = starts_by_document[id(payload)]
+                        chunks = self._chunk_text(
+                            payload['content'], chunk_size, overlap,
+                            source=payload['source'], source_type=payload['source_type'],
+                            token_starts=starts if chunk_unit == 'tokens' else None,
+                            page_starts=payload.get('page_starts')
+                        )
+                        
+                        # Chunks whose content is already indexed keep their rows
+                        previous = known_documents.get(payload['source'])
+                        reusable = self._indexed_chunk_rows(kb_id, previous['rows']) if previous else {}
+                        kept_rows = []
+                        staged_start = staged_count
+                        for chunk_record in chunks:
+                            if reusable.get(chunk_record.id):
+                                kept_rows.append(reusable[chunk_record.id].pop())
+                                continue
+                            if chunk_record.token_count is None:
+                                chunk_record.token_count = count_tokens_in_range(
+                                    starts, chunk_record.start, chunk_record.end
+                                )
+                            batch.append(chunk_record)
+                            staged_count += 1
+                            if len(batch) >= batch_size:
+                                await batches.put(('batch', batch))
+                                batch = []
+                        
+                        summary = self._summarize_document(
+                            payload, len(chunks), len(starts),
+                            status='updated' if previous else 'added',
+                            reused_chunks=len(kept_rows)
+                        )
+                        payload = (summary, {
+                            'content_hash': summary['content_hash'],
+                            'token_count': summary['token_count'],
+                            'modified_at': summary['modified_at'],
+                            'kept_rows': kept_rows,
+                            'staged': [staged_start, staged_count]
+                        })
+                    await batches.put((kind, payload))
+            if batch:
+                await batches.put(('batch', batch))
+        
+        async def embed() -> None:
+            # Batches are embedded concurrently but forwarded in order
+            in_flight: deque = deque()
+            
+            async def forward(limit: int) -> None:
+                while len(in_flight) > limit or (in_flight and in_flight[0][2] is None):
+                    kind, payload, request = in_flight.popleft()
+                    if request is not None:
+                        payload = (payload, await request)
+                    await embedded.put((kind, payload))
+            
+            try:
+                while (item := await batches.get()) is not _END_OF_STREAM:
+                    kind, payload = item
+                    request = None
+                    if kind == 'batch':
+                        request = asyncio.create_task(embedder.embed(
+                            [chunk_record.text for chunk_record in payload],
+                            [chunk_record.token_count for chunk_record in payload]
+                        ))
+                    in_flight.append((kind, payload, request))
+                    await forward(embedder.max_concurrency)
+                await forward(0)
+            finally:
+                for _, _, request in in_flight:
+                    if request is not None:
+                        request.cancel()
+        
+        stages = [
+            asyncio.create_task(_run_stage(read(), documents)),
+            asyncio.create_task(_run_stage(chunk(), batches)),
+            asyncio.create_task(_run_stage(embed(), embedded))
+        ]
+        
+        document_count = 0
+        chunks_indexed = 0
+        token_count = 0
+        remove_missing = options.get('remove_missing', True)
+        try:
+            while (item := await embedded.get()) is not _END_OF_STREAM:
+                kind, payload = item
+                if kind == 'failed':
+                    raise payload
+                if kind == 'batch':
+                    chunk_records, vectors = payload
+                    await asyncio.to_thread(writer.append, chunk_records, vectors)
+                    chunks_indexed += len(chunk_records)
+                    yield {'knowledge_base_id': kb_id, 'event': 'batch', 'chunks_indexed': chunks_indexed,
+                           'documents_processed': document_count}
+                elif kind == 'document':
+                    summary, record = payload
+                    writer.add_document(summary['source'], record)
+                    document_count += 1
+                    token_count += summary['token_count']
+                    yield {'knowledge_base_id': kb_id, 'event': 'document', 'document': summary}
+                elif kind == 'skipped':
+                    yield {'knowledge_base_id': kb_id, 'event': 'skipped', 'document': payload}
+                else:
+                    yield {'knowledge_base_id': kb_id, 'event': 'error', 'error': payload}
+            
+            if remove_missing:
+                for source in known_documents.keys() - seen_sources:
+                    writer.remove_document(source)
+                    yield {'knowledge_base_id': kb_id, 'event': 'deleted',
+                           'document': {'source': source, 'status': 'deleted',
+                                        'chunk_count': len(known_documents[source]['rows'])}}
+            
+            await asyncio.to_thread(writer.close, document_count, token_count)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            for stage in stages:
+                stage.cancel()
+        
+        if options.get('knowledge_base_id'):
+            await self._apply_staged_update(kb_id)
+        
+        yield {'knowledge_base_id': kb_id, 'event': 'complete', 'chunks_indexed': chunks_indexed,
+               'documents_processed': document_count}
+    
     async def create_knowledge_base(
         self,
         config: Dict[str, Any]
@@ -76,33 +464,51 @@ class KnowledgeBaseManager:
         """Create vector database and configure knowledge base."""
         
         kb_id = config.get('knowledge_base_id', str(uuid.uuid4()))
+        await self._ensure_loaded(kb_id)
+        previous_config = self.knowledge_bases.get(kb_id, {})
+        staged = self.store.read_staging(kb_id) if self.store.has_staging(kb_id) else None
         
         # Vector store configuration
         vector_store_config = {
             'type': config.get('vector_store_type', 'chromadb'),
-            'persist_directory': f'./kb_storage/{kb_id}',
+            'persist_directory': str(self.store.path(kb_id)),
             'collection_name': f'kb_{kb_id}',
             'distance_metric': config.get('distance_metric', 'cosine')
         }
         
-        # Embedding configuration
-        embedding_config = {
-            'model': config.get('embedding_model', 'text-embedding-ada-002'),
-            'dimensions': config.get('dimensions', 1536),
-            'batch_size': config.get('batch_size', 100)
-        }
+        # Embedding configuration; existing vectors pin the provider, model and size
+        pinned = staged.get('embedding_config') if staged else (
+            previous_config.get('embedding_config') if kb_id in self.indexes else None
+        )
+        embedding_config = self._embedding_settings(config, pinned or previous_config.get('embedding_config'))
+        if pinned:
+            embedding_config.update({key: pinned[key] for key in ('provider', 'model', 'dimensions') if key in pinned})
+        if staged:
+            embedding_config['dimensions'] = staged['dimensions']
         
-        # Retrieval configuration
+        # Retrieval configuration; agent template rag_config names are accepted too
+        strategy = config.get('strategy', config.get(
+            'retrieval_strategy', previous_config.get('retrieval_config', {}).get('retrieval_strategy', 'similarity')
+        ))
+        if strategy not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Unsupported retrieval strategy: {strategy}")
         retrieval_config = {
-            'similarity_top_k': config.get('top_k', 5),
-            'similarity_threshold': config.get('threshold', 0.7),
-            'retrieval_strategy': config.get('strategy', 'similarity'),
-            'rerank': config.get('rerank', False)
+            'similarity_top_k': config.get('top_k', config.get('similarity_top_k', 5)),
+            'similarity_threshold': config.get('threshold', config.get('similarity_threshold', 0.7)),
+            'retrieval_strategy': strategy,
+            'rrf_k': config.get('rrf_k', 60),
+            'semantic_cache_distance': config.get('semantic_cache_distance', 0.0),
+            'rerank': config.get('rerank', config.get('reranking', False)),
+            'reranker': config.get('reranker', 'lexical'),
+            'rerank_candidates': config.get('rerank_candidates', 20),
+            'rerank_budget_ms': config.get('rerank_budget_ms', 50),
+            'index_type': config.get('index_type', 'auto'),
+            'nlist': config.get('nlist'),
+            'nprobe': config.get('nprobe', 8),
+            'quantization': config.get('quantization', 'float32'),
+            'rerank_factor': config.get('rerank_factor', 4)
         }
         
-        # Create storage directory
-        os.makedirs(vector_store_config['persist_directory'], exist_ok=True)
-        
         # Store knowledge base configuration
         kb_config = {
             'id': kb_id,
@@ -114,14 +520,31 @@ class KnowledgeBaseManager:
         }
         
         self.knowledge_bases[kb_id] = kb_config
+        # Cached results may depend on the previous index or retrieval settings
+        self.retrieval_cache.invalidate(kb_id)
         
-        # Mock index stats (in real implementation, would come from vector store)
-        index_stats = {
-            'document_count': 0,
-            'chunk_count': 0,
-            'index_size': '0 MB',
-            'embedding_model': embedding_config['model']
-        }
+        # Index the chunks staged by process_documents
+        if staged or kb_id not in self.indexes:
+            if not staged:
+                writer = await asyncio.to_thread(self.store.open_staging, kb_id, embedding_config['dimensions'])
+                await asyncio.to_thread(writer.close, 0)
+                staged = self.store.read_staging(kb_id)
+            
+            self.indexes[kb_id] = await self._build_index(kb_id, vector_store_config['distance_metric'], retrieval_config)
+            self.lexical_indexes.pop(kb_id, None)
+            self.metadata_indexes.pop(kb_id, None)
+            self.chunks[kb_id] = ChunkTable(self.store.path(kb_id))
+            kb_config['document_count'] = staged['document_count']
+            kb_config['token_count'] = staged.get('token_count', 0)
+        else:
+            kb_config['document_count'] = previous_config.get('document_count', 0)
+            kb_config['token_count'] = previous_config.get('token_count', 0)
+            kb_config['estimated_recall'] = previous_config.get('estimated_recall', 1.0)
+        
+        kb_config['status'] = 'ready'
+        index_stats = self._get_index_stats(kb_id)
+        kb_config['index_stats'] = index_stats
+        await asyncio.to_thread(self.store.write_manifest, kb_id, kb_config, self.indexes[kb_id])
         
         return {
             'knowledge_base_id': kb_id,
@@ -135,10 +558,40 @@ class KnowledgeBaseManager:
         self,
         config: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Configure embedding strategy."""
+        """Configure embedding strategy.
+        
+        Costs are estimated from the token count recorded for
+        knowledge_base_id when one is given, or from estimated_tokens.
+        With knowledge_base_id, the request settings (batching, concurrency,
+        timeout, retries) are also applied to that knowledge base; the
+        returned config can be passed to process_documents as
+        options['embedding_config'].
+        """
+        
+        kb_id = config.get('knowledge_base_id')
+        if kb_id:
+            await self._ensure_loaded(kb_id)
+        kb_config = self.knowledge_bases.get(kb_id) if kb_id else None
+        
+        settings = self._embedding_settings(
+            {
+                'embedding_config': config.get('embedding_config', {}),
+                'embedding_provider': config.get('provider'),
+                'embedding_model': config.get('model'),
+                'embedding_concurrency': config.get('max_concurrency'),
+                **{key: config.get(key) for key in ('dimensions', 'batch_size', 'max_batch_tokens', 'timeout', 'retry_count')}
+            },
+            kb_config['embedding_config'] if kb_config else None
+        )
+        if kb_config:
+            # Existing vectors pin the provider, model and size
+            for key in ('provider', 'model', 'dimensions'):
+                settings[key] = kb_config['embedding_config'].get(key, settings[key])
+            kb_config['embedding_config'] = settings
+            await asyncio.to_thread(self.store.update_config, kb_id, kb_config)
         
-        model = config.get('model', 'text-embedding-ada-002')
-        dimensions = config.get('dimensions', 1536)
+        model = settings['model']
+        dimensions = settings['dimensions']
         
         # Cost estimation
         cost_per_token = {
@@ -147,19 +600,30 @@ class KnowledgeBaseManager:
             'text-embedding-3-large': 0.00013
         }.get(model, 0.0001)
         
-        estimated_tokens = config.get('estimated_tokens', 10000)
-        estimated_total_cost = estimated_tokens * cost_per_token / 1000  # Per 1K tokens
+        estimated_tokens = config.get('estimated_tokens')
+        if estimated_tokens is None and kb_config:
+            estimated_tokens = kb_config.get('token_count')
+        if estimated_tokens is None:
+            estimated_tokens = 10000
+        
+        uncached_cost = estimated_tokens * cost_per_token / 1000  # Per 1K tokens
+        
+        # Chunks already in the embedding cache are not billed again. Only
+        # ingestion lookups predict that; query embeddings are excluded.
+        cache_stats = self.get_embedding_cache_stats()
+        ingest_hit_rate = cache_stats['by_purpose']['ingest']['hit_rate'] if cache_stats['enabled'] else 0.0
+        estimated_total_cost = uncached_cost * (1 - ingest_hit_rate)
         
         result = {
             'model': model,
             'dimensions': dimensions,
             'cost_per_token': cost_per_token,
+            'estimated_tokens': estimated_tokens,
             'estimated_total_cost': estimated_total_cost,
-            'config': {
-                'batch_size': config.get('batch_size', 100),
-                'timeout': config.get('timeout', 30),
-                'retry_count': config.get('retry_count', 3)
-            }
+            'estimated_cost_without_cache': uncached_cost,
+            'ingest_cache_hit_rate': ingest_hit_rate,
+            'cache_stats': cache_stats,
+            'config': settings
         }
         
         return result
@@ -172,46 +636,108 @@ class KnowledgeBaseManager:
     ) -> Dict[str, Any]:
         """Test knowledge base retrieval with sample queries."""
         
+        await self._ensure_loaded(knowledge_base_id)
         if knowledge_base_id not in self.knowledge_bases:
             raise ValueError(f"Knowledge base {knowledge_base_id} not found")
         
         config = config or {}
-        top_k = config.get('top_k', 5)
+        retrieval_config = self.knowledge_bases[knowledge_base_id]['retrieval_config']
+        top_k = config.get('top_k', config.get('similarity_top_k', retrieval_config['similarity_top_k']))
+        threshold = config.get('threshold', config.get('similarity_threshold', retrieval_config['similarity_threshold']))
         
-        # Mock retrieval results (in real implementation, would query vector store)
-        test_results = []
+        nprobe = config.get('nprobe', retrieval_config.get('nprobe'))
+        strategy = config.get('strategy', config.get('retrieval_strategy'))
+        filters = config.get('filters')
+        rerank = config.get('rerank', config.get('reranking'))
+        labels = self._relevance_labels(test_queries, config.get('relevant_chunk_ids'))
         
-        for query in test_queries:
-            mock_results = [
-                {
-                    'content': f'Mock relevant content for query: {query}',
-                    'score': 0.85,
-                    'source': 'document_1.pdf',
-                    'page': 1
-                },
-                {
-                    'content': f'Additional context for: {query}',
-                    'score': 0.78,
-                    'source': 'document_2.pdf',
-                    'page': 3
-                }
-            ]
-            
-            test_results.append({
+        index = self.indexes[knowledge_base_id]
+        vector_before = dict(index.scan_stats)
+        lexical_before = self._lexical_scan_stats(knowledge_base_id)
+        cache_before = self.retrieval_cache.stats()
+        rerank_before = self.get_rerank_stats()
+        
+        # Queries run one at a time so each wall time is what a caller sees;
+        # 'batch' scores them together and reports the amortised time instead
+        search_params = {'nprobe': nprobe, 'strategy': strategy, 'filters': filters, 'rerank': rerank}
+        latencies = []
+        started = time.perf_counter()
+        if config.get('batch'):
+            batch_results = await self.search_batch(knowledge_base_id, test_queries, top_k, threshold, **search_params)
+            latencies = [(time.perf_counter() - started) / max(len(test_queries), 1)] * len(test_queries)
+        else:
+            batch_results = []
+            for query in test_queries:
+                query_started = time.perf_counter()
+                batch_results.append(await self.search(knowledge_base_id, query, top_k, threshold, **search_params))
+                latencies.append(time.perf_counter() - query_started)
+        total_time = time.perf_counter() - started
+        
+        vector_after = index.scan_stats
+        lexical_after = self._lexical_scan_stats(knowledge_base_id)
+        cache_after = self.retrieval_cache.stats()
+        rerank_after = self.get_rerank_stats()
+        reranked_queries = rerank_after['queries'] - rerank_before['queries']
+        
+        test_results = []
+        for query, results, latency, relevant in zip(test_queries, batch_results, latencies, labels):
+            result = {
                 'query': query,
-                'results': mock_results[:top_k],
-                'result_count': len(mock_results[:top_k]),
-                'avg_score': sum(r['score'] for r in mock_results[:top_k]) / len(mock_results[:top_k]) if mock_results[:top_k] else 0
-            })
+                'results': results,
+                'result_count': len(results),
+                'avg_score': sum(r['score'] for r in results) / len(results) if results else 0,
+                'response_time': latency
+            }
+            if relevant is not None:
+                result['relevance'] = ranking_quality([r['chunk_id'] for r in results], relevant, top_k)
+            test_results.append(result)
         
         # Performance metrics
+        all_scores = [r['score'] for result in test_results for r in result['results']]
+        answered = sum(1 for result in test_results if result['results'])
+        vector_queries = vector_after['queries'] - vector_before['queries']
+        rows_scanned = vector_after['rows_scanned'] - vector_before['rows_scanned']
+        cache_hits = (cache_after['hits'] + cache_after['semantic_hits']) - (cache_before['hits'] + cache_before['semantic_hits'])
+        cache_lookups = cache_hits + cache_after['misses'] - cache_before['misses']
         metrics = {
-            'avg_response_time': 0.25,  # seconds
-            'avg_relevance_score': 0.82,
-            'coverage_percentage': 95.0,
+            'avg_response_time': total_time / len(test_queries) if test_queries else 0,  # seconds
+            'total_response_time': total_time,
+            'latency': {
+                'mode': 'batch' if config.get('batch') else 'per_query',
+                **latency_percentiles(latencies)
+            },
+            'index_scans': {
+                'vector_queries': vector_queries,
+                'rows_scanned': rows_scanned,
+                'rows_rescored': vector_after['rows_rescored'] - vector_before['rows_rescored'],
+                'avg_rows_scanned': rows_scanned / vector_queries if vector_queries else 0,
+                'scan_fraction': rows_scanned / (vector_queries * len(index)) if vector_queries and len(index) else 0,
+                'lexical_queries': lexical_after['queries'] - lexical_before['queries'],
+                'postings_scanned': lexical_after['postings_scanned'] - lexical_before['postings_scanned']
+            },
+            'cache_hit_rate': cache_hits / cache_lookups if cache_lookups else 0.0,
+            'retrieval_cache': cache_after,
+            'rerank_time': rerank_after['total_time'] - rerank_before['total_time'],  # seconds
+            'avg_rerank_time': (
+                (rerank_after['total_time'] - rerank_before['total_time']) / reranked_queries if reranked_queries else 0
+            ),
+            'rerank_fallbacks': rerank_after['fallbacks'] - rerank_before['fallbacks'],
+            'avg_relevance_score': sum(all_scores) / len(all_scores) if all_scores else 0,
+            'coverage_percentage': 100.0 * answered / len(test_queries) if test_queries else 0,
             'total_queries_tested': len(test_queries)
         }
         
+        # Ranking quality against labeled relevant chunks
+        labeled = [result['relevance'] for result in test_results if 'relevance' in result]
+        if labeled:
+            metrics['relevance'] = {
+                'labeled_queries': len(labeled),
+                'k': top_k,
+                'recall_at_k': sum(quality['recall_at_k'] for quality in labeled) / len(labeled),
+                'mrr': sum(quality['reciprocal_rank'] for quality in labeled) / len(labeled),
+                'ndcg_at_k': sum(quality['ndcg_at_k'] for quality in labeled) / len(labeled)
+            }
+        
         # Quality assessment
         quality_score = sum(result['avg_score'] for result in test_results) / len(test_results) if test_results else 0
         
@@ -222,76 +748,668 @@ class KnowledgeBaseManager:
             'Add more diverse test queries for comprehensive evaluation'
         ]
         
+        if metrics['coverage_percentage'] < 100:
+            suggestions.insert(0, 'Some queries returned no results - consider lowering the similarity threshold')
+        
+        relevance = metrics.get('relevance')
+        if relevance and relevance['recall_at_k'] < 0.8:
+            missed_by_threshold = any(
+                result['result_count'] < top_k and result['relevance']['recall_at_k'] < 1.0
+                for result in test_results if 'relevance' in result
+            )
+            suggestions.insert(0, (
+                f"Recall@{top_k} on labeled queries is {relevance['recall_at_k']:.0%} - "
+                + ('lower similarity_threshold' if missed_by_threshold else 'increase top_k or try the hybrid strategy')
+            ))
+        
+        # Approximate-vs-exact recall report
+        recall_report = await self._measure_recall(
+            knowledge_base_id,
+            test_queries,
+            top_k,
+            config.get('nprobe_sweep') or [nprobe]
+        )
+        
+        if metrics['rerank_fallbacks']:
+            suggestions.insert(0, 'Reranking exceeded its latency budget - raise rerank_budget_ms or lower rerank_candidates')
+        
+        if recall_report['approximate'] and recall_report['recall_at_k'] < 0.9:
+            suggestions.insert(0, 'Approximate index recall is below 90% - increase nprobe')
+        
         return {
             'results': test_results,
             'metrics': metrics,
+            'recall_report': recall_report,
             'quality_score': quality_score,
             'suggestions': suggestions
         }
     
-    async def _process_single_document(
+    @staticmethod
+    def _relevance_labels(queries: List[str], labeled: Any) -> List[Optional[List[str]]]:
+        """Relevant chunk IDs per query, from a list aligned with queries or a dict keyed by query."""
+        if not labeled:
+            return [None] * len(queries)
+        if isinstance(labeled, dict):
+            return [labeled.get(query) for query in queries]
+        if len(labeled) != len(queries):
+            raise ValueError("relevant_chunk_ids must have one entry per test query")
+        return list(labeled)
+    
+    def _lexical_scan_stats(self, kb_id: str) -> Dict[str, int]:
+        """Scan counters of a knowledge base's lexical index, zero when not built."""
+        lexical = self.lexical_indexes.get(kb_id)
+        return dict(lexical.scan_stats) if lexical else {'queries': 0, 'postings_scanned': 0}
+    
+    async def search(
         self,
-        source: str,
-        chunk_size: int,
-        overlap: int
+        knowledge_base_id: str,
+        query: str,
+        top_k: int = 5,
+        threshold: Optional[float] = None,
+        nprobe: Optional[int] = None,
+        strategy: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        rerank: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """Search a knowledge base for chunks relevant to the query.
+        
+        strategy overrides the knowledge base's retrieval_strategy. The
+        similarity threshold applies to vector scores only: keyword hits are
+        ranked by BM25, and hybrid hits by the reciprocal rank fusion of both
+        rankings, so exact term matches are kept even with a low similarity.
+        
+        filters restrict the rows searched (see metadata_index); they are
+        applied before scoring, so top_k is filled from matching chunks.
+        
+        rerank overrides retrieval_config['rerank']: the top
+        rerank_candidates hits are re-scored by the configured reranker
+        (see reranking) within rerank_budget_ms, keeping the retrieval
+        order when the budget is exceeded.
+        """
+        results = await self.search_batch(
+            knowledge_base_id, [query], top_k, threshold, nprobe=nprobe, strategy=strategy, filters=filters,
+            rerank=rerank
+        )
+        return results[0]
+    
+    async def search_batch(
+        self,
+        knowledge_base_id: str,
+        queries: List[str],
+        top_k: int = 5,
+        threshold: Optional[float] = None,
+        nprobe: Optional[int] = None,
+        strategy: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        rerank: Optional[bool] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Search a knowledge base for several queries at once (see search).
+        
+        All queries are embedded in one request and scored against the index
+        with one matrix-matrix product per block of vectors. Returns the hits
+        of each query in order.
+        
+        Results are served from the retrieval cache when the same query text
+        was searched with the same parameters, or, with the knowledge base's
+        semantic_cache_distance > 0, when a cached query's embedding is within
+        that cosine distance. The cache is cleared whenever the knowledge base
+        changes.
+        """
+        
+        await self._ensure_loaded(knowledge_base_id)
+        if knowledge_base_id not in self.indexes:
+            raise ValueError(f"Knowledge base {knowledge_base_id} not found")
+        
+        retrieval_config = self.knowledge_bases[knowledge_base_id]['retrieval_config']
+        strategy = strategy or retrieval_config.get('retrieval_strategy', 'similarity')
+        if strategy not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Unsupported retrieval strategy: {strategy}")
+        
+        if rerank is None:
+            rerank = retrieval_config.get('rerank', False)
+        # Resolve nprobe so equivalent searches share cache entries
+        index = self.indexes[knowledge_base_id]
+        nprobe = (nprobe or getattr(index, 'nprobe', None)) if index.is_approximate else None
+        scope = RetrievalCache.scope(
+            top_k=top_k, threshold=threshold, nprobe=nprobe, strategy=strategy, filters=filters,
+            rerank=retrieval_config.get('reranker', 'lexical') if rerank else None
+        )
+        results: List[Optional[List[Dict[str, Any]]]] = [
+            self.retrieval_cache.get(knowledge_base_id, scope, query) for query in queries
+        ]
+        pending = [position for position, hits in enumerate(results) if hits is None]
+        if not pending:
+            return results
+        
+        query_vectors = None
+        if strategy != 'keyword':
+            embedder = self._get_embedder(self.knowledge_bases[knowledge_base_id]['embedding_config'])
+            query_vectors = await embedder.embed([queries[position] for position in pending], purpose='query')
+            
+            max_distance = retrieval_config.get('semantic_cache_distance', 0.0)
+            if max_distance > 0:
+                missed = []
+                for position, vector in zip(pending, query_vectors):
+                    results[position] = self.retrieval_cache.get_similar(knowledge_base_id, scope, vector, max_distance)
+                    if results[position] is None:
+                        missed.append(position)
+                query_vectors = query_vectors[[pending.index(position) for position in missed]]
+                pending = missed
+        
+        self.retrieval_cache.record_miss(len(pending))
+        if pending:
+            searched = await self._search_index(
+                knowledge_base_id, [queries[position] for position in pending], query_vectors,
+                top_k, threshold, nprobe, strategy, filters, rerank
+            )
+            for offset, (position, hits) in enumerate(zip(pending, searched)):
+                results[position] = hits
+                self.retrieval_cache.put(
+                    knowledge_base_id, scope, queries[position], hits,
+                    query_vectors[offset] if query_vectors is not None else None
+                )
+        return results
+    
+    async def _search_index(
+        self,
+        knowledge_base_id: str,
+        queries: List[str],
+        query_vectors: Optional[np.ndarray],
+        top_k: int,
+        threshold: Optional[float],
+        nprobe: Optional[int],
+        strategy: str,
+        filters: Optional[Dict[str, Any]],
+        rerank: bool
+    ) -> List[List[Dict[str, Any]]]:
+        """Run a batch of embedded queries against a knowledge base's indexes."""
+        
+        retrieval_config = self.knowledge_bases[knowledge_base_id]['retrieval_config']
+        index = self.indexes[knowledge_base_id]
+        chunks = self.chunks[knowledge_base_id]
+        # Fused rankings look deeper than top_k so either side can promote a hit
+        depth = top_k if strategy == 'similarity' else max(top_k * 4, 20)
+        if rerank:
+            depth = max(depth, retrieval_config.get('rerank_candidates', 20))
+        
+        deleted = index.tombstones if index.deleted_count else None
+        allowed = None
+        if filters:
+            metadata = await self._get_metadata_index(knowledge_base_id)
+            allowed = metadata.evaluate(filters, deleted)
+            if not allowed.any():
+                return [[] for _ in queries]
+        
+        vector_hits: List[List[Tuple[int, float]]] = [[] for _ in queries]
+        if query_vectors is not None:
+            search_params = {'nprobe': nprobe} if index.is_approximate and nprobe else {}
+            vector_hits = index.search_batch(query_vectors, depth, threshold, allowed=allowed, **search_params)
+        
+        if strategy == 'similarity':
+            results = [[self._format_hit(chunks[row], score) for row, score in hits] for hits in vector_hits]
+        else:
+            lexical = await self._get_lexical_index(knowledge_base_id)
+            excluded = deleted if allowed is None else ~allowed
+            lexical_hits = [lexical.search(query, depth, excluded) for query in queries]
+        
+        if strategy == 'keyword':
+            results = [[self._format_hit(chunks[row], score) for row, score in hits] for hits in lexical_hits]
+        elif strategy == 'hybrid':
+            results = []
+            for vector_ranking, lexical_ranking in zip(vector_hits, lexical_hits):
+                vector_scores = dict(vector_ranking)
+                lexical_scores = dict(lexical_ranking)
+                fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking], k=retrieval_config.get('rrf_k', 60))
+                results.append([
+                    {
+                        **self._format_hit(chunks[row], score),
+                        'vector_score': vector_scores.get(row),
+                        'lexical_score': lexical_scores.get(row)
+                    }
+                    for row, score in fused[:depth]
+                ])
+        
+        if rerank:
+            results = await self._rerank(retrieval_config, queries, results)
+        return [hits[:top_k] for hits in results]
+    
+    async def _rerank(
+        self,
+        retrieval_config: Dict[str, Any],
+        queries: List[str],
+        results: List[List[Dict[str, Any]]]
+    ) -> List[List[Dict[str, Any]]]:
+        """Rerank each query's top rerank_candidates hits within rerank_budget_ms."""
+        name = retrieval_config.get('reranker', 'lexical')
+        if name not in self.rerankers:
+            raise ValueError(f"Unknown reranker: {name}")
+        reranker = self.rerankers[name]
+        candidates = retrieval_config.get('rerank_candidates', 20)
+        budget_ms = retrieval_config.get('rerank_budget_ms', 50)
+        
+        reranked = []
+        for query, hits in zip(queries, results):
+            head, info = await rerank_hits(reranker, query, hits[:candidates], budget_ms)
+            reranked.append(head + hits[candidates:])
+            self.rerank_stats['queries'] += 1
+            self.rerank_stats['reranked'] += int(info['reranked'])
+            self.rerank_stats['fallbacks'] += int(not info['reranked'])
+            self.rerank_stats['total_time'] += info['time']
+        return reranked
+    
+    def register_reranker(self, name: str, reranker: Union[Reranker, Callable[[str, List[str]], Any]]) -> None:
+        """Make a reranker selectable as retrieval_config['reranker'].
+        
+        reranker is a Reranker or a model hook `fn(query, texts) -> scores`,
+        sync or async.
+        """
+        self.rerankers[name] = reranker if isinstance(reranker, Reranker) else CallableReranker(reranker, name)
+    
+    def get_rerank_stats(self) -> Dict[str, Any]:
+        """Rerank counters and timing across all searches."""
+        stats = dict(self.rerank_stats)
+        stats['avg_time'] = stats['total_time'] / stats['queries'] if stats['queries'] else 0.0
+        return stats
+    
+    async def _get_lexical_index(self, kb_id: str) -> LexicalIndex:
+        """Open a knowledge base's BM25 index on first use."""
+        if kb_id not in self.lexical_indexes:
+            self.lexical_indexes[kb_id] = await asyncio.to_thread(
+                self.store.load_lexical, kb_id, len(self.indexes[kb_id])
+            )
+        return self.lexical_indexes[kb_id]
+    
+    async def _get_metadata_index(self, kb_id: str) -> MetadataIndex:
+        """Open a knowledge base's metadata posting lists on first use."""
+        if kb_id not in self.metadata_indexes:
+            self.metadata_indexes[kb_id] = await asyncio.to_thread(
+                self.store.load_metadata, kb_id, len(self.indexes[kb_id])
+            )
+        return self.metadata_indexes[kb_id]
+    
+    async def _measure_recall(
+        self,
+        knowledge_base_id: str,
+        queries: List[str],
+        top_k: int,
+        nprobe_values: List[Optional[int]]
     ) -> Dict[str, Any]:
-        """Process a single document."""
+        """Compare approximate top-k results against exact search."""
+        
+        index = self.indexes[knowledge_base_id]
+        report = {
+            'index_type': index.get_stats()['index_type'],
+            'approximate': index.is_approximate,
+            'k': top_k,
+            'recall_at_k': 1.0,
+            'settings': []
+        }
         
-        # Mock document processing (in real implementation, would handle various file types)
+        if not index.is_approximate or not queries or len(index) == 0:
+            return report
+        
+        embedder = self._get_embedder(self.knowledge_bases[knowledge_base_id]['embedding_config'])
+        query_vectors = await embedder.embed(queries, purpose='query')
+        
+        exact_results = []
+        started = time.perf_counter()
+        for vector in query_vectors:
+            exact_results.append(index.search_exact(vector, top_k))
+        exact_latency = (time.perf_counter() - started) / len(queries)
+        
+        for nprobe in nprobe_values:
+            hits = 0
+            expected = 0
+            started = time.perf_counter()
+            approx_results = index.search_batch(query_vectors, top_k, nprobe=nprobe)
+            for exact, approx in zip(exact_results, approx_results):
+                if not exact:
+                    continue
+                # Tie-aware: any result scoring at least the exact k-th score counts
+                kth_score = exact[-1][1] - 1e-6
+                hits += min(len(exact), sum(1 for _, score in approx if score >= kth_score))
+                expected += len(exact)
+            report['settings'].append({
+                'nprobe': nprobe or getattr(index, 'nprobe', None),
+                'recall_at_k': hits / expected if expected else 1.0,
+                'avg_response_time': (time.perf_counter() - started) / len(queries),
+                'exact_avg_response_time': exact_latency
+            })
+        
+        report['recall_at_k'] = report['settings'][0]['recall_at_k']
+        return report
+    
+    async def _build_index(
+        self,
+        kb_id: str,
+        distance_metric: str,
+        retrieval_config: Dict[str, Any]
+    ) -> FlatVectorIndex:
+        """Build a vector index over a knowledge base's staged chunks."""
+        
+        staged = self.store.read_staging(kb_id)
+        index = create_index(
+            staged['dimensions'],
+            distance_metric,
+            index_type=retrieval_config['index_type'],
+            expected_size=staged['chunk_count'],
+            nlist=retrieval_config.get('nlist'),
+            nprobe=retrieval_config.get('nprobe') or 8,
+            quantization=retrieval_config.get('quantization', 'float32'),
+            rerank_factor=retrieval_config.get('rerank_factor', 4)
+        )
+        
+        # Block-wise copy into the mmap'd layout keeps vectors out of RAM
+        await asyncio.to_thread(self.store.commit_staging, kb_id, index)
+        
+        # k-means training and the recall estimate are CPU heavy; keep them off the event loop
+        await asyncio.to_thread(index.train)
+        self.knowledge_bases[kb_id]['estimated_recall'] = await asyncio.to_thread(index.estimate_recall)
+        
+        return index
+    
+    def _embedding_settings(
+        self,
+        options: Dict[str, Any],
+        base: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Resolve embedding settings from processing or knowledge base options.
+        
+        Settings come from DEFAULT_EMBEDDING_CONFIG, then base, then an
+        'embedding_config' dict in options, then the flat option keys
+        (embedding_provider, embedding_model, dimensions, batch_size,
+        max_batch_tokens, embedding_concurrency, timeout, retry_count).
+        """
+        settings = {
+            **DEFAULT_EMBEDDING_CONFIG,
+            'provider': self.default_embedding_provider,
+            'model': self.default_embedding_model,
+            **(base or {}),
+            **options.get('embedding_config', {})
+        }
+        flat_options = {
+            'embedding_provider': 'provider',
+            'embedding_model': 'model',
+            'dimensions': 'dimensions',
+            'batch_size': 'batch_size',
+            'max_batch_tokens': 'max_batch_tokens',
+            'embedding_concurrency': 'max_concurrency',
+            'timeout': 'timeout',
+            'retry_count': 'retry_count'
+        }
+        for option, key in flat_options.items():
+            if options.get(option) is not None:
+                settings[key] = options[option]
+        
+        if settings['provider'] not in EMBEDDING_PROVIDERS:
+            raise ValueError(f"Unsupported embedding provider: {settings['provider']}")
+        return {key: settings[key] for key in DEFAULT_EMBEDDING_CONFIG}
+    
+    def _get_embedder(self, embedding_config: Dict[str, Any]) -> EmbeddingProvider:
+        """Get the shared embedding provider for a set of embedding settings."""
+        settings = {**DEFAULT_EMBEDDING_CONFIG, **embedding_config}
+        key = json.dumps(settings, sort_keys=True)
+        if key not in self.embedding_providers:
+            self.embedding_providers[key] = create_embedding_provider(settings, cache=self._get_embedding_cache())
+        return self.embedding_providers[key]
+    
+    def _get_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """Get the shared embedding cache; None when disabled."""
+        if self._embedding_cache is None and self.embedding_cache_bytes > 0:
+            self._embedding_cache = EmbeddingCache(
+                self.storage_dir / 'embedding_cache.sqlite',
+                max_bytes=self.embedding_cache_bytes
+            )
+        return self._embedding_cache
+    
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and size of the shared embedding cache."""
+        if self.embedding_cache_bytes <= 0:
+            return {'enabled': False}
+        cache = self._get_embedding_cache()
+        return {'enabled': True, **cache.stats()}
+    
+    async def _ensure_loaded(self, kb_id: str) -> None:
+        """Open a persisted knowledge base on first access."""
+        if kb_id in self.knowledge_bases or not self.store.exists(kb_id):
+            return
+        
+        kb_config, index, chunks = await asyncio.to_thread(self.store.load, kb_id)
+        self.knowledge_bases[kb_id] = kb_config
+        self.indexes[kb_id] = index
+        self.chunks[kb_id] = chunks
+    
+    def _get_index_stats(self, kb_id: str) -> Dict[str, Any]:
+        """Build index statistics for a knowledge base."""
+        index = self.indexes[kb_id]
+        stats = index.get_stats()
+        storage_bytes = self.store.size_bytes(kb_id)
+        
+        return {
+            'document_count': self.knowledge_bases[kb_id].get('document_count', 0),
+            'chunk_count': index.live_count,
+            'token_count': self.knowledge_bases[kb_id].get('token_count', 0),
+            'index_size': f"{storage_bytes / (1024 * 1024):.2f} MB",
+            'storage_bytes': storage_bytes,
+            'embedding_model': self.knowledge_bases[kb_id]['embedding_config']['model'],
+            'estimated_recall': self.knowledge_bases[kb_id].get('estimated_recall', 1.0),
+            **stats
+        }
+    
+    def _format_hit(self, chunk: Dict[str, Any], score: float) -> Dict[str, Any]:
+        """Format an indexed chunk as a retrieval result."""
+        return {
+            'chunk_id': chunk['id'],
+            'content': chunk['text'],
+            'score': score,
+            'source': chunk['source'],
+            'source_type': chunk['source_type'],
+            'page': chunk.get('page')
+        }
+    
+    async def _read_document(self, source: str) -> Dict[str, Any]:
+        """Read a single document source."""
+        
+        modified_at = datetime.now(timezone.utc)
+        page_starts = None
         if source.startswith('http'):
-            # Web content
-            content = f"Web content from {source}"
+            # Web content; HTML is reduced to its visible text in the process pool
+            page = await self._get_web_fetcher().fetch(source)
+            content = page['body']
+            if page['content_type'] in HTML_CONTENT_TYPES:
+                loop = asyncio.get_running_loop()
+                content = await loop.run_in_executor(self._get_parse_executor(), html_to_text, content)
             source_type = 'web'
-        elif Path(source).exists():
+            if page['last_modified']:
+                try:
+                    modified_at = parsedate_to_datetime(page['last_modified'])
+                except (TypeError, ValueError):
+                    # Malformed Last-Modified header; keep the fetch time
+                    pass
+        elif self._is_local_file(source):
             # Local file
-            content = f"File content from {Path(source).name}"
+            content, page_starts = await self._load_file(source)
             source_type = 'file'
+            modified_at = datetime.fromtimestamp(os.path.getmtime(source), timezone.utc)
         else:
             # Direct content
             content = source
             source_type = 'direct'
+            content_hash = self._content_hash(content)
+            source = DIRECT_SOURCE_PREFIX + content_hash
         
-        # Mock chunking
-        chunks = self._chunk_text(content, chunk_size, overlap)
-        token_count = len(content.split()) * 1.3  # Rough token estimate
+        document = {
+            'source': source,
+            'source_type': source_type,
+            'content': content,
+            'modified_at': modified_at.isoformat()
+        }
+        if page_starts is not None:
+            document['page_starts'] = page_starts
+        if source_type == 'direct':
+            document['content_hash'] = content_hash
+        return document
+    
+    def _is_local_file(self, source: str) -> bool:
+        """Check whether a source names an existing local file."""
+        try:
+            return Path(source).exists()
+        except OSError:
+            # Long direct content is not a valid path (ENAMETOOLONG)
+            return False
+    
+    async def _load_file(self, path: str) -> Tuple[str, Optional[List[int]]]:
+        """Load a local file, parsing CPU-heavy formats in the process pool.
+        
+        PDFs are split into page ranges parsed by separate workers; their
+        page start offsets are returned with the text (None otherwise).
+        """
+        
+        if not needs_process_pool(path):
+            return await asyncio.to_thread(load_file, path), None
+        
+        loop = asyncio.get_running_loop()
+        executor = self._get_parse_executor()
+        if not is_pdf(path):
+            return await loop.run_in_executor(executor, load_file, path), None
+        
+        page_count = await loop.run_in_executor(executor, pdf_page_count, path)
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(executor, load_pdf_pages, path, start, start + PDF_PAGES_PER_TASK)
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ))
+        return join_pages([page for part in parts for page in part])
+    
+    def _get_web_fetcher(self) -> WebFetcher:
+        """Get the shared web fetcher; its response cache is None when disabled."""
+        if self._web_fetcher is None:
+            cache = None
+            if self.web_cache_bytes > 0:
+                cache = ResponseCache(self.storage_dir / 'web_cache.sqlite', max_bytes=self.web_cache_bytes)
+            self._web_fetcher = WebFetcher(
+                cache,
+                max_connections=self.web_max_connections,
+                per_host_limit=self.web_per_host_limit,
+                http2=self.web_http2
+            )
+        return self._web_fetcher
+    
+    def get_web_fetch_stats(self) -> Dict[str, Any]:
+        """Request and conditional-GET counters of the shared web fetcher."""
+        if self._web_fetcher is None:
+            return {'requests': 0}
+        return self._web_fetcher.stats()
+    
+    def _get_parse_executor(self) -> ProcessPoolExecutor:
+        """Get the shared document parsing process pool."""
+        if self._parse_executor is None:
+            self._parse_executor = ProcessPoolExecutor(max_workers=self.parse_workers)
+        return self._parse_executor
+    
+    async def close(self) -> None:
+        """Release worker processes, embedding clients and the web fetcher."""
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown(wait=False, cancel_futures=True)
+            self._parse_executor = None
         
-        # Generate document hash
-        doc_hash = hashlib.md5(content.encode()).hexdigest()
+        for provider in self.embedding_providers.values():
+            await provider.close()
+        self.embedding_providers.clear()
+        
+        if self._embedding_cache is not None:
+            self._embedding_cache.close()
+            self._embedding_cache = None
+        
+        if self._web_fetcher is not None:
+            await self._web_fetcher.close()
+            self._web_fetcher = None
+    
+    def _summarize_document(
+        self,
+        document: Dict[str, Any],
+        chunk_count: int,
+        token_count: int,
+        status: str = 'added',
+        reused_chunks: int = 0
+    ) -> Dict[str, Any]:
+        """Summarize a chunked document without holding on to its chunks."""
         
         return {
-            'source': source,
-            'source_type': source_type,
-            'content_hash': doc_hash,
-            'chunk_count': len(chunks),
-            'token_count': int(token_count),
-            'chunks': chunks,
+            'source': document['source'],
+            'source_type': document['source_type'],
+            'content_hash': document.get('content_hash') or self._content_hash(document['content']),
+            'status': status,
+            'chunk_count': chunk_count,
+            'reused_chunks': reused_chunks,
+            'token_count': token_count,
+            'size_bytes': len(document['content'].encode()),
+            'modified_at': document.get('modified_at'),
             'processed_at': datetime.now(timezone.utc).isoformat()
         }
     
-    def _chunk_text(self, text: str, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
-        """Split text into chunks with overlap."""
-        words = text.split()
-        chunks = []
+    def _content_hash(self, content: str) -> str:
+        """Hash identifying a document's content in the knowledge base manifest."""
+        return hashlib.md5(content.encode()).hexdigest()
+    
+    def _is_unchanged(self, document: Dict[str, Any], known_documents: Dict[str, Dict[str, Any]]) -> bool:
+        """Check whether a document is already indexed with the same content."""
+        previous = known_documents.get(document['source'])
+        return previous is not None and previous['content_hash'] == document['content_hash']
+    
+    def _indexed_chunk_rows(self, kb_id: str, rows: List[int]) -> Dict[str, List[int]]:
+        """Map the chunk IDs stored at rows to those rows."""
+        chunks = self.chunks[kb_id]
+        indexed: Dict[str, List[int]] = {}
+        for row in rows:
+            indexed.setdefault(chunks[row]['id'], []).append(row)
+        return indexed
+    
+    async def _apply_staged_update(self, kb_id: str) -> None:
+        """Append an incremental sync to a stored knowledge base."""
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk_text = ' '.join(chunk_words)
-            
-            chunks.append({
-                'id': str(uuid.uuid4()),
-                'text': chunk_text,
-                'word_count': len(chunk_words),
-                'start_index': i,
-                'end_index': min(i + chunk_size, len(words))
-            })
-            
-            if i + chunk_size >= len(words):
-                break
+        index = self.indexes[kb_id]
+        counts = await asyncio.to_thread(self.store.append_staging, kb_id, index)
+        self.lexical_indexes.pop(kb_id, None)
+        self.metadata_indexes.pop(kb_id, None)
+        self.retrieval_cache.invalidate(kb_id)
+        self.chunks[kb_id] = ChunkTable(self.store.path(kb_id), len(index))
         
+        kb_config = self.knowledge_bases[kb_id]
+        kb_config.update(counts)
+        kb_config['estimated_recall'] = await asyncio.to_thread(index.estimate_recall)
+        kb_config['updated_at'] = datetime.now(timezone.utc).isoformat()
+        kb_config['index_stats'] = self._get_index_stats(kb_id)
+        await asyncio.to_thread(self.store.write_manifest, kb_id, kb_config, index)
+    
+    def _chunk_text(
+        self,
+        text: str,
+        chunk_size: int,
+        overlap: int,
+        source: str = '',
+        source_type: Optional[str] = None,
+        token_starts: Optional[Sequence[int]] = None,
+        page_starts: Optional[Sequence[int]] = None
+    ) -> List[Chunk]:
+        """Split text into offset-based chunks with overlap.
+        
+        When token_starts is given, chunk_size and overlap count tokens.
+        With page_starts, each chunk gets the 1-based page it starts on.
+        """
+        if token_starts is not None:
+            chunks = self.token_chunker.chunk(
+                text, token_starts, chunk_size, overlap, source=source, source_type=source_type
+            )
+        else:
+            chunks = self.chunker.chunk(text, chunk_size, overlap, source=source, source_type=source_type)
+        if page_starts:
+            for chunk_record in chunks:
+                chunk_record.page = bisect.bisect_right(page_starts, chunk_record.start)
         return chunks
     
     async def get_knowledge_base_info(self, kb_id: str) -> Dict[str, Any]:
         """Get knowledge base information."""
+        await self._ensure_loaded(kb_id)
         if kb_id not in self.knowledge_bases:
             raise ValueError(f"Knowledge base {kb_id} not found")
         
@@ -303,18 +1421,48 @@ class KnowledgeBaseManager:
         updates: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Update knowledge base configuration."""
+        await self._ensure_loaded(kb_id)
         if kb_id not in self.knowledge_bases:
             raise ValueError(f"Knowledge base {kb_id} not found")
         
         kb_config = self.knowledge_bases[kb_id]
         kb_config.update(updates)
         kb_config['updated_at'] = datetime.now(timezone.utc).isoformat()
+        self.retrieval_cache.invalidate(kb_id)
+        
+        if self.store.exists(kb_id):
+            await asyncio.to_thread(self.store.update_config, kb_id, kb_config)
         
         return kb_config
     
+    async def apply_rag_config(self, kb_id: str, rag_config: Dict[str, Any]) -> Dict[str, Any]:
+        """Adopt an agent template's retrieval settings (strategy, top_k, threshold, reranking)."""
+        await self._ensure_loaded(kb_id)
+        if kb_id not in self.knowledge_bases:
+            raise ValueError(f"Knowledge base {kb_id} not found")
+        
+        retrieval_config = dict(self.knowledge_bases[kb_id]['retrieval_config'])
+        for key in ('retrieval_strategy', 'similarity_top_k', 'similarity_threshold'):
+            if key in rag_config:
+                retrieval_config[key] = rag_config[key]
+        if 'reranking' in rag_config:
+            retrieval_config['rerank'] = rag_config['reranking']
+        if retrieval_config['retrieval_strategy'] not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Unsupported retrieval strategy: {retrieval_config['retrieval_strategy']}")
+        
+        kb_config = await self.update_knowledge_base(kb_id, {'retrieval_config': retrieval_config})
+        return kb_config['retrieval_config']
+    
     async def delete_knowledge_base(self, kb_id: str) -> bool:
         """Delete knowledge base."""
-        if kb_id in self.knowledge_bases:
-            del self.knowledge_bases[kb_id]
-            return True
-        return False
+        found = self.knowledge_bases.pop(kb_id, None) is not None
+        self.indexes.pop(kb_id, None)
+        self.chunks.pop(kb_id, None)
+        self.lexical_indexes.pop(kb_id, None)
+        self.metadata_indexes.pop(kb_id, None)
+        self.retrieval_cache.invalidate(kb_id)
+        
+        if await asyncio.to_thread(self.store.delete, kb_id):
+            found = True
+        
+        return found
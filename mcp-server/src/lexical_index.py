@@ -0,0 +1,246 @@
+"""
+Lexical Index
+Compact BM25 inverted index over knowledge base chunks.
+
+Postings are stored term-major in three flat arrays: `offsets[t]` to
+`offsets[t + 1]` delimits the rows and term frequencies of term t. Rows
+are the vector index rows, so lexical and vector hits share IDs.
+Documents are buffered by `add` and merged into the arrays in one
+vectorised pass the next time the index is read.
+"""
+
+import json
+import math
+import os
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .embeddings import tokenize
+except ImportError:
+    from embeddings import tokenize
+
+LEXICAL_TERMS_FILE = 'lexical_terms.json'
+
+_LEXICAL_ARRAYS = {
+    'lexical_offsets.bin': np.uint64,
+    'lexical_rows.bin': np.int32,
+    'lexical_freqs.bin': np.uint16,
+    'lexical_lengths.bin': np.uint32
+}
+
+LEXICAL_FILES = (LEXICAL_TERMS_FILE, *_LEXICAL_ARRAYS)
+
+_MAX_FREQ = np.iinfo(np.uint16).max
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked (row, score) lists by summing 1 / (k + rank) per row."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (row, _) in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 inverted index with term -> (rows, term frequencies) postings."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.uint64)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._freqs = np.empty(0, dtype=np.uint16)
+        self._lengths = np.empty(0, dtype=np.uint32)
+        self._total_length = 0
+        # Cumulative scan work: queries answered and postings read
+        self.scan_stats = {'queries': 0, 'postings_scanned': 0}
+
+        # Postings of added documents not yet merged into the arrays
+        self._pending_terms = array('i')
+        self._pending_rows = array('i')
+        self._pending_freqs = array('i')
+        self._pending_lengths = array('I')
+
+    def __len__(self) -> int:
+        return len(self._lengths) + len(self._pending_lengths)
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self.terms)
+
+    def add(self, texts: Iterable[str]) -> None:
+        """Index texts as the next rows."""
+        row = len(self)
+        terms = self.terms
+        for text in texts:
+            tokens = tokenize(text)
+            counts = Counter(tokens)
+            self._pending_terms.extend([terms.setdefault(term, len(terms)) for term in counts])
+            self._pending_rows.extend([row] * len(counts))
+            self._pending_freqs.extend(counts.values())
+            self._pending_lengths.append(len(tokens))
+            row += 1
+
+    def extend(self, other: 'LexicalIndex') -> None:
+        """Append the rows of another index after this index's rows."""
+        other._merge_pending()
+        if len(other._lengths) == 0:
+            return
+
+        term_ids = np.array(
+            [self.terms.setdefault(term, len(self.terms)) for term in other.terms], dtype=np.int32
+        )
+        postings = np.diff(other._offsets.astype(np.int64))
+        self._pending_terms.extend(np.repeat(term_ids, postings).tolist())
+        self._pending_rows.extend((other._rows.astype(np.int64) + len(self)).tolist())
+        self._pending_freqs.extend(other._freqs.tolist())
+        self._pending_lengths.extend(other._lengths.tolist())
+
+    def truncate(self, count: int) -> None:
+        """Drop rows at and after count."""
+        self._merge_pending()
+        if count >= len(self._lengths):
+            return
+        self._lengths = self._lengths[:count]
+        keep = self._rows < count
+        term_of_posting = np.repeat(
+            np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets.astype(np.int64))
+        )
+        self._set_postings(term_of_posting[keep], self._rows[keep], self._freqs[keep])
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        excluded: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """BM25 top-k rows for a query, skipping rows flagged in excluded."""
+        self._merge_pending()
+        count = len(self._lengths)
+        term_ids = [self.terms[term] for term in set(tokenize(query)) if term in self.terms]
+        if top_k <= 0 or count == 0 or not term_ids:
+            return []
+
+        self.scan_stats['queries'] += 1
+        average_length = self._total_length / count
+        rows, scores = [], []
+        for term_id in term_ids:
+            start, end = int(self._offsets[term_id]), int(self._offsets[term_id + 1])
+            if start == end:
+                continue
+            self.scan_stats['postings_scanned'] += end - start
+            term_rows = self._rows[start:end]
+            freqs = self._freqs[start:end].astype(np.float32)
+            lengths = self._lengths[term_rows].astype(np.float32)
+            idf = math.log(1.0 + (count - (end - start) + 0.5) / (end - start + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * lengths / average_length)
+            rows.append(term_rows)
+            scores.append(idf * freqs * (self.k1 + 1.0) / (freqs + norm))
+
+        if not rows:
+            return []
+
+        # Sum per-term contributions over the rows that matched any term
+        candidates, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        if excluded is not None:
+            live = ~excluded[candidates]
+            candidates, totals = candidates[live], totals[live]
+
+        if len(candidates) > top_k:
+            top = np.argpartition(-totals, top_k - 1)[:top_k]
+            candidates, totals = candidates[top], totals[top]
+        order = np.argsort(-totals, kind='stable')
+        return [(int(candidates[i]), float(totals[i])) for i in order]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Size of the index."""
+        self._merge_pending()
+        return {
+            'vocabulary_size': self.vocabulary_size,
+            'posting_count': len(self._rows),
+            'memory_bytes': int(
+                self._offsets.nbytes + self._rows.nbytes + self._freqs.nbytes + self._lengths.nbytes
+            )
+        }
+
+    def save(self, directory: Path) -> None:
+        """Write the index next to a knowledge base's vectors."""
+        self._merge_pending()
+        arrays = {
+            'lexical_offsets.bin': self._offsets,
+            'lexical_rows.bin': self._rows,
+            'lexical_freqs.bin': self._freqs,
+            'lexical_lengths.bin': self._lengths
+        }
+        for name, values in arrays.items():
+            tmp_path = directory / (name + '.tmp')
+            np.ascontiguousarray(values, dtype=_LEXICAL_ARRAYS[name]).tofile(tmp_path)
+            os.replace(tmp_path, directory / name)
+
+        # Term IDs are list positions
+        terms = sorted(self.terms, key=self.terms.get)
+        tmp_path = directory / (LEXICAL_TERMS_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'terms': terms}, f)
+        os.replace(tmp_path, directory / LEXICAL_TERMS_FILE)
+
+    @classmethod
+    def load(cls, directory: Path, count: Optional[int] = None) -> Optional['LexicalIndex']:
+        """Read a saved index, or None when the knowledge base has none.
+
+        With count, rows appended after the last manifest are dropped.
+        """
+        if not (directory / LEXICAL_TERMS_FILE).exists():
+            return None
+
+        with open(directory / LEXICAL_TERMS_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        index = cls(k1=saved['k1'], b=saved['b'])
+        index.terms = {term: term_id for term_id, term in enumerate(saved['terms'])}
+        index._offsets = np.fromfile(directory / 'lexical_offsets.bin', dtype=np.uint64)
+        index._rows = np.fromfile(directory / 'lexical_rows.bin', dtype=np.int32)
+        index._freqs = np.fromfile(directory / 'lexical_freqs.bin', dtype=np.uint16)
+        index._lengths = np.fromfile(directory / 'lexical_lengths.bin', dtype=np.uint32)
+        index._total_length = int(index._lengths.sum())
+        if count is not None:
+            index.truncate(count)
+        return index
+
+    def _merge_pending(self) -> None:
+        """Merge buffered postings into the term-major arrays."""
+        if not self._pending_lengths:
+            return
+
+        existing_terms = np.repeat(
+            np.arange(len(self._offsets) - 1, dtype=np.int64), np.diff(self._offsets.astype(np.int64))
+        )
+        self._lengths = np.concatenate([self._lengths, np.frombuffer(self._pending_lengths, dtype=np.uint32)])
+        self._set_postings(
+            np.concatenate([existing_terms, np.frombuffer(self._pending_terms, dtype=np.int32)]),
+            np.concatenate([self._rows, np.frombuffer(self._pending_rows, dtype=np.int32)]),
+            np.concatenate([
+                self._freqs,
+                np.minimum(np.frombuffer(self._pending_freqs, dtype=np.int32), _MAX_FREQ).astype(np.uint16)
+            ])
+        )
+        self._pending_terms = array('i')
+        self._pending_rows = array('i')
+        self._pending_freqs = array('i')
+        self._pending_lengths = array('I')
+
+    def _set_postings(self, term_ids: np.ndarray, rows: np.ndarray, freqs: np.ndarray) -> None:
+        """Store postings grouped by term; rows stay ascending within a term."""
+        order = np.argsort(term_ids, kind='stable')
+        counts = np.bincount(term_ids.astype(np.int64), minlength=len(self.terms))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+        self._rows = rows[order].astype(np.int32)
+        self._freqs = freqs[order].astype(np.uint16)
+        self._total_length = int(self._lengths.sum())
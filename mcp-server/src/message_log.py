@@ -0,0 +1,153 @@
+"""
+Message Log
+Append-only, segmented message history of a conversation.
+
+Messages are compact `__slots__` records appended to fixed-size segments;
+a record is never modified or moved once written. Positions are indexed by
+message type as they are appended, so lookups such as the key decisions
+of a summary cost O(matches) instead of a scan of the whole history.
+
+The log stays list-like: len(), iteration and indexing yield messages,
+and a message can be read like the dict it replaces (message['content']).
+Every message also has a sequence number that keeps increasing when old
+messages are compacted into a summary record, so stores can key rows by it.
+"""
+
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+try:
+    from .timestamps import to_epoch_ns
+except ImportError:
+    from timestamps import to_epoch_ns
+
+# Messages per segment
+SEGMENT_SIZE = 256
+
+
+class Message:
+    """One conversation message; timestamp is in epoch nanoseconds."""
+
+    __slots__ = ('id', 'role', 'content', 'metadata', 'timestamp')
+
+    def __init__(self, id: str, role: str, content: str, metadata: Dict[str, Any], timestamp: int):
+        self.id = id
+        self.role = role
+        self.content = content
+        self.metadata = metadata
+        self.timestamp = timestamp
+
+    @property
+    def type(self) -> Optional[str]:
+        return self.metadata.get('type')
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'role': self.role,
+            'content': self.content,
+            'metadata': self.metadata,
+            'timestamp': self.timestamp
+        }
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> 'Message':
+        return cls(
+            record['id'],
+            record['role'],
+            record['content'],
+            record.get('metadata') or {},
+            to_epoch_ns(record['timestamp'])
+        )
+
+
+class MessageLog:
+    """Segmented append-only list of messages with a per-type position index."""
+
+    def __init__(self, messages: Iterable[Message] = (), first_seq: int = 0):
+        self._segments: List[List[Message]] = []
+        self._count = 0
+        self._by_type: Dict[str, List[int]] = {}
+        self.next_seq = first_seq
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Message) -> int:
+        """Append a message; returns its sequence number."""
+        if not self._segments or len(self._segments[-1]) >= SEGMENT_SIZE:
+            self._segments.append([])
+        self._segments[-1].append(message)
+        if message.type is not None:
+            self._by_type.setdefault(message.type, []).append(self._count)
+        self._count += 1
+        self.next_seq += 1
+        return self.next_seq - 1
+
+    def compact(self, count: int, summary: Message) -> int:
+        """Replace the oldest count messages with a summary record; returns its sequence number.
+
+        The summary takes the sequence number of the last message it replaces.
+        """
+        kept = self[count:]
+        seq = self.first_seq + count - 1
+        self._segments, self._count, self._by_type = [], 0, {}
+        self.next_seq = seq
+        self.append(summary)
+        for message in kept:
+            self.append(message)
+        return seq
+
+    def of_type(self, *types: str) -> List[Message]:
+        """Messages of the given types, in log order."""
+        positions = sorted(position for kind in types for position in self._by_type.get(kind, ()))
+        return [self[position] for position in positions]
+
+    def count_of_type(self, message_type: str) -> int:
+        return len(self._by_type.get(message_type, ()))
+
+    @property
+    def first_seq(self) -> int:
+        return self.next_seq - self._count
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the messages."""
+        return sum(
+            sys.getsizeof(message) + sys.getsizeof(message.content) + sys.getsizeof(message.metadata)
+            for message in self
+        ) + sum(sys.getsizeof(segment) for segment in self._segments)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Messages as plain dicts, for serialisation."""
+        return [message.to_dict() for message in self]
+
+    @classmethod
+    def from_list(cls, records: Iterable[Dict[str, Any]], first_seq: int = 0) -> 'MessageLog':
+        return cls((Message.from_dict(record) for record in records), first_seq)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[Message]:
+        for segment in self._segments:
+            yield from segment
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Message, List[Message]]:
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('message index out of range')
+        return self._segments[index // SEGMENT_SIZE][index % SEGMENT_SIZE]
@@ -0,0 +1,319 @@
+"""
+Metadata Index
+Pre-computed posting lists for filtering knowledge base chunks by metadata.
+
+Filters are evaluated into a row bitmap before vector or keyword scoring,
+so selective filters scan only the rows they allow and never lose results
+to a post-filtered top-k.
+
+A filter maps fields to conditions, all of which must hold:
+
+    {'source': {'in': ['faq.md', 'billing.md']},
+     'source_type': 'web',
+     'modified_at': {'gte': '2024-01-01', 'lt': '2024-07-01'},
+     'page': {'lte': 10}}
+
+A bare value means equality and a bare list means `in`.
+
+The index is built as chunks are staged and saved next to the lexical
+index. Keyword postings are stored value-major like the lexical index:
+`offsets[v]` to `offsets[v + 1]` delimits the rows holding value v.
+Range fields are stored as one float64 value per row (NaN when absent).
+"""
+
+import json
+import math
+import os
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+# Fields matched by value (posting list per value) and by range (sorted values)
+KEYWORD_FIELDS = ('source', 'source_type')
+RANGE_FIELDS = ('page', 'modified_at')
+
+FILTER_OPERATORS = ('eq', 'in', 'gt', 'gte', 'lt', 'lte')
+
+METADATA_VALUES_FILE = 'metadata_values.json'
+
+_METADATA_ARRAYS = {
+    **{f'metadata_{field}_offsets.bin': np.uint64 for field in KEYWORD_FIELDS},
+    **{f'metadata_{field}_rows.bin': np.int32 for field in KEYWORD_FIELDS},
+    **{f'metadata_{field}.bin': np.float64 for field in RANGE_FIELDS}
+}
+
+METADATA_FILES = (METADATA_VALUES_FILE, *_METADATA_ARRAYS)
+
+# Filter values must be usable as posting list keys
+_FILTER_VALUE_TYPES = (str, int, float, bool, type(None))
+
+
+def _timestamp(value: Any) -> float:
+    """Seconds since the epoch for an ISO 8601 date or datetime (UTC when naive)."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class MetadataIndex:
+    """Posting lists over the rows of one knowledge base."""
+
+    def __init__(self):
+        # Per keyword field: value -> value ID
+        self.values: Dict[str, Dict[Any, int]] = {field: {} for field in KEYWORD_FIELDS}
+        self._offsets = {field: np.zeros(1, dtype=np.uint64) for field in KEYWORD_FIELDS}
+        self._rows = {field: np.empty(0, dtype=np.int32) for field in KEYWORD_FIELDS}
+        # Per range field: one value per row, NaN when the row has none
+        self._columns = {field: array('d') for field in RANGE_FIELDS}
+        # Per range field: values ascending and the rows holding them, built on first use
+        self._ranges: Dict[str, Any] = {}
+
+        # Value IDs of added rows not yet merged into the postings
+        self._pending = {field: array('i') for field in KEYWORD_FIELDS}
+        self._pending_start = 0
+
+    def __len__(self) -> int:
+        return len(self._columns['page'])
+
+    @property
+    def count(self) -> int:
+        return len(self)
+
+    def add(self, chunks: Iterable[Dict[str, Any]]) -> None:
+        """Index chunk metadata as the next rows."""
+        if not any(self._pending.values()):
+            self._pending_start = len(self)
+        for chunk in chunks:
+            for field in KEYWORD_FIELDS:
+                values = self.values[field]
+                self._pending[field].append(values.setdefault(chunk.get(field), len(values)))
+            page = chunk.get('page')
+            self._columns['page'].append(math.nan if page is None else float(page))
+        self._ranges = {}
+
+    def set_modified(self, rows: Iterable[int], modified_at: Optional[str]) -> None:
+        """Date rows with their document's modification time."""
+        column = self._pad_modified()
+        value = math.nan if not modified_at else _timestamp(modified_at)
+        for row in rows:
+            if row < len(column):
+                column[row] = value
+        self._ranges.pop('modified_at', None)
+
+    def extend(self, other: 'MetadataIndex') -> None:
+        """Append the rows of another index after this index's rows."""
+        other._merge_pending()
+        self._merge_pending()
+        base = len(self)
+        for field in KEYWORD_FIELDS:
+            values = self.values[field]
+            value_ids = np.array(
+                [values.setdefault(value, len(values)) for value in other.values[field]], dtype=np.int32
+            )
+            postings = np.diff(other._offsets[field].astype(np.int64))
+            self._set_postings(
+                field,
+                np.concatenate([self._value_ids(field), np.repeat(value_ids, postings)]),
+                np.concatenate([self._rows[field], other._rows[field].astype(np.int64) + base])
+            )
+        for field in RANGE_FIELDS:
+            column = self._columns[field]
+            column.extend([math.nan] * (base - len(column)))
+            column.extend(other._columns[field])
+        self._pad_modified()
+        self._ranges = {}
+
+    def truncate(self, count: int) -> None:
+        """Drop rows at and after count."""
+        self._merge_pending()
+        if count >= len(self):
+            return
+        for field in KEYWORD_FIELDS:
+            keep = self._rows[field] < count
+            self._set_postings(field, self._value_ids(field)[keep], self._rows[field][keep])
+        for column in self._columns.values():
+            del column[count:]
+        self._ranges = {}
+
+    def evaluate(self, filters: Dict[str, Any], excluded: Optional[np.ndarray] = None) -> np.ndarray:
+        """Boolean mask of the rows matching every condition and not excluded."""
+        self._merge_pending()
+        count = len(self)
+        allowed = np.ones(count, dtype=bool) if excluded is None else ~excluded[:count]
+        for field, condition in filters.items():
+            if field not in KEYWORD_FIELDS and field not in RANGE_FIELDS:
+                raise ValueError(f"Unsupported filter field: {field}")
+            if not isinstance(condition, dict):
+                condition = {'in': condition} if isinstance(condition, list) else {'eq': condition}
+            for operator, operand in condition.items():
+                if operator not in FILTER_OPERATORS:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+                _validate_operand(field, operator, operand)
+                allowed &= self._bitmap(field, operator, operand)
+        return allowed
+
+    def get_stats(self) -> Dict[str, int]:
+        """Number of distinct values per keyword field."""
+        return {f'{field}_values': len(values) for field, values in self.values.items()}
+
+    def save(self, directory: Path) -> None:
+        """Write the index next to a knowledge base's vectors."""
+        self._merge_pending()
+        self._pad_modified()
+        arrays = {}
+        for field in KEYWORD_FIELDS:
+            arrays[f'metadata_{field}_offsets.bin'] = self._offsets[field]
+            arrays[f'metadata_{field}_rows.bin'] = self._rows[field]
+        for field in RANGE_FIELDS:
+            arrays[f'metadata_{field}.bin'] = np.frombuffer(self._columns[field], dtype=np.float64)
+        for name, values in arrays.items():
+            tmp_path = directory / (name + '.tmp')
+            np.ascontiguousarray(values, dtype=_METADATA_ARRAYS[name]).tofile(tmp_path)
+            os.replace(tmp_path, directory / name)
+
+        # Value IDs are list positions
+        values = {field: sorted(ids, key=ids.get) for field, ids in self.values.items()}
+        tmp_path = directory / (METADATA_VALUES_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(values, f)
+        os.replace(tmp_path, directory / METADATA_VALUES_FILE)
+
+    @classmethod
+    def load(cls, directory: Path, count: Optional[int] = None) -> Optional['MetadataIndex']:
+        """Read a saved index, or None when the knowledge base has none.
+
+        With count, rows appended after the last manifest are dropped.
+        """
+        if not (directory / METADATA_VALUES_FILE).exists():
+            return None
+
+        with open(directory / METADATA_VALUES_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        index = cls()
+        for field in KEYWORD_FIELDS:
+            index.values[field] = {value: value_id for value_id, value in enumerate(saved[field])}
+            index._offsets[field] = np.fromfile(directory / f'metadata_{field}_offsets.bin', dtype=np.uint64)
+            index._rows[field] = np.fromfile(directory / f'metadata_{field}_rows.bin', dtype=np.int32)
+        for field in RANGE_FIELDS:
+            index._columns[field].frombytes((directory / f'metadata_{field}.bin').read_bytes())
+        if count is not None:
+            index.truncate(count)
+        return index
+
+    @classmethod
+    def build(
+        cls,
+        chunks: Sequence[Dict[str, Any]],
+        documents: Dict[str, Dict[str, Any]]
+    ) -> 'MetadataIndex':
+        """Index stored chunk metadata, taking document dates from the documents manifest.
+
+        Only needed for knowledge bases saved before the index was persisted.
+        """
+        index = cls()
+        index.add(chunks[row] for row in range(len(chunks)))
+        for record in documents.values():
+            index.set_modified(record['rows'], record.get('modified_at'))
+        return index
+
+    def _pad_modified(self) -> array:
+        """Extend the modified_at column to every row; rows without a date hold NaN."""
+        column = self._columns['modified_at']
+        if len(column) < len(self):
+            column.extend([math.nan] * (len(self) - len(column)))
+        return column
+
+    def _value_ids(self, field: str) -> np.ndarray:
+        """Value ID of every posting of a field, in posting order."""
+        offsets = self._offsets[field].astype(np.int64)
+        return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+    def _merge_pending(self) -> None:
+        """Merge buffered value IDs into the value-major postings."""
+        if not any(self._pending.values()):
+            return
+
+        for field in KEYWORD_FIELDS:
+            pending = np.frombuffer(self._pending[field], dtype=np.int32)
+            self._set_postings(
+                field,
+                np.concatenate([self._value_ids(field), pending]),
+                np.concatenate([
+                    self._rows[field], np.arange(self._pending_start, self._pending_start + len(pending))
+                ])
+            )
+            self._pending[field] = array('i')
+
+    def _set_postings(self, field: str, value_ids: np.ndarray, rows: np.ndarray) -> None:
+        """Store postings grouped by value; rows stay ascending within a value."""
+        order = np.argsort(value_ids, kind='stable')
+        counts = np.bincount(value_ids.astype(np.int64), minlength=len(self.values[field]))
+        self._offsets[field] = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+        self._rows[field] = rows[order].astype(np.int32)
+
+    def _postings(self, field: str, value: Any) -> np.ndarray:
+        value_id = self.values[field].get(value)
+        if value_id is None:
+            return np.empty(0, dtype=np.int32)
+        return self._rows[field][int(self._offsets[field][value_id]):int(self._offsets[field][value_id + 1])]
+
+    def _range(self, field: str) -> Any:
+        if field not in self._ranges:
+            values = np.full(len(self), np.nan)
+            column = np.frombuffer(self._columns[field], dtype=np.float64)
+            values[:len(column)] = column[:len(self)]
+            present = np.flatnonzero(~np.isnan(values))
+            order = np.argsort(values[present], kind='stable')
+            self._ranges[field] = (values[present][order], present[order])
+        return self._ranges[field]
+
+    def _bitmap(self, field: str, operator: str, operand: Any) -> np.ndarray:
+        bitmap = np.zeros(len(self), dtype=bool)
+        if field in KEYWORD_FIELDS:
+            if operator not in ('eq', 'in'):
+                raise ValueError(f"Filter field {field} only supports eq and in")
+            for value in (operand if operator == 'in' else [operand]):
+                bitmap[self._postings(field, value)] = True
+            return bitmap
+
+        values, rows = self._range(field)
+        if operator == 'in':
+            for value in operand:
+                bitmap |= self._bitmap(field, 'eq', value)
+            return bitmap
+
+        bound = _timestamp(operand) if field == 'modified_at' else float(operand)
+        start, end = 0, len(values)
+        if operator in ('eq', 'gte'):
+            start = np.searchsorted(values, bound, side='left')
+        elif operator == 'gt':
+            start = np.searchsorted(values, bound, side='right')
+        if operator in ('eq', 'lte'):
+            end = np.searchsorted(values, bound, side='right')
+        elif operator == 'lt':
+            end = np.searchsorted(values, bound, side='left')
+        bitmap[rows[start:end]] = True
+        return bitmap
+
+
+def _validate_operand(field: str, operator: str, operand: Any) -> None:
+    """Reject filter values that cannot be matched, such as lists passed to eq."""
+    if operator == 'in':
+        if not isinstance(operand, (list, tuple)):
+            raise ValueError(f"Filter operator in on {field} needs a list of values")
+        values = operand
+    else:
+        values = [operand]
+    for value in values:
+        if not isinstance(value, _FILTER_VALUE_TYPES):
+            raise ValueError(
+                f"Filter value for {field} must be a string or number, not {type(value).__name__}"
+            )
+        if field in RANGE_FIELDS and value is None:
+            raise ValueError(f"Filter value for {field} must be a string or number, not None")
@@ -0,0 +1,164 @@
+"""
+Reranking
+Second-stage scoring of retrieved candidates under a latency budget.
+
+A reranker scores the top-N candidates of a query; the hits are then
+reordered by that score. The default `LexicalReranker` combines the
+retrieval score with query-term coverage, bigram overlap and exact phrase
+matches. Model-based rerankers (e.g. cross-encoders) plug in through
+`CallableReranker`. When scoring exceeds the budget, the original
+order is kept.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple, Union
+
+try:
+    from .embeddings import tokenize
+except ImportError:
+    from embeddings import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class RerankTimeout(Exception):
+    """Raised by a reranker that runs past its deadline."""
+
+
+class Reranker:
+    """Base class: score candidate texts for a query; higher is better."""
+
+    name = 'base'
+
+    async def score(
+        self,
+        query: str,
+        texts: Sequence[str],
+        retrieval_scores: Sequence[float],
+        deadline: float
+    ) -> List[float]:
+        """Score texts; deadline is a time.perf_counter() value."""
+        raise NotImplementedError
+
+
+class LexicalReranker(Reranker):
+    """Cross-feature scorer over query and chunk terms; needs no model."""
+
+    name = 'lexical'
+
+    def __init__(
+        self,
+        retrieval_weight: float = 0.5,
+        coverage_weight: float = 0.3,
+        bigram_weight: float = 0.1,
+        phrase_weight: float = 0.1
+    ):
+        self.retrieval_weight = retrieval_weight
+        self.coverage_weight = coverage_weight
+        self.bigram_weight = bigram_weight
+        self.phrase_weight = phrase_weight
+
+    async def score(
+        self,
+        query: str,
+        texts: Sequence[str],
+        retrieval_scores: Sequence[float],
+        deadline: float
+    ) -> List[float]:
+        query_tokens = tokenize(query)
+        query_terms = set(query_tokens)
+        query_bigrams = set(zip(query_tokens, query_tokens[1:]))
+        phrase = ' '.join(query_tokens)
+
+        # Retrieval scores differ in scale per strategy, so rank them within the pool
+        low, high = min(retrieval_scores, default=0.0), max(retrieval_scores, default=0.0)
+        spread = high - low
+
+        scores = []
+        for text, retrieval_score in zip(texts, retrieval_scores):
+            if time.perf_counter() > deadline:
+                raise RerankTimeout()
+            tokens = tokenize(text)
+            terms = set(tokens)
+            coverage = len(query_terms & terms) / len(query_terms) if query_terms else 0.0
+            bigrams = len(query_bigrams & set(zip(tokens, tokens[1:]))) / len(query_bigrams) if query_bigrams else 0.0
+            has_phrase = 1.0 if phrase and phrase in ' '.join(tokens) else 0.0
+            retrieval = (retrieval_score - low) / spread if spread > 0 else 1.0
+            scores.append(
+                self.retrieval_weight * retrieval
+                + self.coverage_weight * coverage
+                + self.bigram_weight * bigrams
+                + self.phrase_weight * has_phrase
+            )
+        return scores
+
+
+class CallableReranker(Reranker):
+    """Model hook: wraps `fn(query, texts) -> scores`, sync or async.
+
+    Synchronous functions run in a worker thread so a slow model does not
+    block the event loop; the budget is enforced by cancellation.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[str, List[str]], Union[Sequence[float], Awaitable[Sequence[float]]]],
+        name: str = 'model'
+    ):
+        self.fn = fn
+        self.name = name
+
+    async def score(
+        self,
+        query: str,
+        texts: Sequence[str],
+        retrieval_scores: Sequence[float],
+        deadline: float
+    ) -> List[float]:
+        if inspect.iscoroutinefunction(self.fn):
+            call = self.fn(query, list(texts))
+        else:
+            call = asyncio.to_thread(self.fn, query, list(texts))
+        try:
+            scores = await asyncio.wait_for(call, timeout=max(0.0, deadline - time.perf_counter()))
+        except asyncio.TimeoutError:
+            raise RerankTimeout()
+        return [float(score) for score in scores]
+
+
+async def rerank_hits(
+    reranker: Reranker,
+    query: str,
+    hits: List[Dict[str, Any]],
+    budget_ms: float
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Reorder hits by reranker score within budget_ms.
+
+    Returns the hits (original order on timeout or error) and timing info.
+    Reranked hits carry a 'rerank_score'; 'score' stays the retrieval score.
+    """
+    started = time.perf_counter()
+    info: Dict[str, Any] = {'reranker': reranker.name, 'candidates': len(hits), 'reranked': False}
+    if not hits:
+        info['time'] = 0.0
+        return hits, info
+
+    try:
+        scores = await reranker.score(
+            query, [hit['content'] for hit in hits], [hit['score'] for hit in hits], started + budget_ms / 1000
+        )
+    except RerankTimeout:
+        info['timed_out'] = True
+    except Exception as e:
+        # A failing model must not fail retrieval
+        logger.warning(f"Reranker {reranker.name} failed, keeping retrieval order: {e}")
+        info['error'] = str(e)
+    else:
+        hits = [{**hit, 'rerank_score': score} for hit, score in zip(hits, scores)]
+        hits.sort(key=lambda hit: hit['rerank_score'], reverse=True)
+        info['reranked'] = True
+    info['time'] = time.perf_counter() - started
+    return hits, info
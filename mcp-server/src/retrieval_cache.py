@@ -0,0 +1,175 @@
+"""
+Retrieval Cache
+In-memory cache of knowledge base search results.
+
+Results are keyed by knowledge base, search parameters and the normalised
+query text. Queries that miss on text can still hit a cached query whose
+embedding lies within a configured cosine distance. Entries expire after a
+TTL, the cache is bounded in entries with LRU eviction, and a knowledge
+base's entries are dropped whenever its index changes.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query."""
+    return ' '.join(query.lower().split())
+
+
+class _Entry:
+    __slots__ = ('kb_id', 'scope', 'vector', 'results', 'expires_at')
+
+    def __init__(
+        self,
+        kb_id: str,
+        scope: str,
+        vector: Optional[np.ndarray],
+        results: List[Dict[str, Any]],
+        expires_at: float
+    ):
+        self.kb_id = kb_id
+        self.scope = scope
+        self.vector = vector
+        self.results = results
+        self.expires_at = expires_at
+
+
+class RetrievalCache:
+    """LRU + TTL cache of search results with optional semantic lookups."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: 'OrderedDict[Tuple[str, str, str], _Entry]' = OrderedDict()
+        # Per (kb_id, scope): entry keys with embeddings, stacked lazily for lookups
+        self._vectors: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    @staticmethod
+    def scope(**params: Any) -> str:
+        """Key for the search parameters a result depends on."""
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def get(self, kb_id: str, scope: str, query: str) -> Optional[List[Dict[str, Any]]]:
+        """Cached results for the same query text, or None."""
+        if self.max_entries <= 0:
+            return None
+        key = (kb_id, scope, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is None or not self._is_live(key, entry):
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [dict(hit) for hit in entry.results]
+
+    def get_similar(
+        self,
+        kb_id: str,
+        scope: str,
+        vector: np.ndarray,
+        max_distance: float
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Cached results for the nearest query within max_distance cosine distance."""
+        bucket = self._vectors.get((kb_id, scope))
+        if self.max_entries <= 0 or max_distance <= 0 or not bucket or not bucket['keys']:
+            return None
+
+        if bucket['matrix'] is None:
+            bucket['matrix'] = np.stack([self._entries[key].vector for key in bucket['keys']])
+        similarities = bucket['matrix'] @ self._unit(vector)
+        best = int(np.argmax(similarities))
+        if 1.0 - float(similarities[best]) > max_distance:
+            return None
+
+        key = bucket['keys'][best]
+        entry = self._entries[key]
+        if not self._is_live(key, entry):
+            return None
+        self._entries.move_to_end(key)
+        self.semantic_hits += 1
+        return [dict(hit) for hit in entry.results]
+
+    def put(
+        self,
+        kb_id: str,
+        scope: str,
+        query: str,
+        results: List[Dict[str, Any]],
+        vector: Optional[np.ndarray] = None
+    ) -> None:
+        """Cache the results of a query, evicting the least recently used entries."""
+        if self.max_entries <= 0:
+            return
+        key = (kb_id, scope, normalize_query(query))
+        if key in self._entries:
+            self._remove(key)
+
+        unit = self._unit(vector) if vector is not None else None
+        self._entries[key] = _Entry(kb_id, scope, unit, results, time.monotonic() + self.ttl)
+        if unit is not None:
+            bucket = self._vectors.setdefault((kb_id, scope), {'keys': [], 'matrix': None})
+            bucket['keys'].append(key)
+            bucket['matrix'] = None
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def record_miss(self, count: int = 1) -> None:
+        """Count queries answered by the index."""
+        self.misses += count
+
+    def invalidate(self, kb_id: str) -> None:
+        """Drop every entry of a knowledge base."""
+        stale = [key for key in self._entries if key[0] == kb_id]
+        for key in stale:
+            self._remove(key)
+        if stale:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and cache size."""
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            'hits': self.hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl
+        }
+
+    def _is_live(self, key: Tuple[str, str, str], entry: _Entry) -> bool:
+        if entry.expires_at > time.monotonic():
+            return True
+        self._remove(key)
+        return False
+
+    def _remove(self, key: Tuple[str, str, str]) -> None:
+        entry = self._entries.pop(key)
+        if entry.vector is not None:
+            bucket = self._vectors[(entry.kb_id, entry.scope)]
+            bucket['keys'].remove(key)
+            bucket['matrix'] = None
+            if not bucket['keys']:
+                del self._vectors[(entry.kb_id, entry.scope)]
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
@@ -0,0 +1,54 @@
+"""
+Retrieval Metrics
+Latency percentiles and ranking quality measures for retrieval tests.
+
+Quality measures take the ranked chunk IDs a query returned and the set of
+chunk IDs labeled relevant for it. Relevance is binary.
+"""
+
+import math
+from typing import Collection, Dict, Sequence
+
+import numpy as np
+
+
+def latency_percentiles(latencies: Sequence[float]) -> Dict[str, float]:
+    """p50/p95/p99 and max of per-query wall times, in seconds."""
+    if not latencies:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(latencies, dtype=np.float64), [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(max(latencies))}
+
+
+def recall_at_k(ranked: Sequence[str], relevant: Collection[str], k: int) -> float:
+    """Fraction of the relevant chunks found in the first k results."""
+    if not relevant:
+        return 1.0
+    return len(set(ranked[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked: Sequence[str], relevant: Collection[str]) -> float:
+    """1 / rank of the first relevant result; 0 when none is returned."""
+    for rank, chunk_id in enumerate(ranked, start=1):
+        if chunk_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: Sequence[str], relevant: Collection[str], k: int) -> float:
+    """Normalised discounted cumulative gain of the first k results."""
+    if not relevant:
+        return 1.0
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, chunk_id in enumerate(ranked[:k], start=1) if chunk_id in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal
+
+
+def ranking_quality(ranked: Sequence[str], relevant: Collection[str], k: int) -> Dict[str, float]:
+    """recall@k, reciprocal rank and nDCG@k of one query's results."""
+    relevant = set(relevant)
+    return {
+        'recall_at_k': recall_at_k(ranked, relevant, k),
+        'reciprocal_rank': reciprocal_rank(ranked[:k], relevant),
+        'ndcg_at_k': ndcg_at_k(ranked, relevant, k)
+    }
@@ -0,0 +1,39 @@
+"""
+Timestamps
+Epoch-nanosecond timestamps for conversation hot paths.
+
+Conversations and messages record time as integer nanoseconds since the
+Unix epoch (time.time_ns()): taking one is a single syscall, comparing and
+subtracting them is integer arithmetic, and they serialise as plain JSON
+numbers. ISO 8601 strings are produced only where a timestamp leaves the
+server, with to_iso().
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+NS_PER_SECOND = 1_000_000_000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def now_ns() -> int:
+    """Current time in epoch nanoseconds."""
+    return time.time_ns()
+
+
+def to_iso(timestamp: int) -> str:
+    """ISO 8601 UTC rendering of an epoch-nanosecond timestamp (microsecond precision)."""
+    return (_EPOCH + timedelta(microseconds=timestamp // 1000)).isoformat()
+
+
+def to_epoch_ns(timestamp: Union[int, str]) -> int:
+    """Epoch nanoseconds from a timestamp that may still be an ISO string (records written before epoch timestamps)."""
+    if isinstance(timestamp, int):
+        return timestamp
+    moment = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    delta = moment - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * NS_PER_SECOND + delta.microseconds * 1000
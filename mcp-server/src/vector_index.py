@@ -0,0 +1,802 @@
+"""
+Vector Index
+In-process NumPy vector indexes backing knowledge base retrieval.
+
+Indexes can keep a compact copy of their vectors (float16, or int8 with a
+per-vector scale) for scanning. The best candidates from the compact scan
+are re-scored against the full-precision float32 vectors, which usually stay
+on disk behind a memmap and are only paged in for those few rows.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+SUPPORTED_METRICS = ('cosine', 'dot', 'l2')
+
+QUANTIZATION_TYPES = ('float32', 'float16', 'int8')
+
+CODE_DTYPES = {'float16': np.float16, 'int8': np.int8}
+
+# Rows scored per block when scanning quantized codes
+_SCAN_BLOCK_ROWS = 4096
+
+_METRIC_ALIASES = {
+    'euclidean': 'l2',
+    'inner_product': 'dot',
+    'ip': 'dot'
+}
+
+
+def normalize_metric(metric: str) -> str:
+    """Resolve a distance metric name to one of SUPPORTED_METRICS."""
+    metric = _METRIC_ALIASES.get(metric, metric)
+    if metric not in SUPPORTED_METRICS:
+        raise ValueError(f"Unsupported distance metric: {metric}")
+    return metric
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return indices of the k highest scores, best first."""
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= scores.size:
+        return np.argsort(-scores, kind='stable')
+    partition = np.argpartition(-scores, k - 1)[:k]
+    return partition[np.argsort(-scores[partition], kind='stable')]
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Encode float32 vectors as (codes, per-vector scales).
+    
+    int8 uses symmetric per-vector scaling; float16 needs no scales.
+    """
+    if quantization == 'float16':
+        return vectors.astype(np.float16), None
+    if quantization == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, np.newaxis]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unsupported quantization: {quantization}")
+
+
+class FlatVectorIndex:
+    """Brute-force vector index over a contiguous float32 matrix.
+    
+    Exact unless quantization is 'float16' or 'int8', in which case the scan
+    uses quantized codes and the top rerank_factor * top_k candidates are
+    re-scored at full precision.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        metric: str = 'cosine',
+        initial_capacity: int = 1024,
+        quantization: str = 'float32',
+        rerank_factor: int = 4
+    ):
+        if quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        self.dimensions = dimensions
+        self.metric = normalize_metric(metric)
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
+        capacity = max(initial_capacity, 1)
+        self._vectors = np.empty((capacity, dimensions), dtype=np.float32)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        if self.is_quantized:
+            self._codes = np.empty((capacity, dimensions), dtype=CODE_DTYPES[quantization])
+            self._scales = np.ones(capacity, dtype=np.float32)
+        self._count = 0
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        # Cumulative scan work: query vectors ranked, rows scored, candidates re-scored
+        self.scan_stats = {'queries': 0, 'rows_scanned': 0, 'rows_rescored': 0}
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def is_quantized(self) -> bool:
+        return self.quantization != 'float32'
+
+    @property
+    def is_approximate(self) -> bool:
+        """Whether search may miss some of the exact top-k results."""
+        return self.is_quantized
+
+    @property
+    def codes(self) -> Optional[np.ndarray]:
+        """Quantized codes of the stored vectors, if quantized."""
+        return self._codes[:self._count] if self._codes is not None else None
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        """Per-vector int8 scales, if int8 quantized."""
+        return self._scales[:self._count] if self.quantization == 'int8' else None
+
+    @property
+    def deleted_count(self) -> int:
+        """Number of tombstoned rows."""
+        return self._deleted_count
+
+    @property
+    def live_count(self) -> int:
+        """Number of rows that can be returned by search."""
+        return self._count - self._deleted_count
+
+    @property
+    def tombstones(self) -> np.ndarray:
+        """Boolean mask of tombstoned rows."""
+        return self._tombstone_mask()
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """View of the stored (prepared) vectors."""
+        return self._vectors[:self._count]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        """Squared norms of the stored vectors."""
+        return self._sq_norms[:self._count]
+
+    def attach(
+        self,
+        vectors: np.ndarray,
+        sq_norms: np.ndarray,
+        codes: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None
+    ) -> None:
+        """Serve already-prepared vectors (e.g. a read-only memmap) without copying.
+        
+        Quantized indexes take their codes (and int8 scales) the same way;
+        missing codes are computed from the vectors. The arrays are only
+        copied into RAM if more vectors are added later.
+        """
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Expected an (n, {self.dimensions}) matrix")
+        self._vectors = vectors
+        self._sq_norms = sq_norms
+        self._count = len(vectors)
+
+        if self.is_quantized:
+            if codes is None:
+                codes, scales = self.quantize_blocks(vectors)
+            if len(codes) != self._count:
+                raise ValueError("Quantized codes do not match the stored vectors")
+            self._codes = codes
+            self._scales = scales if scales is not None else np.ones(self._count, dtype=np.float32)
+
+    def quantize_blocks(
+        self,
+        vectors: np.ndarray,
+        block_rows: int = 65536
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Quantize prepared vectors block by block."""
+        blocks = [quantize(np.asarray(vectors[start:start + block_rows]), self.quantization)
+                  for start in range(0, len(vectors), block_rows)]
+        if not blocks:
+            return np.empty((0, self.dimensions), dtype=CODE_DTYPES[self.quantization]), np.empty(0, dtype=np.float32)
+        codes = np.concatenate([block[0] for block in blocks])
+        scales = np.concatenate([block[1] for block in blocks]) if self.quantization == 'int8' else None
+        return codes, scales
+
+    def add(self, vectors: np.ndarray) -> List[int]:
+        """Append vectors to the index and return their row numbers."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        if vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Expected {self.dimensions}-dimensional vectors, got {vectors.shape[1]}"
+            )
+
+        vectors = self.prepare(vectors)
+        start = self._count
+        self._ensure_capacity(start + len(vectors))
+        self._vectors[start:start + len(vectors)] = vectors
+        self._sq_norms[start:start + len(vectors)] = np.einsum('ij,ij->i', vectors, vectors)
+        if self.is_quantized:
+            codes, scales = quantize(vectors, self.quantization)
+            self._codes[start:start + len(vectors)] = codes
+            if scales is not None:
+                self._scales[start:start + len(vectors)] = scales
+        self._count += len(vectors)
+
+        return list(range(start, self._count))
+
+    def delete(self, rows: Sequence[int]) -> None:
+        """Tombstone rows so they are skipped by search.
+        
+        Rows keep their position; space is only reclaimed by rebuilding the index.
+        """
+        mask = self._tombstone_mask()
+        mask[np.asarray(rows, dtype=np.int64)] = True
+        self._deleted_count = int(mask.sum())
+
+    def restore_tombstones(self, mask: np.ndarray) -> None:
+        """Restore a persisted tombstone mask."""
+        if len(mask) != self._count:
+            raise ValueError("Tombstone mask does not match the stored vectors")
+        self._deleted = np.asarray(mask, dtype=bool).copy()
+        self._deleted_count = int(self._deleted.sum())
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        threshold: Optional[float] = None,
+        allowed: Optional[np.ndarray] = None,
+        **search_params: Any
+    ) -> List[Tuple[int, float]]:
+        """Return (row, score) pairs for the top_k most similar vectors.
+        
+        allowed is an optional boolean row mask (see metadata_index); only
+        live rows it allows are scored.
+        """
+        if self._count == 0:
+            return []
+        query = self.prepare(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        if allowed is not None:
+            rows = self._allowed_rows(allowed)
+            return self._rank(query, rows, top_k, threshold) if rows.size else []
+        return self._rank(query, None, top_k, threshold)
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        threshold: Optional[float] = None,
+        allowed: Optional[np.ndarray] = None,
+        **search_params: Any
+    ) -> List[List[Tuple[int, float]]]:
+        """Return (row, score) pairs per query, scoring all queries together.
+        
+        Each block of stored vectors is scored against every query with one
+        matrix-matrix product, so the vectors are read once per batch.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimensions)
+        if self._count == 0 or len(queries) == 0:
+            return [[] for _ in queries]
+        queries = self.prepare(queries)
+        rows = self._allowed_rows(allowed) if allowed is not None else None
+        return self._rank_batch(queries, rows, top_k, threshold)
+
+    def search_exact(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        threshold: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """Brute-force search over every stored vector at full precision."""
+        if self._count == 0:
+            return []
+        query = self.prepare(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        return self._rank(query, None, top_k, threshold, exact=True)
+
+    def train(self) -> None:
+        """Flat indexes need no training."""
+
+    def estimate_recall(self, sample_size: int = 32, top_k: int = 10, seed: int = 0) -> float:
+        """Estimate recall@top_k of search against exact search.
+        
+        Stored vectors are sampled as queries; the exact results for all of
+        them come from a single blockwise pass over the full-precision vectors.
+        """
+        live_rows = np.flatnonzero(~self._tombstone_mask())
+        if not self.is_approximate or live_rows.size == 0:
+            return 1.0
+
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(live_rows, min(sample_size, live_rows.size), replace=False)
+        queries = np.array(self._vectors[np.sort(sample)], dtype=np.float32)
+        k = min(top_k, self.live_count)
+        exact_scores = self._exact_top_k_scores(queries, k)
+
+        hits = 0
+        for query, scores in zip(queries, exact_scores):
+            # Tie-aware: any result scoring at least the exact k-th score counts
+            kth_score = scores[-1] - 1e-6
+            hits += min(k, sum(1 for _, score in self.search(query, k) if score >= kth_score))
+        return hits / (k * len(queries))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return index size statistics.
+        
+        memory_bytes is what a scan touches: the quantized codes when
+        quantized, otherwise the float32 vectors.
+        """
+        full_precision_bytes = self._count * self.dimensions * 4
+        if self.is_quantized:
+            scale_bytes = self._scales.itemsize if self.quantization == 'int8' else 0
+            memory_bytes = self._count * (self.dimensions * self._codes.itemsize + scale_bytes)
+        else:
+            memory_bytes = full_precision_bytes
+        return {
+            'index_type': 'flat',
+            'vector_count': self._count,
+            'deleted_count': self._deleted_count,
+            'dimensions': self.dimensions,
+            'distance_metric': self.metric,
+            'quantization': self.quantization,
+            'rerank_factor': self.rerank_factor if self.is_quantized else None,
+            'memory_bytes': memory_bytes,
+            'full_precision_bytes': full_precision_bytes,
+            'compression_ratio': full_precision_bytes / memory_bytes if memory_bytes else 1.0
+        }
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """Normalise vectors for cosine similarity."""
+        if self.metric != 'cosine':
+            return vectors
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _rank(
+        self,
+        query: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int,
+        threshold: Optional[float],
+        exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """Rank stored rows (all live rows when rows is None) for a prepared query.
+        
+        Quantized indexes scan codes, then re-score the best candidates at
+        full precision unless exact is set. rows must exclude tombstones.
+        """
+        available = self.live_count if rows is None else len(rows)
+        self.scan_stats['queries'] += 1
+        self.scan_stats['rows_scanned'] += self._count if rows is None else len(rows)
+        if exact or not self.is_quantized:
+            if rows is None:
+                scores = self._score(query, self.vectors, self._sq_norms[:self._count])
+            else:
+                scores = self._score(query, self._vectors[rows], self._sq_norms[rows])
+        else:
+            scores = self._quantized_scores(query, rows)
+        if rows is None and self._deleted_count:
+            scores[self._tombstone_mask()] = -np.inf
+
+        if exact or not self.is_quantized:
+            positions = top_k_indices(scores, min(top_k, available))
+        else:
+            candidates = top_k_indices(scores, min(top_k * self.rerank_factor, available))
+            candidate_rows = candidates if rows is None else rows[candidates]
+            self.scan_stats['rows_rescored'] += len(candidate_rows)
+            scores = self._score(query, self._vectors[candidate_rows], self._sq_norms[candidate_rows])
+            positions = top_k_indices(scores, top_k)
+            rows = candidate_rows
+
+        results = []
+        for position in positions:
+            score = float(scores[position])
+            if threshold is not None and score < threshold:
+                break
+            results.append((int(position if rows is None else rows[position]), score))
+
+        return results
+
+    def _rank_batch(
+        self,
+        queries: np.ndarray,
+        rows: Optional[np.ndarray],
+        top_k: int,
+        threshold: Optional[float],
+        member: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """Rank rows (all live rows when None) for a batch of prepared queries.
+        
+        member optionally marks, per query, which of rows it may return. The
+        best candidates are kept per query block by block; quantized indexes
+        then re-score theirs at full precision.
+        """
+        count = self._count if rows is None else len(rows)
+        available = self.live_count if rows is None else count
+        k = min(top_k * (self.rerank_factor if self.is_quantized else 1), available)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        if k <= 0:
+            return [[] for _ in queries]
+        self.scan_stats['queries'] += len(queries)
+        self.scan_stats['rows_scanned'] += count * len(queries)
+
+        mask = self._tombstone_mask() if rows is None and self._deleted_count else None
+        for start in range(0, count, _SCAN_BLOCK_ROWS):
+            end = min(start + _SCAN_BLOCK_ROWS, count)
+            block = np.arange(start, end) if rows is None else rows[start:end]
+            if self.is_quantized:
+                scores = self._quantized_score_matrix(queries, block)
+            else:
+                scores = self._score_matrix(queries, self._vectors[block], self._sq_norms[block])
+            if mask is not None:
+                scores[:, mask[start:end]] = -np.inf
+            if member is not None:
+                scores[~member[:, start:end]] = -np.inf
+
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block, scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        if self.is_quantized:
+            self.scan_stats['rows_rescored'] += best_rows.size
+            candidates = np.array(self._vectors[best_rows.ravel()], dtype=np.float32).reshape(*best_rows.shape, -1)
+            dots = np.einsum('qkd,qd->qk', candidates, queries)
+            if self.metric == 'l2':
+                dots = self._l2_similarity(
+                    self._sq_norms[best_rows] - 2.0 * dots + np.einsum('qd,qd->q', queries, queries)[:, np.newaxis]
+                )
+            # Candidates that were masked out keep their -inf score
+            best_scores = np.where(np.isneginf(best_scores), -np.inf, dots)
+
+        results = []
+        for scores, candidate_rows in zip(best_scores, best_rows):
+            hits = []
+            for position in top_k_indices(scores, min(top_k, len(scores))):
+                score = float(scores[position])
+                if score == -np.inf or threshold is not None and score < threshold:
+                    break
+                hits.append((int(candidate_rows[position]), score))
+            results.append(hits)
+        return results
+
+    def _quantized_score_matrix(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Approximate (queries, rows) scores from the quantized codes."""
+        dots = queries @ self._codes[rows].astype(np.float32).T
+        if self.quantization == 'int8':
+            dots *= self._scales[rows][np.newaxis, :]
+        if self.metric != 'l2':
+            return dots
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+        return self._l2_similarity(self._sq_norms[rows][np.newaxis, :] - 2.0 * dots + query_sq_norms[:, np.newaxis])
+
+    def _quantized_scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Approximate scores from the quantized codes, decoded block by block."""
+        count = self._count if rows is None else len(rows)
+        dots = np.empty(count, dtype=np.float32)
+        for start in range(0, count, _SCAN_BLOCK_ROWS):
+            end = min(start + _SCAN_BLOCK_ROWS, count)
+            block = slice(start, end) if rows is None else rows[start:end]
+            dots[start:end] = self._codes[block].astype(np.float32) @ query
+            if self.quantization == 'int8':
+                dots[start:end] *= self._scales[block]
+        if self.metric != 'l2':
+            return dots
+        sq_norms = self._sq_norms[:self._count] if rows is None else self._sq_norms[rows]
+        return self._l2_similarity(sq_norms - 2.0 * dots + float(query @ query))
+
+    def _exact_top_k_scores(self, queries: np.ndarray, k: int, block_rows: int = 16384) -> np.ndarray:
+        """Exact k best scores per prepared query, best first, in one pass over the vectors."""
+        best = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        mask = self._tombstone_mask()
+        for start in range(0, self._count, block_rows):
+            end = min(start + block_rows, self._count)
+            scores = self._score_matrix(queries, self._vectors[start:end], self._sq_norms[start:end])
+            scores[:, mask[start:end]] = -np.inf
+            merged = np.concatenate([best, scores], axis=1)
+            best = -np.partition(-merged, k - 1, axis=1)[:, :k]
+        return -np.sort(-best, axis=1)
+
+    def _score(self, query: np.ndarray, vectors: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """Score a prepared query against vectors; higher is more similar."""
+        dots = vectors @ query
+        if self.metric != 'l2':
+            return dots
+        return self._l2_similarity(sq_norms - 2.0 * dots + float(query @ query))
+
+    def _score_matrix(self, queries: np.ndarray, vectors: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """Score prepared queries against vectors with one matrix product: (queries, vectors)."""
+        dots = queries @ vectors.T
+        if self.metric != 'l2':
+            return dots
+        query_sq_norms = np.einsum('ij,ij->i', queries, queries)
+        return self._l2_similarity(sq_norms[np.newaxis, :] - 2.0 * dots + query_sq_norms[:, np.newaxis])
+
+    @staticmethod
+    def _l2_similarity(sq_distances: np.ndarray) -> np.ndarray:
+        """Map squared L2 distance onto a (0, 1] similarity so thresholds stay meaningful."""
+        return 1.0 / (1.0 + np.sqrt(np.maximum(sq_distances, 0.0)))
+
+    def _allowed_rows(self, allowed: np.ndarray) -> np.ndarray:
+        """Live rows set in a boolean row mask."""
+        allowed = allowed[:self._count]
+        if self._deleted_count:
+            allowed = allowed & ~self._tombstone_mask()[:len(allowed)]
+        return np.flatnonzero(allowed)
+
+    def _tombstone_mask(self) -> np.ndarray:
+        """Tombstone mask covering every stored row."""
+        if len(self._deleted) < self._count:
+            self._deleted = np.concatenate([self._deleted, np.zeros(self._count - len(self._deleted), dtype=bool)])
+        return self._deleted[:self._count]
+
+    def _ensure_capacity(self, required: int) -> None:
+        """Grow the backing matrix geometrically."""
+        capacity = len(self._vectors)
+        if required <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < required:
+            capacity *= 2
+        vectors = np.empty((capacity, self.dimensions), dtype=np.float32)
+        vectors[:self._count] = self._vectors[:self._count]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self._count] = self._sq_norms[:self._count]
+        self._vectors = vectors
+        self._sq_norms = sq_norms
+        if self.is_quantized:
+            codes = np.empty((capacity, self.dimensions), dtype=self._codes.dtype)
+            codes[:self._count] = self._codes[:self._count]
+            scales = np.ones(capacity, dtype=np.float32)
+            scales[:self._count] = self._scales[:self._count]
+            self._codes = codes
+            self._scales = scales
+
+
+class IVFVectorIndex(FlatVectorIndex):
+    """Inverted-file (IVF) approximate index with k-means coarse quantisation.
+    
+    Vectors are bucketed under their nearest centroid; queries only scan the
+    `nprobe` closest buckets. Raising nprobe trades latency for recall.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        metric: str = 'cosine',
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        initial_capacity: int = 1024,
+        training_iterations: int = 10,
+        seed: int = 0,
+        quantization: str = 'float32',
+        rerank_factor: int = 4
+    ):
+        super().__init__(dimensions, metric, initial_capacity, quantization, rerank_factor)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.training_iterations = training_iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists: List[np.ndarray] = []
+
+    @property
+    def is_approximate(self) -> bool:
+        return True
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def assignments(self) -> np.ndarray:
+        """Bucket id of each stored vector."""
+        return self._assignments
+
+    def restore_partitions(self, centroids: np.ndarray, assignments: np.ndarray) -> None:
+        """Restore a previously trained partitioning."""
+        if len(assignments) != self._count:
+            raise ValueError("IVF assignments do not match the stored vectors")
+        self.centroids = centroids
+        self._assignments = assignments
+        self._rebuild_lists()
+
+    def attach(
+        self,
+        vectors: np.ndarray,
+        sq_norms: np.ndarray,
+        codes: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None
+    ) -> None:
+        """Serve prepared vectors, assigning rows beyond the trained ones to buckets."""
+        super().attach(vectors, sq_norms, codes, scales)
+        if self.is_trained and len(self._assignments) < self._count:
+            self._assign(len(self._assignments), self._count)
+
+    def add(self, vectors: np.ndarray) -> List[int]:
+        """Append vectors, assigning them to buckets when already trained."""
+        rows = super().add(vectors)
+        if self.is_trained and rows:
+            self._assign(rows[0], rows[-1] + 1)
+        return rows
+
+    def train(self) -> None:
+        """Cluster the stored vectors and build the inverted lists."""
+        if self._count == 0:
+            return
+
+        nlist = self.nlist or self.default_nlist(self._count)
+        nlist = max(1, min(nlist, self._count))
+        rng = np.random.default_rng(self.seed)
+
+        # Train on a bounded sample; assignment of the full set happens afterwards
+        sample_size = min(self._count, nlist * 64)
+        sample = self.vectors[rng.choice(self._count, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.training_iterations):
+            labels = self._nearest_centroids(sample, centroids, 1)[:, 0]
+            counts = np.bincount(labels, minlength=nlist)
+            occupied = np.flatnonzero(counts)
+            order = np.argsort(labels, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[occupied]
+            # Empty clusters keep their previous centroid
+            centroids[occupied] = np.add.reduceat(sample[order], starts, axis=0) / counts[occupied, np.newaxis]
+            centroids = self.prepare(centroids)
+
+        self.centroids = centroids.astype(np.float32)
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._assign(0, self._count)
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        threshold: Optional[float] = None,
+        allowed: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Return approximate (row, score) pairs scanning only nprobe buckets.
+        
+        With an allowed row mask that admits fewer rows than the probed
+        buckets would hold, the allowed rows are scanned directly instead,
+        so selective filters are both cheaper and exact.
+        """
+        if self._count == 0:
+            return []
+        if not self.is_trained:
+            if allowed is not None:
+                return super().search(query, top_k, threshold, allowed=allowed)
+            return self.search_exact(query, top_k, threshold)
+
+        query = self.prepare(np.asarray(query, dtype=np.float32).reshape(1, -1))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        if allowed is not None:
+            rows = self._allowed_rows(allowed)
+            if rows.size <= self._count * nprobe / len(self.centroids):
+                return self._rank(query[0], rows, top_k, threshold) if rows.size else []
+
+        probes = self._nearest_centroids(query, self.centroids, nprobe)[0]
+        candidates = np.concatenate([self._lists[probe] for probe in probes])
+        if self._deleted_count:
+            candidates = candidates[~self._tombstone_mask()[candidates]]
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if candidates.size == 0:
+            return []
+
+        return self._rank(query[0], candidates, top_k, threshold)
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        top_k: int,
+        threshold: Optional[float] = None,
+        allowed: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """Return approximate (row, score) pairs per query in one pass.
+        
+        The union of every query's probed buckets is scored with one matrix
+        product; each query only keeps rows from its own buckets.
+        """
+        if not self.is_trained or self._count == 0:
+            return super().search_batch(queries, top_k, threshold, allowed=allowed)
+
+        queries = self.prepare(np.asarray(queries, dtype=np.float32).reshape(-1, self.dimensions))
+        if len(queries) == 0:
+            return []
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        if allowed is not None:
+            rows = self._allowed_rows(allowed)
+            if rows.size <= self._count * nprobe / len(self.centroids):
+                return self._rank_batch(queries, rows, top_k, threshold)
+
+        probes = self._nearest_centroids(queries, self.centroids, nprobe)
+        candidates = np.concatenate([self._lists[probe] for probe in np.unique(probes)])
+        if self._deleted_count:
+            candidates = candidates[~self._tombstone_mask()[candidates]]
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if candidates.size == 0:
+            return [[] for _ in queries]
+
+        probed = np.zeros((len(queries), len(self.centroids)), dtype=bool)
+        probed[np.arange(len(queries))[:, np.newaxis], probes] = True
+        return self._rank_batch(queries, candidates, top_k, threshold, member=probed[:, self._assignments[candidates]])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return index size and partitioning statistics."""
+        stats = super().get_stats()
+        centroid_bytes = self.centroids.nbytes if self.is_trained else 0
+        stats.update({
+            'index_type': 'ivf',
+            'nlist': len(self.centroids) if self.is_trained else self.nlist,
+            'nprobe': self.nprobe,
+            'trained': self.is_trained,
+            'memory_bytes': stats['memory_bytes'] + centroid_bytes + self._assignments.nbytes
+        })
+        return stats
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        """Heuristic bucket count: roughly 4 * sqrt(n), capped at 4096."""
+        return int(min(4096, max(1, 4 * np.sqrt(count))))
+
+    def _assign(self, start: int, end: int, batch_size: int = 16384) -> None:
+        """Assign rows [start, end) to their nearest centroid and rebuild lists."""
+        labels = [
+            self._nearest_centroids(self._vectors[offset:min(offset + batch_size, end)], self.centroids, 1)[:, 0]
+            for offset in range(start, end, batch_size)
+        ]
+        self._assignments = np.concatenate([self._assignments, *labels]).astype(np.int32)
+        self._rebuild_lists()
+
+    def _rebuild_lists(self) -> None:
+        """Group row ids by bucket."""
+        order = np.argsort(self._assignments, kind='stable')
+        boundaries = np.searchsorted(self._assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [
+            order[boundaries[bucket]:boundaries[bucket + 1]]
+            for bucket in range(len(self.centroids))
+        ]
+
+    def _nearest_centroids(self, vectors: np.ndarray, centroids: np.ndarray, count: int) -> np.ndarray:
+        """Return the `count` nearest centroid ids for each vector."""
+        if self.metric == 'dot':
+            # Inner-product buckets are still formed by L2 proximity
+            scores = vectors @ centroids.T - 0.5 * np.einsum('ij,ij->i', centroids, centroids)
+        elif self.metric == 'cosine':
+            scores = vectors @ centroids.T
+        else:
+            scores = 2.0 * (vectors @ centroids.T) - np.einsum('ij,ij->i', centroids, centroids)
+
+        count = min(count, centroids.shape[0])
+        if count == 1:
+            return np.argmax(scores, axis=1)[:, np.newaxis]
+        partition = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        ranked = np.take_along_axis(scores, partition, axis=1)
+        return np.take_along_axis(partition, np.argsort(-ranked, axis=1), axis=1)
+
+
+INDEX_TYPES = ('flat', 'ivf', 'auto')
+
+# Knowledge bases above this many chunks switch to IVF when index_type is 'auto'
+AUTO_ANN_THRESHOLD = 200_000
+
+
+def create_index(
+    dimensions: int,
+    metric: str = 'cosine',
+    index_type: str = 'auto',
+    expected_size: int = 0,
+    nlist: Optional[int] = None,
+    nprobe: int = 8,
+    quantization: str = 'float32',
+    rerank_factor: int = 4
+) -> FlatVectorIndex:
+    """Create a vector index of the requested type."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}")
+
+    if index_type == 'auto':
+        index_type = 'ivf' if expected_size >= AUTO_ANN_THRESHOLD else 'flat'
+
+    capacity = max(expected_size, 1024)
+    if index_type == 'ivf':
+        return IVFVectorIndex(
+            dimensions, metric, nlist=nlist, nprobe=nprobe, initial_capacity=capacity,
+            quantization=quantization, rerank_factor=rerank_factor
+        )
+    return FlatVectorIndex(
+        dimensions, metric, initial_capacity=capacity, quantization=quantization, rerank_factor=rerank_factor
+    )
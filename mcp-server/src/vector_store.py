@@ -0,0 +1,572 @@
+"""
+Vector Store
+Compact on-disk layout for knowledge bases, opened with mmap on load.
+
+Each knowledge base directory holds:
+
+    manifest.json          knowledge base config, counts and file layout
+    vectors.bin            (count, dimensions) matrix of index-ready vectors
+    sq_norms.bin           float32 squared norm per vector (L2 scoring)
+    vector_codes.bin       float16 or int8 quantized vectors (quantized indexes only)
+    vector_scales.bin      float32 scale per vector (int8 indexes only)
+    chunks.bin             concatenated UTF-8 chunk texts
+    chunk_offsets.bin      uint64 byte offsets into chunks.bin (count + 1)
+    metadata.bin           concatenated UTF-8 JSON chunk metadata
+    metadata_offsets.bin   uint64 byte offsets into metadata.bin (count + 1)
+    ivf_centroids.bin      float32 IVF centroids (IVF indexes only)
+    ivf_assignments.bin    int32 bucket per vector (IVF indexes only)
+    tombstones.bin         uint8 deleted flag per vector (after incremental updates)
+    lexical_*.bin/.json    BM25 inverted index over the chunk texts (see lexical_index)
+    metadata_*.bin/.json   posting lists for metadata filters (see metadata_index)
+    documents.json         content hash and chunk rows of each source document
+
+Document processing streams chunks into a `staging/` subdirectory with the
+same record files plus raw vectors. Committing moves them into place for a
+new knowledge base, or appends them to an existing one and tombstones the
+rows of changed and removed documents.
+"""
+
+import json
+import os
+import shutil
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .lexical_index import LEXICAL_FILES, LexicalIndex
+    from .metadata_index import METADATA_FILES, MetadataIndex
+    from .vector_index import CODE_DTYPES, FlatVectorIndex, IVFVectorIndex, quantize
+except ImportError:
+    from lexical_index import LEXICAL_FILES, LexicalIndex
+    from metadata_index import METADATA_FILES, MetadataIndex
+    from vector_index import CODE_DTYPES, FlatVectorIndex, IVFVectorIndex, quantize
+
+LAYOUT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+
+STAGING_DIR = 'staging'
+
+STAGING_MANIFEST_FILE = 'staging.json'
+
+DOCUMENTS_FILE = 'documents.json'
+
+TOMBSTONES_FILE = 'tombstones.bin'
+
+_RECORD_FILES = ('chunks.bin', 'chunk_offsets.bin', 'metadata.bin', 'metadata_offsets.bin')
+
+
+class ChunkTable(Sequence):
+    """Read-only chunk records decoded lazily from mmap'd text and metadata."""
+
+    def __init__(self, directory: Path, count: Optional[int] = None):
+        self._texts = _map_bytes(directory / 'chunks.bin')
+        self._text_offsets = np.memmap(directory / 'chunk_offsets.bin', dtype=np.uint64, mode='r')
+        self._metadata = _map_bytes(directory / 'metadata.bin')
+        self._metadata_offsets = np.memmap(directory / 'metadata_offsets.bin', dtype=np.uint64, mode='r')
+        if count is not None:
+            # Ignore records appended after the last manifest was written
+            self._text_offsets = self._text_offsets[:count + 1]
+            self._metadata_offsets = self._metadata_offsets[:count + 1]
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+
+        chunk = json.loads(_slice(self._metadata, self._metadata_offsets, row))
+        chunk['text'] = _slice(self._texts, self._text_offsets, row)
+        return chunk
+
+
+class StagingWriter:
+    """Appends embedded chunks to a staging area as they stream in."""
+
+    def __init__(self, directory: Path, dimensions: int):
+        directory.mkdir(parents=True)
+        self.directory = directory
+        self.dimensions = dimensions
+        self.chunk_count = 0
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.removed: List[str] = []
+        self.embedding_config: Dict[str, Any] = {}
+        self.lexical = LexicalIndex()
+        self.metadata = MetadataIndex()
+        self._vectors = open(directory / 'vectors.bin', 'wb')
+        self._texts = _RecordWriter(directory / 'chunks.bin', directory / 'chunk_offsets.bin')
+        self._metadata = _RecordWriter(directory / 'metadata.bin', directory / 'metadata_offsets.bin')
+
+    def append(self, chunks: Sequence, vectors: np.ndarray) -> None:
+        """Append a batch of chunks (see chunking.Chunk) with their embeddings."""
+        if len(chunks) != len(vectors):
+            raise ValueError("Each staged chunk needs exactly one vector")
+        np.ascontiguousarray(vectors, dtype=np.float32).tofile(self._vectors)
+        self._texts.write(chunk.text.encode('utf-8') for chunk in chunks)
+        metadata = [chunk.metadata() for chunk in chunks]
+        self._metadata.write(json.dumps(record).encode('utf-8') for record in metadata)
+        self.lexical.add(chunk.text for chunk in chunks)
+        self.metadata.add(metadata)
+        self.chunk_count += len(chunks)
+
+    def add_document(self, source: str, record: Dict[str, Any]) -> None:
+        """Record a processed document.
+        
+        record holds its content_hash, token_count, the existing rows it
+        keeps (kept_rows) and the [start, end) range of its staged chunks.
+        """
+        self.documents[source] = record
+
+    def remove_document(self, source: str) -> None:
+        """Record a document whose chunks should be tombstoned."""
+        self.removed.append(source)
+
+    def close(self, document_count: int, token_count: int = 0) -> None:
+        """Flush staged files and mark the staging area complete."""
+        self._vectors.close()
+        self._texts.close()
+        self._metadata.close()
+        self.lexical.save(self.directory)
+        for record in self.documents.values():
+            self.metadata.set_modified(range(*record['staged']), record.get('modified_at'))
+        self.metadata.save(self.directory)
+        staged = {
+            'chunk_count': self.chunk_count,
+            'document_count': document_count,
+            'token_count': token_count,
+            'dimensions': self.dimensions,
+            'embedding_config': self.embedding_config,
+            'documents': self.documents,
+            'removed': self.removed
+        }
+        _atomic_write(self.directory / STAGING_MANIFEST_FILE, json.dumps(staged).encode('utf-8'))
+
+    def abort(self) -> None:
+        """Discard a partially written staging area."""
+        for f in (self._vectors, self._texts, self._metadata):
+            f.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class _RecordWriter:
+    """Streams variable-length records into a data file plus a uint64 offsets file."""
+
+    def __init__(self, data_path: Path, offsets_path: Path):
+        self._data = open(data_path, 'wb')
+        self._offsets = open(offsets_path, 'wb')
+        self._position = 0
+        np.zeros(1, dtype=np.uint64).tofile(self._offsets)
+
+    def write(self, records: Iterable[bytes]) -> None:
+        offsets = []
+        for record in records:
+            self._data.write(record)
+            self._position += len(record)
+            offsets.append(self._position)
+        np.asarray(offsets, dtype=np.uint64).tofile(self._offsets)
+
+    def close(self) -> None:
+        self._data.close()
+        self._offsets.close()
+
+
+class KnowledgeBaseStore:
+    """Persists knowledge bases under one storage root, one directory each."""
+
+    def __init__(self, storage_dir: Path):
+        self.storage_dir = Path(storage_dir)
+
+    def path(self, kb_id: str) -> Path:
+        """Directory holding a knowledge base."""
+        return self.storage_dir / kb_id
+
+    def exists(self, kb_id: str) -> bool:
+        """Check whether a complete knowledge base has been stored."""
+        return (self.path(kb_id) / MANIFEST_FILE).exists()
+
+    def has_staging(self, kb_id: str) -> bool:
+        """Check whether processed chunks are waiting to be indexed."""
+        return (self.path(kb_id) / STAGING_DIR / STAGING_MANIFEST_FILE).exists()
+
+    def open_staging(self, kb_id: str, dimensions: int) -> 'StagingWriter':
+        """Start a fresh staging area for streamed chunks."""
+        staging = self.path(kb_id) / STAGING_DIR
+        if staging.exists():
+            shutil.rmtree(staging)
+        return StagingWriter(staging, dimensions)
+
+    def read_staging(self, kb_id: str) -> Dict[str, Any]:
+        """Read the staging manifest."""
+        with open(self.path(kb_id) / STAGING_DIR / STAGING_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def commit_staging(self, kb_id: str, index: FlatVectorIndex, block_rows: int = 8192) -> None:
+        """Move staged chunks into the knowledge base and attach them to the index.
+        
+        Vectors are prepared for the index metric block by block, so memory use
+        does not grow with the size of the knowledge base.
+        """
+        directory = self.path(kb_id)
+        staging = directory / STAGING_DIR
+        staged = self.read_staging(kb_id)
+        count, dimensions = staged['chunk_count'], staged['dimensions']
+        if dimensions != index.dimensions:
+            raise ValueError(
+                f"Staged vectors have {dimensions} dimensions, index expects {index.dimensions}"
+            )
+
+        raw = _map_array(staging / 'vectors.bin', np.float32, (count, dimensions))
+        with _VectorFiles(directory, index, suffix='.tmp') as files:
+            for start in range(0, count, block_rows):
+                files.write(index.prepare(np.array(raw[start:start + block_rows], dtype=np.float32)))
+        del raw
+
+        for name in _VectorFiles.names(index):
+            os.replace(directory / (name + '.tmp'), directory / name)
+        for name in ('vector_codes.bin', 'vector_scales.bin'):
+            # Codes left over from a previous quantization setting
+            if name not in _VectorFiles.names(index) and (directory / name).exists():
+                os.remove(directory / name)
+        for name in _RECORD_FILES + LEXICAL_FILES + METADATA_FILES:
+            os.replace(staging / name, directory / name)
+        if (directory / TOMBSTONES_FILE).exists():
+            os.remove(directory / TOMBSTONES_FILE)
+
+        documents, _ = _merge_documents({}, staged, 0)
+        _atomic_write(directory / DOCUMENTS_FILE, json.dumps(documents).encode('utf-8'))
+        shutil.rmtree(staging)
+
+        index.attach(*_map_vectors(directory, index.quantization, count, dimensions))
+
+    def append_staging(self, kb_id: str, index: FlatVectorIndex, block_rows: int = 8192) -> Dict[str, int]:
+        """Append staged chunks to a stored knowledge base and tombstone replaced rows.
+        
+        Only the staged (new or changed) chunks are written; existing rows are
+        never rewritten. The caller must write the manifest afterwards.
+        Returns the number of documents and tokens now in the knowledge base.
+        """
+        directory = self.path(kb_id)
+        staging = directory / STAGING_DIR
+        staged = self.read_staging(kb_id)
+        count, dimensions = staged['chunk_count'], index.dimensions
+        if staged['dimensions'] != dimensions:
+            raise ValueError(
+                f"Staged vectors have {staged['dimensions']} dimensions, index expects {dimensions}"
+            )
+
+        # Drop anything appended after the last manifest, e.g. by an interrupted update
+        base = self.read_manifest(kb_id)['vector_count']
+        raw = _map_array(staging / 'vectors.bin', np.float32, (count, dimensions))
+        with _VectorFiles(directory, index, append_after=base) as files:
+            for start in range(0, count, block_rows):
+                files.write(index.prepare(np.array(raw[start:start + block_rows], dtype=np.float32)))
+        del raw
+
+        _append_records(directory / 'chunks.bin', directory / 'chunk_offsets.bin',
+                        staging / 'chunks.bin', staging / 'chunk_offsets.bin', base)
+        _append_records(directory / 'metadata.bin', directory / 'metadata_offsets.bin',
+                        staging / 'metadata.bin', staging / 'metadata_offsets.bin', base)
+
+        lexical = self.load_lexical(kb_id, base)
+        lexical.extend(LexicalIndex.load(staging))
+        lexical.save(directory)
+
+        documents, tombstoned = _merge_documents(self.read_documents(kb_id), staged, base)
+
+        # Kept rows of changed documents take the new modification time
+        metadata = self.load_metadata(kb_id, base)
+        metadata.extend(MetadataIndex.load(staging))
+        for source in staged.get('documents', {}):
+            metadata.set_modified(documents[source]['rows'], documents[source].get('modified_at'))
+        metadata.save(directory)
+        _atomic_write(directory / DOCUMENTS_FILE, json.dumps(documents).encode('utf-8'))
+        shutil.rmtree(staging)
+
+        index.attach(*_map_vectors(directory, index.quantization, base + count, dimensions))
+        if tombstoned:
+            index.delete(tombstoned)
+
+        return {
+            'document_count': len(documents),
+            'token_count': sum(document['token_count'] for document in documents.values())
+        }
+
+    def read_documents(self, kb_id: str) -> Dict[str, Dict[str, Any]]:
+        """Read the content hash manifest; empty for stores without one."""
+        path = self.path(kb_id) / DOCUMENTS_FILE
+        if not path.exists():
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_lexical(self, kb_id: str, count: int) -> LexicalIndex:
+        """Open the BM25 index of the first count rows, building it for stores without one."""
+        directory = self.path(kb_id)
+        lexical = LexicalIndex.load(directory, count)
+        if lexical is None:
+            lexical = LexicalIndex()
+            chunks = ChunkTable(directory, count)
+            lexical.add(chunk['text'] for chunk in chunks)
+            lexical.save(directory)
+        return lexical
+
+    def load_metadata(self, kb_id: str, count: int) -> MetadataIndex:
+        """Open the metadata posting lists of the first count rows, building them for stores without any."""
+        directory = self.path(kb_id)
+        metadata = MetadataIndex.load(directory, count)
+        if metadata is None:
+            metadata = MetadataIndex.build(ChunkTable(directory, count), self.read_documents(kb_id))
+            metadata.save(directory)
+        return metadata
+
+    def write_manifest(self, kb_id: str, kb_config: Dict[str, Any], index: FlatVectorIndex) -> None:
+        """Write index partitions and the manifest that makes the store loadable."""
+        directory = self.path(kb_id)
+
+        index_layout: Dict[str, Any] = {'index_type': 'flat'}
+        if isinstance(index, IVFVectorIndex):
+            index_layout = {'index_type': 'ivf', 'nprobe': index.nprobe, 'trained': index.is_trained}
+            if index.is_trained:
+                _write_array(directory / 'ivf_centroids.bin', index.centroids)
+                _write_array(directory / 'ivf_assignments.bin', index.assignments)
+
+        if index.deleted_count:
+            _write_array(directory / TOMBSTONES_FILE, index.tombstones.astype(np.uint8))
+
+        index_layout['quantization'] = index.quantization
+        index_layout['rerank_factor'] = index.rerank_factor
+
+        manifest = {
+            'layout_version': LAYOUT_VERSION,
+            'knowledge_base': kb_config,
+            'vector_count': len(index),
+            'deleted_count': index.deleted_count,
+            'dimensions': index.dimensions,
+            'distance_metric': index.metric,
+            'vector_dtype': 'float32',
+            'index': index_layout
+        }
+
+        # The manifest is written last so a partially written store is never loaded
+        self._write_manifest(kb_id, manifest)
+
+    def load(self, kb_id: str) -> Tuple[Dict[str, Any], FlatVectorIndex, ChunkTable]:
+        """Open a stored knowledge base without reading its vectors into RAM."""
+        directory = self.path(kb_id)
+        manifest = self.read_manifest(kb_id)
+        if manifest.get('layout_version') != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported knowledge base layout in {directory}")
+
+        dimensions = manifest['dimensions']
+        count = manifest['vector_count']
+        index_layout = manifest['index']
+        quantization = index_layout.get('quantization', 'float32')
+        arrays = _map_vectors(directory, quantization, count, dimensions)
+        settings = {'quantization': quantization, 'rerank_factor': index_layout.get('rerank_factor', 4)}
+
+        if index_layout['index_type'] == 'ivf':
+            index = IVFVectorIndex(dimensions, manifest['distance_metric'], nprobe=index_layout['nprobe'], **settings)
+            index.attach(*arrays)
+            if index_layout.get('trained'):
+                centroids = np.fromfile(directory / 'ivf_centroids.bin', dtype=np.float32).reshape(-1, dimensions)
+                assignments = np.fromfile(directory / 'ivf_assignments.bin', dtype=np.int32)
+                index.restore_partitions(centroids, assignments)
+        else:
+            index = FlatVectorIndex(dimensions, manifest['distance_metric'], **settings)
+            index.attach(*arrays)
+
+        if manifest.get('deleted_count'):
+            index.restore_tombstones(np.fromfile(directory / TOMBSTONES_FILE, dtype=np.uint8)[:count])
+
+        return manifest['knowledge_base'], index, ChunkTable(directory, count)
+
+    def read_manifest(self, kb_id: str) -> Dict[str, Any]:
+        """Read a knowledge base manifest."""
+        with open(self.path(kb_id) / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def update_config(self, kb_id: str, kb_config: Dict[str, Any]) -> None:
+        """Rewrite only the knowledge base configuration in the manifest."""
+        manifest = self.read_manifest(kb_id)
+        manifest['knowledge_base'] = kb_config
+        self._write_manifest(kb_id, manifest)
+
+    def delete(self, kb_id: str) -> bool:
+        """Remove a stored knowledge base."""
+        directory = self.path(kb_id)
+        if not directory.exists():
+            return False
+        shutil.rmtree(directory)
+        return True
+
+    def size_bytes(self, kb_id: str) -> int:
+        """Total size of the files in a knowledge base directory."""
+        directory = self.path(kb_id)
+        if not directory.exists():
+            return 0
+        return sum(path.stat().st_size for path in directory.iterdir() if path.is_file())
+
+    def _write_manifest(self, kb_id: str, manifest: Dict[str, Any]) -> None:
+        _atomic_write(self.path(kb_id) / MANIFEST_FILE, json.dumps(manifest, indent=2).encode('utf-8'))
+
+
+def _write_array(path: Path, array: np.ndarray) -> None:
+    """Write an array's raw bytes atomically."""
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    np.ascontiguousarray(array).tofile(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class _VectorFiles:
+    """Writes prepared vector blocks with their squared norms and quantized codes.
+    
+    With append_after, the files are first truncated to that many rows and
+    then appended to; otherwise they are written fresh with the given suffix.
+    """
+
+    def __init__(self, directory: Path, index: FlatVectorIndex, suffix: str = '', append_after: Optional[int] = None):
+        self.quantization = index.quantization
+        self._files = []
+        row_bytes = {
+            'vectors.bin': index.dimensions * 4,
+            'sq_norms.bin': 4,
+            'vector_codes.bin': index.dimensions * np.dtype(CODE_DTYPES.get(index.quantization, np.float32)).itemsize,
+            'vector_scales.bin': 4
+        }
+        for name in self.names(index):
+            path = directory / (name + suffix)
+            if append_after is not None:
+                os.truncate(path, append_after * row_bytes[name])
+            self._files.append(open(path, 'ab' if append_after is not None else 'wb'))
+
+    @staticmethod
+    def names(index: FlatVectorIndex) -> List[str]:
+        """Files holding the vectors of an index."""
+        names = ['vectors.bin', 'sq_norms.bin']
+        if index.quantization != 'float32':
+            names.append('vector_codes.bin')
+        if index.quantization == 'int8':
+            names.append('vector_scales.bin')
+        return names
+
+    def write(self, block: np.ndarray) -> None:
+        block.tofile(self._files[0])
+        np.einsum('ij,ij->i', block, block).astype(np.float32).tofile(self._files[1])
+        if self.quantization != 'float32':
+            codes, scales = quantize(block, self.quantization)
+            codes.tofile(self._files[2])
+            if scales is not None:
+                scales.tofile(self._files[3])
+
+    def __enter__(self) -> '_VectorFiles':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        for f in self._files:
+            f.close()
+
+
+def _map_vectors(directory: Path, quantization: str, count: int, dimensions: int) -> Tuple:
+    """Memory-map (vectors, sq_norms, codes, scales) of a stored index."""
+    codes = scales = None
+    if quantization != 'float32':
+        codes = _map_array(directory / 'vector_codes.bin', CODE_DTYPES[quantization], (count, dimensions))
+    if quantization == 'int8':
+        scales = _map_array(directory / 'vector_scales.bin', np.float32, (count,))
+    return (
+        _map_array(directory / 'vectors.bin', np.float32, (count, dimensions)),
+        _map_array(directory / 'sq_norms.bin', np.float32, (count,)),
+        codes,
+        scales
+    )
+
+
+def _append_records(
+    data_path: Path,
+    offsets_path: Path,
+    staged_data_path: Path,
+    staged_offsets_path: Path,
+    base: int
+) -> None:
+    """Append staged records after the first `base` records of a record file pair."""
+    offsets = np.fromfile(offsets_path, dtype=np.uint64, count=base + 1)
+    end = int(offsets[base])
+    os.truncate(data_path, end)
+    os.truncate(offsets_path, (base + 1) * 8)
+
+    with open(data_path, 'ab') as data_file, open(staged_data_path, 'rb') as staged_file:
+        shutil.copyfileobj(staged_file, data_file)
+    staged_offsets = np.fromfile(staged_offsets_path, dtype=np.uint64)
+    with open(offsets_path, 'ab') as offsets_file:
+        (staged_offsets[1:] + np.uint64(end)).tofile(offsets_file)
+
+
+def _merge_documents(
+    documents: Dict[str, Dict[str, Any]],
+    staged: Dict[str, Any],
+    base: int
+) -> Tuple[Dict[str, Dict[str, Any]], List[int]]:
+    """Apply staged documents to a content hash manifest.
+    
+    Staged chunks land at rows base + position. Returns the new manifest and
+    the rows that are no longer referenced by any document.
+    """
+    tombstoned: List[int] = []
+
+    for source in staged.get('removed', []):
+        removed = documents.pop(source, None)
+        if removed:
+            tombstoned.extend(removed['rows'])
+
+    for source, record in staged.get('documents', {}).items():
+        start, end = record['staged']
+        rows = record['kept_rows'] + list(range(base + start, base + end))
+        previous = documents.get(source)
+        if previous:
+            kept = set(rows)
+            tombstoned.extend(row for row in previous['rows'] if row not in kept)
+        documents[source] = {
+            'content_hash': record['content_hash'],
+            'token_count': record['token_count'],
+            'modified_at': record.get('modified_at'),
+            'rows': rows
+        }
+
+    return documents, tombstoned
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _map_array(path: Path, dtype: Any, shape: Tuple[int, ...]) -> np.ndarray:
+    """Memory-map a raw array file read-only; empty files map to empty arrays."""
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+def _map_bytes(path: Path) -> Optional[np.ndarray]:
+    """Memory-map a byte file read-only, or None when it is empty."""
+    if path.stat().st_size == 0:
+        return None
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def _slice(data: Optional[np.ndarray], offsets: np.ndarray, row: int) -> str:
+    """Decode one variable-length UTF-8 record."""
+    start, end = int(offsets[row]), int(offsets[row + 1])
+    if data is None or start == end:
+        return ''
+    return data[start:end].tobytes().decode('utf-8')
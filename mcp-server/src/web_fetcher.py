@@ -0,0 +1,254 @@
+"""
+Web Fetcher
+Pooled HTTP fetching of web document sources with conditional requests.
+
+Every fetch goes through one shared httpx.AsyncClient, so connections are
+pooled and reused across URLs (HTTP/2 when the optional h2 package is
+installed). Concurrency is bounded per host. Responses are kept in a
+SQLite cache together with their ETag and Last-Modified validators; a
+re-fetch sends If-None-Match / If-Modified-Since and a 304 is served from
+the cache.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# Content types read as text; HTML is reduced to its visible text by the caller
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/xml', 'application/xhtml+xml')
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+
+class WebFetchError(Exception):
+    """A web source could not be fetched."""
+
+
+class ResponseCache:
+    """Cached response bodies and validators keyed by URL, in SQLite.
+
+    Methods are blocking and thread-safe; async callers run them with
+    asyncio.to_thread. Least recently used entries are evicted beyond
+    max_bytes.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'url TEXT PRIMARY KEY, body TEXT NOT NULL, content_type TEXT, etag TEXT, '
+            'last_modified TEXT, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)')
+        self._connection.commit()
+        self._size_bytes = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Cached response for a URL, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT body, content_type, etag, last_modified FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE responses SET last_used = ? WHERE url = ?', (time.time(), url))
+            self._connection.commit()
+        body, content_type, etag, last_modified = row
+        return {'body': body, 'content_type': content_type, 'etag': etag, 'last_modified': last_modified}
+
+    def put(
+        self,
+        url: str,
+        body: str,
+        content_type: Optional[str],
+        etag: Optional[str],
+        last_modified: Optional[str]
+    ) -> None:
+        """Store a response, replacing any previous one for the URL."""
+        if self.max_bytes <= 0:
+            return
+        size = len(body.encode('utf-8'))
+        with self._lock:
+            previous = self._connection.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(url, body, content_type, etag, last_modified, size, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, body, content_type, etag, last_modified, size, time.time())
+            )
+            self._size_bytes += size - (previous[0] if previous else 0)
+            if self._size_bytes > self.max_bytes:
+                self._evict()
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count and size."""
+        with self._lock:
+            entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {
+            'entries': entries,
+            'size_bytes': self._size_bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions
+        }
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def _evict(self) -> None:
+        """Drop least recently used responses down to 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        rows = self._connection.execute('SELECT url, size FROM responses ORDER BY last_used').fetchall()
+        evicted = []
+        for url, size in rows:
+            if self._size_bytes <= target:
+                break
+            evicted.append((url,))
+            self._size_bytes -= size
+        self._connection.executemany('DELETE FROM responses WHERE url = ?', evicted)
+        self.evictions += len(evicted)
+
+
+class WebFetcher:
+    """Fetches web sources over one pooled client with per-host limits."""
+
+    def __init__(
+        self,
+        cache: Optional[ResponseCache] = None,
+        max_connections: int = 32,
+        per_host_limit: int = 4,
+        timeout: float = 30.0,
+        http2: bool = True,
+        user_agent: str = 'chat-to-rag-agent-creator/1.0'
+    ):
+        self.cache = cache
+        self.max_connections = max(1, max_connections)
+        self.per_host_limit = max(1, per_host_limit)
+        self.timeout = timeout
+        # HTTP/2 needs the optional h2 package
+        self.http2 = http2 and h2 is not None
+        self.user_agent = user_agent
+        self.counters = {'requests': 0, 'downloaded': 0, 'not_modified': 0, 'bytes_downloaded': 0, 'errors': 0}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    async def fetch(self, url: str) -> Dict[str, Any]:
+        """Fetch a URL, revalidating a cached copy with a conditional GET.
+
+        Returns the body, content type and validators, with not_modified set
+        when the body came from the cache after a 304.
+        """
+        cached = await asyncio.to_thread(self.cache.get, url) if self.cache else None
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        response = await self._get(url, headers)
+        if response.status_code == 304 and not cached:
+            # Nothing to serve the 304 from (the entry was evicted); ask for the full body once
+            response = await self._get(url, {'Cache-Control': 'no-cache'})
+
+        if response.status_code == 304 and cached:
+            self.counters['not_modified'] += 1
+            return {
+                'url': url,
+                'body': cached['body'],
+                'content_type': cached['content_type'],
+                'etag': response.headers.get('etag', cached['etag']),
+                'last_modified': response.headers.get('last-modified', cached['last_modified']),
+                'not_modified': True
+            }
+        if response.status_code != 200:
+            self.counters['errors'] += 1
+            raise WebFetchError(f'{url}: HTTP {response.status_code}')
+
+        content_type = response.headers.get('content-type', 'text/plain').split(';')[0].strip().lower()
+        if not content_type.startswith(TEXT_CONTENT_TYPES):
+            self.counters['errors'] += 1
+            raise WebFetchError(f'{url}: unsupported content type {content_type}')
+
+        body = response.text
+        self.counters['downloaded'] += 1
+        self.counters['bytes_downloaded'] += len(response.content)
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if self.cache and (etag or last_modified):
+            await asyncio.to_thread(self.cache.put, url, body, content_type, etag, last_modified)
+        return {
+            'url': url,
+            'body': body,
+            'content_type': content_type,
+            'etag': etag,
+            'last_modified': last_modified,
+            'not_modified': False
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Request counters and response cache size."""
+        return {
+            **self.counters,
+            'http2': self.http2,
+            'cache': self.cache.stats() if self.cache else None
+        }
+
+    async def close(self) -> None:
+        """Close the pooled client and the response cache."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.close)
+            self.cache = None
+
+    async def _get(self, url: str, headers: Dict[str, str]) -> httpx.Response:
+        """Send one GET within the host's concurrency limit."""
+        async with self._host_limit(url):
+            self.counters['requests'] += 1
+            try:
+                return await self._get_client().get(url, headers=headers)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                self.counters['errors'] += 1
+                raise WebFetchError(f'{url}: {type(e).__name__}: {e}')
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={'User-Agent': self.user_agent},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        """Semaphore bounding concurrent requests to the URL's host."""
+        host = urlsplit(url).netloc.lower()
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_limits[host]
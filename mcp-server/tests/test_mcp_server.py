@@ -7,18 +7,30 @@ Comprehensive testing of all tools and functionality.
 import asyncio
 import json
 import os
+import shutil
 import sys
 import tempfile
 import unittest
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, List
 
+import httpx
+import numpy as np
+
 # Add src directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
 
 from conversation_manager import ConversationManager
+from conversation_store import ConversationArchive, MemoryConversationStore, SQLiteConversationStore
+from message_log import SEGMENT_SIZE, Message, MessageLog
+from timestamps import NS_PER_SECOND, to_epoch_ns, to_iso
 from rag_processor import RAGProcessor
-from knowledge_base import KnowledgeBaseManager
+from knowledge_base import KnowledgeBaseManager, direct_source
+from chunking import get_tokenizer
+from embeddings import OpenAIEmbeddingProvider, pack_batches
+from embedding_cache import EmbeddingCache
+from retrieval_cache import RetrievalCache
 from agent_generator import RAGAgentGenerator
 from truststream_integration import TrustStreamIntegrator
 from cost_calculator import CostCalculator
@@ -31,7 +43,8 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         """Set up test environment"""
         self.conversation_manager = ConversationManager()
         self.rag_processor = RAGProcessor()
-        self.knowledge_base_manager = KnowledgeBaseManager()
+        self.storage_dir = self.temp_dir(prefix='kb_storage_')
+        self.knowledge_base_manager = KnowledgeBaseManager(storage_dir=self.storage_dir)
         self.agent_generator = RAGAgentGenerator()
         self.truststream_integrator = TrustStreamIntegrator()
         self.cost_calculator = CostCalculator()
@@ -41,6 +54,12 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         self.test_user_id = "test_user_123"
         self.test_description = "I need a customer support chatbot for my SaaS product"
     
+    def temp_dir(self, prefix: str = 'test_') -> str:
+        """Create a temporary directory removed when the test's cleanups run"""
+        path = tempfile.mkdtemp(prefix=prefix)
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+    
     async def test_conversation_management(self):
         """Test conversation management functionality"""
         print("\n🧪 Testing conversation management...")
@@ -81,6 +100,230 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         
         print("✅ Conversation management tests passed")
     
+    async def test_conversation_store(self):
+        """Test on-demand loading and eviction over memory and SQLite stores"""
+        print("\n🧪 Testing conversation store...")
+        
+        path = Path(self.temp_dir()) / 'conversations.sqlite'
+        manager = ConversationManager(SQLiteConversationStore(path), cache_size=1)
+        first = await manager.start_conversation('Support bot for billing questions', user_id='u1')
+        await manager.update_conversation_state(first['id'], {'state': 'requirements_gathered', 'template': 'faq'})
+        second = await manager.start_conversation('Research assistant for papers')
+        
+        # The idle conversation left memory but is loaded back on demand
+        self.assertEqual(list(manager.conversations), [second['id']])
+        reloaded = await manager.get_conversation(first['id'])
+        self.assertEqual(reloaded['state'], 'requirements_gathered')
+        self.assertEqual(reloaded['metadata']['template'], 'faq')
+        self.assertEqual(len(reloaded['messages']), 1)
+        self.assertEqual(manager.evictions, 2)
+        await manager.close()
+        
+        # A restarted manager finds both conversations
+        restarted = ConversationManager(SQLiteConversationStore(path))
+        await restarted.add_message(second['id'], 'user', 'Focus on biology')
+        self.assertEqual(len((await restarted.get_conversation(second['id']))['messages']), 2)
+        self.assertEqual(sorted(await restarted.store.list_ids()), sorted([first['id'], second['id']]))
+        await restarted.close()
+        
+        # The memory store is bounded by LRU eviction, spilling to disk
+        spill = ConversationArchive(Path(self.temp_dir()) / 'evicted')
+        bounded = ConversationManager(MemoryConversationStore(max_entries=1, spill=spill))
+        spilled = await bounded.start_conversation('First bot')
+        await bounded.add_message(spilled['id'], 'user', 'Answer in French')
+        await bounded.start_conversation('Second bot')
+        self.assertEqual((await bounded.store.stats())['spilled'], 1)
+        bounded.conversations.clear()
+        restored = await bounded.get_conversation(spilled['id'])
+        self.assertEqual([message.content for message in restored['messages']], ['First bot', 'Answer in French'])
+        self.assertEqual(len(await bounded.store.list_ids()), 2)
+        await bounded.close()
+        
+        print("✅ Conversation store tests passed")
+    
+    async def test_message_log(self):
+        """Test the segmented message log, its type index and per-message appends"""
+        print("\n🧪 Testing message log...")
+        
+        log = MessageLog()
+        for i in range(SEGMENT_SIZE * 2 + 5):
+            kind = 'configuration' if i % 100 == 0 else 'chat'
+            log.append(Message(f'm{i}', 'user', f'message {i}', {'type': kind}, i))
+        self.assertEqual(len(log), SEGMENT_SIZE * 2 + 5)
+        self.assertEqual(log.segment_count, 3)
+        self.assertEqual(log[SEGMENT_SIZE + 1]['id'], f'm{SEGMENT_SIZE + 1}')
+        self.assertEqual(log[-1].id, f'm{SEGMENT_SIZE * 2 + 4}')
+        self.assertEqual([message.id for message in log.of_type('configuration')], ['m0', 'm100', 'm200', 'm300', 'm400', 'm500'])
+        self.assertEqual(MessageLog.from_list(log.to_list())[300].content, 'message 300')
+        
+        # Decisions come from the index; SQLite stores one row per message
+        path = Path(self.temp_dir()) / 'conversations.sqlite'
+        manager = ConversationManager(SQLiteConversationStore(path))
+        conversation = await manager.start_conversation('FAQ bot')
+        await manager.add_message(conversation['id'], 'assistant', 'Use the faq template', {'type': 'template_selection'})
+        await manager.add_message(conversation['id'], 'user', 'Sounds good')
+        await manager.add_message(conversation['id'], 'assistant', 'Deployed', {'type': 'deployment'})
+        summary = await manager.generate_summary(conversation['id'])
+        self.assertEqual([decision['type'] for decision in summary['key_decisions']], ['template_selection', 'deployment'])
+        
+        rows = manager.store._connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        self.assertEqual(rows, 4)
+        header = manager.store._connection.execute('SELECT data FROM conversations').fetchone()[0]
+        self.assertNotIn('messages', json.loads(header))
+        
+        manager.conversations.clear()
+        reloaded = await manager.get_conversation(conversation['id'])
+        self.assertEqual([message.role for message in reloaded['messages']], ['user', 'assistant', 'user', 'assistant'])
+        self.assertEqual(reloaded['updated_at'], reloaded['messages'][-1].timestamp)
+        self.assertEqual(reloaded['messages'].count_of_type('deployment'), 1)
+        await manager.close()
+        
+        print("✅ Message log tests passed")
+    
+    async def test_conversation_expiry(self):
+        """Test idle expiry to the archive, restore on access and history compaction"""
+        print("\n🧪 Testing conversation expiry and compaction...")
+        
+        directory = Path(self.temp_dir())
+        manager = ConversationManager(
+            SQLiteConversationStore(directory / 'conversations.sqlite'),
+            idle_ttl=3600,
+            archive=ConversationArchive(directory / 'archive'),
+            compact_threshold=20,
+            compact_keep=5,
+            sweep_interval=3600
+        )
+        long_running = await manager.start_conversation('Policy assistant')
+        for i in range(30):
+            metadata = {'type': 'configuration'} if i in (3, 28) else {}
+            await manager.add_message(long_running['id'], 'user', f'message {i}', metadata)
+        idle = await manager.start_conversation('Abandoned bot')
+        idle['updated_at'] = 946684800 * 10**9  # 2000-01-01
+        await manager.store.save(idle)
+        
+        result = await manager.sweep()
+        self.assertEqual(result, {'expired': 1, 'compacted_messages': 26})
+        stats = await manager.get_stats()
+        self.assertEqual(stats['conversations_in_memory'], 1)
+        self.assertEqual(stats['messages_in_memory'], 6)
+        self.assertEqual(stats['store']['messages'], 6)
+        self.assertEqual(stats['archive']['conversations'], 1)
+        self.assertEqual(stats['archive']['message_histories'], 1)
+        
+        # The summary still counts and reports decisions from the cold history
+        summary = await manager.generate_summary(long_running['id'])
+        self.assertEqual(summary['message_count'], 31)
+        self.assertEqual([decision['decision'] for decision in summary['key_decisions']], ['message 3', 'message 28'])
+        self.assertEqual(len(manager.archive.load_messages(long_running['id'])), 26)
+        
+        # Compaction folds the previous summary into the new one
+        for i in range(20):
+            await manager.add_message(long_running['id'], 'user', f'more {i}')
+        self.assertEqual(await manager.compact_conversation(long_running['id']), 20)
+        self.assertEqual((await manager.generate_summary(long_running['id']))['message_count'], 51)
+        
+        # Both conversations survive a restart, the expired one via the archive
+        await manager.close()
+        restarted = ConversationManager(
+            SQLiteConversationStore(directory / 'conversations.sqlite'),
+            archive=ConversationArchive(directory / 'archive')
+        )
+        self.assertEqual(len((await restarted.get_conversation(long_running['id']))['messages']), 6)
+        restored = await restarted.get_conversation(idle['id'])
+        self.assertEqual(restored['messages'][0].content, 'Abandoned bot')
+        await restarted.add_message(idle['id'], 'user', 'Back again')
+        restarted.conversations.clear()
+        self.assertEqual(len((await restarted.get_conversation(idle['id']))['messages']), 2)
+        self.assertEqual(restarted.counters['restored'], 1)
+        await restarted.close()
+        
+        print("✅ Conversation expiry tests passed")
+    
+    async def test_conversation_locking(self):
+        """Test per-conversation locks against lost updates without serialising other conversations"""
+        print("\n🧪 Testing conversation locking...")
+        
+        path = Path(self.temp_dir()) / 'conversations.sqlite'
+        manager = ConversationManager(SQLiteConversationStore(path))
+        conversation = await manager.start_conversation('Counter bot')
+        other = await manager.start_conversation('Other bot')
+        
+        # Read, await, write back: no increment is lost under the lock
+        async def increment():
+            async with manager.lock(conversation['id']):
+                current = (await manager.get_conversation(conversation['id']))['metadata'].get('counter', {'value': 0})
+                await asyncio.sleep(0.001)
+                await manager.update_conversation_state(conversation['id'], {'counter': {'value': current['value'] + 1}})
+        
+        await asyncio.gather(*(increment() for _ in range(10)))
+        self.assertEqual((await manager.get_conversation(conversation['id']))['metadata']['counter']['value'], 10)
+        
+        # Other conversations proceed while one is held; the held one waits
+        async with manager.lock(conversation['id']):
+            await asyncio.wait_for(manager.add_message(other['id'], 'user', 'Not blocked'), timeout=1)
+            waiting = asyncio.create_task(manager.add_message(conversation['id'], 'user', 'Blocked'))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+        await waiting
+        self.assertEqual(len((await manager.get_conversation(conversation['id']))['messages']), 2)
+        
+        # Concurrent loads of an evicted conversation share one object
+        manager.conversations.clear()
+        first, second = await asyncio.gather(
+            manager.get_conversation(other['id']),
+            manager.get_conversation(other['id'])
+        )
+        self.assertIs(first, second)
+        self.assertEqual(manager._locks, {})
+        await manager.close()
+        
+        print("✅ Conversation locking tests passed")
+    
+    async def test_conversation_timestamps(self):
+        """Test epoch-nanosecond timestamps and their ISO rendering"""
+        print("\n🧪 Testing conversation timestamps...")
+        
+        self.assertEqual(to_iso(1792152000123456789), '2026-10-16T12:00:00.123456+00:00')
+        self.assertEqual(to_epoch_ns('2026-10-16T12:00:00.123456+00:00'), 1792152000123456000)
+        self.assertEqual(to_epoch_ns('2026-10-16T12:00:00Z'), 1792152000 * NS_PER_SECOND)
+        
+        manager = ConversationManager(MemoryConversationStore())
+        conversation = await manager.start_conversation('Timing bot')
+        await manager.add_message(conversation['id'], 'assistant', 'Deploy to staging', {'type': 'deployment'})
+        self.assertIsInstance(conversation['created_at'], int)
+        self.assertEqual(conversation['updated_at'], conversation['messages'][-1].timestamp)
+        
+        # Durations are integer arithmetic; summaries render ISO
+        conversation['created_at'] -= 90 * NS_PER_SECOND
+        summary = await manager.generate_summary(conversation['id'])
+        self.assertAlmostEqual(summary['duration_minutes'], 1.5, places=2)
+        decision = summary['key_decisions'][0]
+        self.assertEqual(to_epoch_ns(decision['timestamp']) // 1000, conversation['messages'][-1].timestamp // 1000)
+        
+        # SQLite keeps updated_at as an indexed epoch-nanosecond column
+        path = Path(self.temp_dir()) / 'conversations.sqlite'
+        durable = ConversationManager(SQLiteConversationStore(path))
+        stored = await durable.start_conversation('Durable bot')
+        await durable.close()
+        
+        restarted = ConversationManager(SQLiteConversationStore(path))
+        loaded = await restarted.get_conversation(stored['id'])
+        self.assertEqual((loaded['created_at'], loaded['updated_at']), (stored['created_at'], stored['updated_at']))
+        self.assertEqual(loaded['messages'][0].timestamp, stored['messages'][0].timestamp)
+        self.assertEqual(await restarted.store.list_idle(stored['updated_at']), [])
+        self.assertEqual(await restarted.store.list_idle(stored['updated_at'] + 1), [stored['id']])
+        await restarted.close()
+        
+        # The benchmark compares the ISO and epoch paths and runs every store
+        sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+        from conversation_benchmark import run_benchmark
+        report = json.loads(json.dumps(await run_benchmark(messages=50, iterations=1000)))
+        self.assertGreater(report['timestamps']['per_message_ns']['iso'], 0)
+        self.assertEqual([case['store'] for case in report['add_message']], ['memory', 'sqlite'])
+        self.assertEqual(report['add_message'][1]['key_decisions'], 13)
+        
+        print("✅ Conversation timestamp tests passed")
+    
     async def test_rag_processor(self):
         """Test RAG processing functionality"""
         print("\n🧪 Testing RAG processor...")
@@ -149,8 +392,738 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         self.assertIn('results', test_result)
         self.assertIn('metrics', test_result)
         
+        # Retrieval comes from the real index
+        password_hits = test_result['results'][0]['results']
+        self.assertGreater(len(password_hits), 0)
+        self.assertEqual(password_hits[0]['content'], "FAQ: How to reset password?")
+        # Direct content is keyed by its hash rather than repeated per chunk
+        self.assertEqual(password_hits[0]['source'], direct_source("FAQ: How to reset password?"))
+        self.assertEqual(kb_result['index_stats']['chunk_count'], 3)
+        
+        # A fresh manager serves the persisted knowledge base from mmap'd files
+        reopened = KnowledgeBaseManager(storage_dir=self.storage_dir)
+        reopened_result = await reopened.test_retrieval(kb_id, ["How to reset password?"])
+        self.assertEqual(
+            reopened_result['results'][0]['results'][0]['chunk_id'],
+            password_hits[0]['chunk_id']
+        )
+        info = await reopened.get_knowledge_base_info(kb_id)
+        self.assertEqual(info['index_stats']['chunk_count'], 3)
+        
+        self.assertTrue(await reopened.delete_knowledge_base(kb_id))
+        self.assertFalse(os.path.exists(os.path.join(self.storage_dir, kb_id)))
+        
         print("✅ Knowledge base manager tests passed")
     
+    async def test_chunking(self):
+        """Test offset-based chunking with deterministic IDs"""
+        print("\n🧪 Testing offset-based chunking...")
+        
+        text = "  ".join(f"word{i}" for i in range(25))
+        chunks = self.knowledge_base_manager._chunk_text(text, 10, 2, source='doc.txt')
+        
+        self.assertEqual([c.start_index for c in chunks], [0, 8, 16])
+        self.assertEqual(chunks[-1].end_index, 25)
+        # Text is sliced from the original document, whitespace included
+        self.assertEqual(chunks[0].text, text[chunks[0].start:chunks[0].end])
+        self.assertTrue(chunks[1].text.startswith("word8  word9"))
+        
+        # Re-chunking the same content yields the same IDs, hashed only when read
+        again = self.knowledge_base_manager._chunk_text(text, 10, 2, source='doc.txt')
+        self.assertIsNone(again[0]._id)
+        self.assertEqual([c.id for c in chunks], [c.id for c in again])
+        self.assertEqual(len({c.id for c in chunks}), 3)
+        
+        # Repeated passages keep distinct IDs
+        repeated = self.knowledge_base_manager._chunk_text("same words here " * 8, 3, 0, source='doc.txt')
+        self.assertEqual(len({c.text for c in repeated}), 1)
+        self.assertEqual(len({c.id for c in repeated}), len(repeated))
+        
+        print("✅ Chunking tests passed")
+    
+    async def test_token_chunking(self):
+        """Test token-based chunking and measured token counts"""
+        print("\n🧪 Testing token-based chunking...")
+        
+        tokenizer = get_tokenizer('text-embedding-ada-002')
+        self.assertIs(tokenizer, get_tokenizer('text-embedding-ada-002'))
+        
+        text = " ".join(f"Sentence {i}, with punctuation." for i in range(40))
+        starts = tokenizer.token_starts(text)
+        self.assertEqual(len(starts), tokenizer.count(text))
+        
+        chunks = self.knowledge_base_manager._chunk_text(text, 32, 8, source='doc.txt', token_starts=starts)
+        self.assertTrue(all(c.token_count <= 32 for c in chunks))
+        self.assertEqual(chunks[1].start_index, 24)
+        self.assertEqual(chunks[-1].end, len(text))
+        self.assertEqual(tokenizer.count_batch([c.text for c in chunks[:1]]), [tokenizer.count(chunks[0].text)])
+        
+        result = await self.knowledge_base_manager.process_documents(
+            [text, "Short document."],
+            {'chunk_unit': 'tokens', 'chunk_size': 32, 'overlap': 8}
+        )
+        self.assertEqual(result['total_tokens'], len(starts) + tokenizer.count("Short document."))
+        self.assertEqual(result['knowledge_base_size']['estimated_tokens'], result['total_tokens'])
+        
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id})
+        embeddings = await self.knowledge_base_manager.configure_embeddings({'knowledge_base_id': kb_id})
+        self.assertEqual(embeddings['estimated_tokens'], result['total_tokens'])
+        
+        print("✅ Token chunking tests passed")
+    
+    async def test_embedding_provider(self):
+        """Test token-budgeted batching and retries of embedding requests"""
+        print("\n🧪 Testing embedding provider...")
+        
+        self.assertEqual(pack_batches([5, 5, 5, 20, 1, 1], 3, 10), [(0, 2), (2, 3), (3, 4), (4, 6)])
+        
+        requests = []
+        
+        def handler(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            if len(requests) == 1:
+                return httpx.Response(429, headers={'retry-after': '0'})
+            texts = json.loads(request.content)['input']
+            return httpx.Response(200, json={'data': [
+                {'index': i, 'embedding': [float(len(text)), 1.0]} for i, text in reversed(list(enumerate(texts)))
+            ]})
+        
+        provider = OpenAIEmbeddingProvider('text-embedding-3-small', 2, api_key='test', batch_size=2, max_concurrency=1)
+        provider._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=provider.base_url)
+        try:
+            vectors = await provider.embed(['a', 'bb', 'ccc'], [1, 1, 1])
+        finally:
+            await provider.close()
+        
+        self.assertEqual(vectors[:, 0].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(len(requests), 3)  # one 429 retry plus two batches
+        self.assertEqual(provider.stats['retries'], 1)
+        self.assertEqual(json.loads(requests[-1].content)['dimensions'], 2)
+        
+        # Settings chosen with configure_embeddings stick to the knowledge base
+        result = await self.knowledge_base_manager.process_documents(
+            ["Embedding settings document"], {'embedding_config': {'batch_size': 16, 'dimensions': 64}}
+        )
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id})
+        configured = await self.knowledge_base_manager.configure_embeddings(
+            {'knowledge_base_id': kb_id, 'retry_count': 5, 'dimensions': 1536}
+        )
+        self.assertEqual(configured['config']['dimensions'], 64)
+        self.assertEqual(configured['config']['batch_size'], 16)
+        info = await self.knowledge_base_manager.get_knowledge_base_info(kb_id)
+        self.assertEqual(info['embedding_config']['retry_count'], 5)
+        
+        print("✅ Embedding provider tests passed")
+    
+    async def test_embedding_cache(self):
+        """Test the shared embedding cache and its LRU size cap"""
+        print("\n🧪 Testing embedding cache...")
+        
+        documents = [f"Shared onboarding guide section {i}" for i in range(20)]
+        first = await self.knowledge_base_manager.process_documents(documents)
+        
+        # A second knowledge base with the same chunks is served from the cache
+        second = await self.knowledge_base_manager.process_documents(documents)
+        self.assertNotEqual(first['knowledge_base_id'], second['knowledge_base_id'])
+        self.assertEqual(second['embedding_cache']['hits'] - first['embedding_cache']['hits'], 20)
+        self.assertEqual(second['embedding_cache']['misses'], first['embedding_cache']['misses'])
+        
+        # Query embeddings served from the cache do not discount ingestion estimates
+        embedder = self.knowledge_base_manager._get_embedder({})
+        for _ in range(3):
+            await embedder.embed(documents, purpose='query')
+        costs = await self.knowledge_base_manager.configure_embeddings({'estimated_tokens': 100000})
+        ingest = costs['cache_stats']['by_purpose']['ingest']
+        self.assertEqual(costs['cache_stats']['by_purpose']['query']['hits'], 60)
+        self.assertEqual(costs['ingest_cache_hit_rate'], ingest['hits'] / (ingest['hits'] + ingest['misses']))
+        self.assertGreater(costs['cache_stats']['hit_rate'], costs['ingest_cache_hit_rate'])
+        self.assertAlmostEqual(
+            costs['estimated_total_cost'], costs['estimated_cost_without_cache'] * (1 - costs['ingest_cache_hit_rate'])
+        )
+        
+        # Least recently used entries are evicted beyond the size cap
+        cache = EmbeddingCache(Path(self.storage_dir) / 'small_cache.sqlite', max_bytes=10 * 16)
+        try:
+            vectors = np.eye(4, dtype=np.float32)
+            cache.put_many('model', 4, ['a', 'b', 'c', 'd'], vectors)
+            cache.get_many('model', 4, ['a'])
+            cache.put_many('model', 4, ['e', 'f', 'g', 'h', 'i', 'j', 'k'], np.ones((7, 4), dtype=np.float32))
+            hits = cache.get_many('model', 4, ['a', 'b'])
+            self.assertIsNotNone(hits[0])
+            self.assertIsNone(hits[1])
+            self.assertLessEqual(cache.stats()['size_bytes'], 10 * 16)
+        finally:
+            cache.close()
+        
+        print("✅ Embedding cache tests passed")
+    
+    async def test_streaming_ingestion(self):
+        """Test streamed document processing with progress events"""
+        print("\n🧪 Testing streaming document ingestion...")
+        
+        documents = [f"Release note {i}: fixed issue number {i}" for i in range(25)]
+        events = []
+        async for event in self.knowledge_base_manager.stream_documents(documents, {'batch_size': 4}):
+            events.append(event)
+        
+        batch_events = [e for e in events if e['event'] == 'batch']
+        self.assertEqual(events[-1]['event'], 'complete')
+        self.assertEqual(events[-1]['chunks_indexed'], 25)
+        self.assertEqual(len(batch_events), 7)  # ceil(25 / 4)
+        
+        # Staged chunks become searchable once the knowledge base is created
+        kb_id = events[-1]['knowledge_base_id']
+        kb_result = await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id})
+        self.assertEqual(kb_result['index_stats']['chunk_count'], 25)
+        self.assertEqual(kb_result['index_stats']['document_count'], 25)
+        
+        print("✅ Streaming ingestion tests passed")
+    
+    async def test_concurrent_ingestion(self):
+        """Test bounded-concurrency ingestion of file sources"""
+        print("\n🧪 Testing concurrent document ingestion...")
+        
+        source_dir = self.temp_dir()
+        sources = []
+        for i in range(6):
+            path = os.path.join(source_dir, f'guide_{i}.txt')
+            with open(path, 'w') as f:
+                f.write(f"Installation guide part {i}")
+            sources.append(path)
+        sources.append(os.path.join(source_dir, 'manual.pdf'))
+        open(sources[-1], 'wb').close()
+        # A directory exists but cannot be read as a document
+        sources.append(source_dir)
+        
+        try:
+            result = await self.knowledge_base_manager.process_documents(sources, {'max_concurrency': 3})
+        finally:
+            await self.knowledge_base_manager.close()
+        
+        # The empty PDF is parsed for real in the process pool and rejected
+        self.assertEqual(result['processed_count'], 6)
+        self.assertEqual({error['source'] for error in result['errors']}, {source_dir, sources[-2]})
+        self.assertEqual(
+            {doc['source_type'] for doc in result['processed_documents']},
+            {'file'}
+        )
+        
+        print("✅ Concurrent ingestion tests passed")
+    
+    async def test_document_loaders(self):
+        """Test PDF/DOCX/HTML extraction and page-aware chunking"""
+        print("\n🧪 Testing document loaders...")
+        
+        from document_loaders import BeautifulSoup, join_pages
+        
+        # Chunks of a paged document record the page they start on
+        content, page_starts = join_pages(['alpha page one', 'beta page two', 'gamma page three'])
+        chunks = self.knowledge_base_manager._chunk_text(content, 3, 0, source='manual.pdf', page_starts=page_starts)
+        self.assertEqual([chunk.page for chunk in chunks], [1, 2, 3])
+        self.assertEqual(chunks[1].text, 'beta page two')
+        
+        path = os.path.join(self.temp_dir(), 'pricing.html')
+        with open(path, 'w') as f:
+            f.write("<html><head><title>Ignored</title><script>var tracking = 1;</script></head>"
+                    "<body><h1>Pricing</h1><p>Plans start at <b>10 dollars</b> per seat.</p></body></html>")
+        try:
+            result = await self.knowledge_base_manager.process_documents([path])
+        finally:
+            await self.knowledge_base_manager.close()
+        
+        if BeautifulSoup is None:
+            # Without the optional parser the source fails with an install hint
+            self.assertIn('beautifulsoup4', result['errors'][0]['error'])
+        else:
+            kb_id = result['knowledge_base_id']
+            await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id})
+            hits = await self.knowledge_base_manager.search(kb_id, 'pricing plans', threshold=0.0)
+            self.assertIn('Plans start at', hits[0]['content'])
+            self.assertNotIn('tracking', hits[0]['content'])
+        
+        print("✅ Document loader tests passed")
+    
+    async def test_web_ingestion(self):
+        """Test pooled web fetching with per-host limits and conditional re-crawls"""
+        print("\n🧪 Testing web ingestion...")
+        
+        pages = {f'https://docs.example.com/guide/{i}': f"Guide page {i} explains webhook setup step {i}" for i in range(6)}
+        in_flight = {'now': 0, 'max': 0}
+        
+        async def handler(request: httpx.Request) -> httpx.Response:
+            url = str(request.url)
+            etag = f'"v1-{url[-1]}"'
+            if request.headers.get('if-none-match') == etag:
+                return httpx.Response(304, headers={'etag': etag})
+            if url.endswith('/stale') and 'no-cache' not in request.headers.get('cache-control', ''):
+                # An intermediary answering 304 to a request that had no validators
+                return httpx.Response(304)
+            if url.endswith('/broken'):
+                return httpx.Response(200, text="Broken date page", headers={
+                    'content-type': 'text/plain', 'etag': '"b"', 'last-modified': 'not a date'
+                })
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            await asyncio.sleep(0.01)
+            in_flight['now'] -= 1
+            return httpx.Response(200, text=pages[url], headers={
+                'content-type': 'text/plain; charset=utf-8', 'etag': etag,
+                'last-modified': 'Mon, 01 Jan 2024 00:00:00 GMT'
+            })
+        
+        manager = KnowledgeBaseManager(storage_dir=self.storage_dir)
+        manager.web_per_host_limit = 2
+        fetcher = manager._get_web_fetcher()
+        fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        
+        result = await manager.process_documents(list(pages), {'max_concurrency': 6})
+        kb_id = result['knowledge_base_id']
+        self.assertEqual(result['processed_count'], 6)
+        self.assertEqual(result['web_fetch']['downloaded'], 6)
+        self.assertLessEqual(in_flight['max'], 2)
+        self.assertEqual(result['processed_documents'][0]['modified_at'], '2024-01-01T00:00:00+00:00')
+        await manager.create_knowledge_base({'knowledge_base_id': kb_id})
+        hits = await manager.search(kb_id, 'webhook setup step 4', threshold=0.0)
+        self.assertEqual(hits[0]['source'], 'https://docs.example.com/guide/4')
+        
+        # A re-crawl revalidates every page and finds nothing changed
+        resync = await manager.process_documents(list(pages), {'knowledge_base_id': kb_id})
+        self.assertEqual(resync['web_fetch']['not_modified'], 6)
+        self.assertEqual(resync['skipped_count'], 6)
+        self.assertEqual(resync['embedded_chunks'], 0)
+        
+        # A 304 with no cached copy is retried for the full body
+        pages['https://docs.example.com/guide/stale'] = "Guide page that an intermediary revalidated"
+        page = await fetcher.fetch('https://docs.example.com/guide/stale')
+        self.assertEqual(page['body'], pages['https://docs.example.com/guide/stale'])
+        self.assertFalse(page['not_modified'])
+        
+        # A malformed Last-Modified header falls back to the fetch time
+        broken = await manager.process_documents(['https://docs.example.com/guide/broken'])
+        self.assertEqual(broken['processed_count'], 1)
+        self.assertIsNotNone(broken['processed_documents'][0]['modified_at'])
+        await manager.close()
+        
+        print("✅ Web ingestion tests passed")
+    
+    async def test_incremental_sync(self):
+        """Test content-hash skipping and incremental re-indexing"""
+        print("\n🧪 Testing incremental knowledge base sync...")
+        
+        source_dir = self.temp_dir()
+        contents = {
+            'faq.txt': " ".join(f"faq{i}" for i in range(30)),
+            'billing.txt': " ".join(f"billing{i}" for i in range(30)),
+            'legacy.txt': " ".join(f"legacy{i}" for i in range(30))
+        }
+        sources = {}
+        for name, content in contents.items():
+            sources[name] = os.path.join(source_dir, name)
+            with open(sources[name], 'w') as f:
+                f.write(content)
+        
+        options = {'chunk_size': 10, 'overlap': 0}
+        result = await self.knowledge_base_manager.process_documents(list(sources.values()), options)
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id, 'threshold': 0.0})
+        
+        # Change one chunk of billing.txt and drop legacy.txt
+        with open(sources['billing.txt'], 'w') as f:
+            f.write(contents['billing.txt'].replace('billing25', 'invoices25'))
+        
+        sync = await self.knowledge_base_manager.process_documents(
+            [sources['faq.txt'], sources['billing.txt']],
+            {**options, 'knowledge_base_id': kb_id}
+        )
+        self.assertEqual(sync['knowledge_base_id'], kb_id)
+        self.assertEqual((sync['skipped_count'], sync['updated_count'], sync['deleted_count']), (1, 1, 1))
+        self.assertEqual((sync['embedded_chunks'], sync['reused_chunks']), (1, 2))
+        
+        info = await self.knowledge_base_manager.get_knowledge_base_info(kb_id)
+        self.assertEqual(info['document_count'], 2)
+        self.assertEqual(info['index_stats']['chunk_count'], 6)
+        self.assertEqual(info['index_stats']['deleted_count'], 4)
+        
+        # Tombstoned chunks are no longer returned, also after reopening
+        reopened = KnowledgeBaseManager(storage_dir=self.storage_dir)
+        for manager in (self.knowledge_base_manager, reopened):
+            hits = await manager.search(kb_id, 'legacy3 billing25 invoices25', top_k=10, threshold=0.0)
+            self.assertNotIn(sources['legacy.txt'], {hit['source'] for hit in hits})
+            self.assertFalse(any('billing25' in hit['content'] for hit in hits))
+            self.assertTrue(any('invoices25' in hit['content'] for hit in hits))
+        
+        print("✅ Incremental sync tests passed")
+    
+    async def test_approximate_index(self):
+        """Test IVF index selection and recall reporting"""
+        print("\n🧪 Testing approximate knowledge base index...")
+        
+        documents = [f"Support article {i} about topic {i % 7} and feature {i % 11}" for i in range(200)]
+        result = await self.knowledge_base_manager.process_documents(documents)
+        
+        kb_result = await self.knowledge_base_manager.create_knowledge_base({
+            'knowledge_base_id': result['knowledge_base_id'],
+            'index_type': 'ivf',
+            'nlist': 8,
+            'nprobe': 2
+        })
+        
+        self.assertEqual(kb_result['index_stats']['index_type'], 'ivf')
+        self.assertTrue(kb_result['index_stats']['trained'])
+        
+        test_result = await self.knowledge_base_manager.test_retrieval(
+            result['knowledge_base_id'],
+            ["topic 3 feature 5", "article about topic 1"],
+            {'nprobe_sweep': [1, 8]}
+        )
+        
+        report = test_result['recall_report']
+        self.assertTrue(report['approximate'])
+        self.assertEqual(len(report['settings']), 2)
+        # Probing every bucket is exhaustive, so recall must be perfect
+        self.assertEqual(report['settings'][1]['recall_at_k'], 1.0)
+        
+        print("✅ Approximate index tests passed")
+    
+    async def test_quantized_index(self):
+        """Test float16/int8 quantized storage with full-precision re-ranking"""
+        print("\n🧪 Testing quantized knowledge base index...")
+        
+        documents = [f"Runbook {i} for service {i % 13} covering alert {i % 5}" for i in range(120)]
+        queries = ["service 4 alert 2", "runbook for service 11"]
+        
+        baseline = await self.knowledge_base_manager.process_documents(documents)
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': baseline['knowledge_base_id']})
+        expected = [
+            await self.knowledge_base_manager.search(baseline['knowledge_base_id'], query, top_k=5, threshold=0.0)
+            for query in queries
+        ]
+        
+        for quantization, ratio in (('float16', 2.0), ('int8', 3.9)):
+            result = await self.knowledge_base_manager.process_documents(documents)
+            kb_id = result['knowledge_base_id']
+            await self.knowledge_base_manager.create_knowledge_base({
+                'knowledge_base_id': kb_id,
+                'quantization': quantization
+            })
+            
+            stats = (await self.knowledge_base_manager.get_knowledge_base_info(kb_id))['index_stats']
+            self.assertEqual(stats['quantization'], quantization)
+            self.assertGreaterEqual(stats['compression_ratio'], ratio)
+            self.assertGreaterEqual(stats['estimated_recall'], 0.9)
+            
+            # Re-ranked scores are full precision, also after reopening from disk
+            reopened = KnowledgeBaseManager(storage_dir=self.storage_dir)
+            for query, exact in zip(queries, expected):
+                hits = await reopened.search(kb_id, query, top_k=5, threshold=0.0)
+                self.assertEqual(hits[0]['content'], exact[0]['content'])
+                self.assertAlmostEqual(hits[0]['score'], exact[0]['score'], places=5)
+        
+        print("✅ Quantized index tests passed")
+    
+    async def test_hybrid_retrieval(self):
+        """Test BM25 keyword and hybrid (reciprocal rank fusion) retrieval"""
+        print("\n🧪 Testing hybrid retrieval...")
+        
+        source_dir = self.temp_dir()
+        sources = []
+        for i in range(40):
+            sources.append(os.path.join(source_dir, f'api_{i}.md'))
+            with open(sources[-1], 'w') as f:
+                f.write(f"Endpoint reference page {i}. Call fetch_resource_{i} to load resource {i}.")
+        
+        result = await self.knowledge_base_manager.process_documents(sources)
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id, 'strategy': 'hybrid'})
+        
+        hits = await self.knowledge_base_manager.search(kb_id, 'how do I call fetch_resource_17', top_k=3)
+        self.assertIn('fetch_resource_17', hits[0]['content'])
+        self.assertIsNotNone(hits[0]['lexical_score'])
+        
+        keyword_hits = await self.knowledge_base_manager.search(kb_id, 'fetch_resource_5', top_k=3, strategy='keyword')
+        self.assertIn('fetch_resource_5 ', keyword_hits[0]['content'])
+        
+        # Incremental syncs extend the inverted index and drop replaced rows
+        with open(sources[5], 'w') as f:
+            f.write("Endpoint reference page 5. Call stream_resource_5 instead.")
+        await self.knowledge_base_manager.process_documents(sources, {'knowledge_base_id': kb_id})
+        
+        reopened = KnowledgeBaseManager(storage_dir=self.storage_dir)
+        for manager in (self.knowledge_base_manager, reopened):
+            self.assertEqual(await manager.search(kb_id, 'fetch_resource_5', strategy='keyword'), [])
+            hits = await manager.search(kb_id, 'stream_resource_5', top_k=1)
+            self.assertIn('stream_resource_5', hits[0]['content'])
+        
+        with self.assertRaises(ValueError):
+            await self.knowledge_base_manager.search(kb_id, 'query', strategy='mmr')
+        
+        # A Documentation Q&A agent switches its knowledge base to hybrid search
+        docs = await self.knowledge_base_manager.process_documents(sources[:10])
+        docs_kb = docs['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': docs_kb})
+        agent = await self.agent_generator.generate_rag_agent(
+            {'metadata': {'knowledge_base_id': docs_kb}}, 'documentation_qa'
+        )
+        retrieval_config = await self.knowledge_base_manager.apply_rag_config(docs_kb, agent['rag_config'])
+        self.assertEqual(retrieval_config['retrieval_strategy'], 'hybrid')
+        self.assertEqual(retrieval_config['similarity_top_k'], 7)
+        
+        lexical_before = self.knowledge_base_manager._lexical_scan_stats(docs_kb)['queries']
+        hits = await self.knowledge_base_manager.search(docs_kb, 'fetch_resource_3', top_k=3, threshold=0.0)
+        self.assertIn('fetch_resource_3', hits[0]['content'])
+        self.assertEqual(self.knowledge_base_manager._lexical_scan_stats(docs_kb)['queries'], lexical_before + 1)
+        
+        # The template key is also accepted when the knowledge base is created
+        created = await self.knowledge_base_manager.create_knowledge_base(
+            {'knowledge_base_id': docs_kb, 'retrieval_strategy': 'hybrid'}
+        )
+        self.assertEqual(created['retrieval_config']['retrieval_strategy'], 'hybrid')
+        
+        print("✅ Hybrid retrieval tests passed")
+    
+    async def test_filtered_retrieval(self):
+        """Test metadata filters applied before vector and keyword scoring"""
+        print("\n🧪 Testing filtered retrieval...")
+        
+        source_dir = self.temp_dir()
+        sources = []
+        for i in range(30):
+            sources.append(os.path.join(source_dir, f'guide_{i}.md'))
+            with open(sources[-1], 'w') as f:
+                f.write(f"Deployment guide {i} for region {i % 3}.")
+            # Guide i was last modified on day i of January 2024
+            modified = datetime(2024, 1, i + 1, tzinfo=timezone.utc).timestamp()
+            os.utime(sources[-1], (modified, modified))
+        documents = [f"Deployment guide pasted inline {i}" for i in range(30)]
+        
+        result = await self.knowledge_base_manager.process_documents(sources + documents)
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({
+            'knowledge_base_id': kb_id, 'index_type': 'ivf', 'nlist': 8, 'nprobe': 1
+        })
+        
+        # A selective filter still fills top_k, even outside the probed buckets
+        hits = await self.knowledge_base_manager.search(
+            kb_id, 'deployment guide', top_k=3, threshold=0.0, filters={'source': [sources[7], sources[21]]}
+        )
+        self.assertEqual({hit['source'] for hit in hits}, {sources[7], sources[21]})
+        
+        hits = await self.knowledge_base_manager.search(
+            kb_id, 'deployment guide', top_k=50, threshold=0.0,
+            filters={'source_type': 'file', 'modified_at': {'gte': '2024-01-10', 'lt': '2024-01-15'}}
+        )
+        self.assertEqual(sorted(hit['source'] for hit in hits), sorted(sources[9:14]))
+        
+        test_result = await self.knowledge_base_manager.test_retrieval(
+            kb_id, ['pasted inline'], {'threshold': 0.0, 'strategy': 'hybrid', 'filters': {'source_type': 'direct'}}
+        )
+        self.assertTrue(all(hit['source_type'] == 'direct' for hit in test_result['results'][0]['results']))
+        
+        with self.assertRaises(ValueError):
+            await self.knowledge_base_manager.search(kb_id, 'guide', filters={'author': 'x'})
+        for filters in ({'source': {'eq': ['faq.md']}}, {'source_type': {'eq': {'a': 1}}}, {'page': {'in': 3}}):
+            with self.assertRaises(ValueError):
+                await self.knowledge_base_manager.search(kb_id, 'guide', filters=filters)
+        
+        # Posting lists are written at ingestion and follow incremental syncs
+        self.assertTrue(os.path.exists(os.path.join(self.storage_dir, kb_id, 'metadata_values.json')))
+        with open(sources[3], 'w') as f:
+            f.write("Deployment guide 3, revised.")
+        modified = datetime(2024, 1, 12, tzinfo=timezone.utc).timestamp()
+        os.utime(sources[3], (modified, modified))
+        await self.knowledge_base_manager.process_documents(sources + documents, {'knowledge_base_id': kb_id})
+        
+        reopened = KnowledgeBaseManager(storage_dir=self.storage_dir)
+        for manager in (self.knowledge_base_manager, reopened):
+            hits = await manager.search(
+                kb_id, 'deployment guide', top_k=50, threshold=0.0,
+                filters={'source_type': 'file', 'modified_at': {'gte': '2024-01-10', 'lt': '2024-01-15'}}
+            )
+            self.assertEqual(sorted(hit['source'] for hit in hits), sorted([sources[3]] + sources[9:14]))
+        
+        print("✅ Filtered retrieval tests passed")
+    
+    async def test_batch_retrieval(self):
+        """Test multi-query retrieval scored in one batch"""
+        print("\n🧪 Testing batch retrieval...")
+        
+        documents = [f"Pricing note {i} on plan {i % 9} and seat tier {i % 4}" for i in range(150)]
+        queries = ["plan 3 seat tier 1", "pricing for plan 8", "seat tier 2", "unrelated question"]
+        
+        for config in ({}, {'index_type': 'ivf', 'nlist': 6, 'nprobe': 2, 'quantization': 'int8'}):
+            result = await self.knowledge_base_manager.process_documents(documents)
+            kb_id = result['knowledge_base_id']
+            await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id, **config})
+            
+            batch = await self.knowledge_base_manager.search_batch(kb_id, queries, top_k=4, threshold=0.0)
+            self.assertEqual(len(batch), len(queries))
+            for query, hits in zip(queries, batch):
+                single = await self.knowledge_base_manager.search(kb_id, query, top_k=4, threshold=0.0)
+                # Tied chunks may swap places, so compare the ranked scores
+                self.assertEqual(len(hits), len(single))
+                for hit, expected in zip(hits, single):
+                    self.assertAlmostEqual(hit['score'], expected['score'], places=5)
+        
+        self.assertEqual(await self.knowledge_base_manager.search_batch(kb_id, []), [])
+        
+        print("✅ Batch retrieval tests passed")
+    
+    async def test_retrieval_cache(self):
+        """Test exact and semantic retrieval cache hits, bounds and invalidation"""
+        print("\n🧪 Testing retrieval cache...")
+        
+        manager = KnowledgeBaseManager(storage_dir=self.temp_dir())
+        manager.retrieval_cache = RetrievalCache(max_entries=3, ttl=60)
+        cache = manager.retrieval_cache
+        documents = [f"To reset password {i} open account settings page {i}" for i in range(20)]
+        result = await manager.process_documents(documents)
+        kb_id = result['knowledge_base_id']
+        await manager.create_knowledge_base({'knowledge_base_id': kb_id, 'semantic_cache_distance': 0.3})
+        
+        first = await manager.search(kb_id, 'How do I reset my password', threshold=0.0)
+        self.assertEqual(await manager.search(kb_id, '  how do I RESET my password ', threshold=0.0), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        
+        # A rephrased query close in embedding space is served from the cache
+        self.assertEqual(await manager.search(kb_id, 'How do I reset my password please', threshold=0.0), first)
+        self.assertEqual(cache.semantic_hits, 1)
+        await manager.search(kb_id, 'billing invoices refund', threshold=0.0)
+        self.assertEqual(cache.misses, 2)
+        
+        # Entries are bounded and dropped whenever the knowledge base changes
+        for i in range(4):
+            await manager.search(kb_id, f'settings page {i}', threshold=0.0)
+        self.assertEqual(cache.stats()['entries'], 3)
+        await manager.update_knowledge_base(kb_id, {'description': 'FAQ'})
+        self.assertEqual(cache.stats()['entries'], 0)
+        await manager.search(kb_id, 'settings page 3', threshold=0.0)
+        await manager.process_documents(documents[:10], {'knowledge_base_id': kb_id})
+        self.assertEqual(cache.stats()['entries'], 0)
+        
+        # Expired entries are not served
+        cache.ttl = 0
+        await manager.search(kb_id, 'settings page 3', threshold=0.0)
+        misses = cache.misses
+        await manager.search(kb_id, 'settings page 3', threshold=0.0)
+        self.assertEqual(cache.misses, misses + 1)
+        await manager.close()
+        
+        print("✅ Retrieval cache tests passed")
+    
+    async def test_reranking(self):
+        """Test the rerank stage, model hooks and the latency budget fallback"""
+        print("\n🧪 Testing reranking...")
+        
+        documents = [f"Refund policy section {i} covers orders placed in region {i % 5}" for i in range(30)]
+        documents.append("To request a refund policy exception contact billing support")
+        result = await self.knowledge_base_manager.process_documents(documents)
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({
+            'knowledge_base_id': kb_id, 'reranking': True, 'rerank_candidates': 10
+        })
+        
+        hits = await self.knowledge_base_manager.search(kb_id, 'refund policy exception', top_k=3, threshold=0.0)
+        self.assertIn('exception', hits[0]['content'])
+        self.assertTrue(all('rerank_score' in hit for hit in hits))
+        
+        # A model hook replaces the default scorer
+        self.knowledge_base_manager.register_reranker('by_length', lambda query, texts: [-len(text) for text in texts])
+        info = await self.knowledge_base_manager.get_knowledge_base_info(kb_id)
+        await self.knowledge_base_manager.update_knowledge_base(
+            kb_id, {'retrieval_config': {**info['retrieval_config'], 'reranker': 'by_length'}}
+        )
+        hits = await self.knowledge_base_manager.search(kb_id, 'refund policy', top_k=3, threshold=0.0)
+        self.assertEqual(hits[0]['rerank_score'], -len(hits[0]['content']))
+        
+        # Scoring past the budget keeps the retrieval order
+        async def slow_model(query, texts):
+            await asyncio.sleep(1)
+            return [0.0] * len(texts)
+        
+        self.knowledge_base_manager.register_reranker('by_length', slow_model)
+        test_result = await self.knowledge_base_manager.test_retrieval(
+            kb_id, ['refund policy region 2'], {'threshold': 0.0, 'rerank': True}
+        )
+        self.assertEqual(test_result['metrics']['rerank_fallbacks'], 1)
+        self.assertLess(test_result['metrics']['rerank_time'], 0.5)
+        self.assertNotIn('rerank_score', test_result['results'][0]['results'][0])
+        
+        print("✅ Reranking tests passed")
+    
+    async def test_retrieval_metrics(self):
+        """Test measured latency, scan counts and labeled ranking quality"""
+        print("\n🧪 Testing retrieval metrics...")
+        
+        documents = [f"Invoice guide {i} explains billing cycle {i % 6} for account type {i % 3}" for i in range(60)]
+        result = await self.knowledge_base_manager.process_documents(documents)
+        kb_id = result['knowledge_base_id']
+        await self.knowledge_base_manager.create_knowledge_base({'knowledge_base_id': kb_id})
+        
+        queries = ['billing cycle 4 account type 1', 'invoice guide 7']
+        hits = await self.knowledge_base_manager.search(kb_id, queries[1], top_k=5, threshold=0.0)
+        relevant = [[hits[0]['chunk_id'], 'missing-chunk'], [hits[0]['chunk_id']]]
+        
+        test_result = await self.knowledge_base_manager.test_retrieval(
+            kb_id, queries, {'top_k': 5, 'threshold': 0.0, 'relevant_chunk_ids': relevant}
+        )
+        metrics = test_result['metrics']
+        latency = metrics['latency']
+        self.assertEqual(latency['mode'], 'per_query')
+        self.assertTrue(0 < latency['p50'] <= latency['p95'] <= latency['p99'] <= latency['max'])
+        
+        # The second query was cached by the search above; the first scanned every row
+        self.assertEqual(metrics['cache_hit_rate'], 0.5)
+        self.assertEqual(metrics['index_scans']['vector_queries'], 1)
+        self.assertEqual(metrics['index_scans']['rows_scanned'], 60)
+        self.assertEqual(metrics['index_scans']['scan_fraction'], 1.0)
+        
+        # Quality against labels: the cached query ranks its only relevant chunk first
+        self.assertEqual(test_result['results'][1]['relevance'], {'recall_at_k': 1.0, 'reciprocal_rank': 1.0, 'ndcg_at_k': 1.0})
+        self.assertLessEqual(test_result['results'][0]['relevance']['recall_at_k'], 0.5)
+        self.assertEqual(metrics['relevance']['labeled_queries'], 2)
+        self.assertLess(metrics['relevance']['recall_at_k'], 1.0)
+        
+        with self.assertRaises(ValueError):
+            await self.knowledge_base_manager.test_retrieval(kb_id, queries, {'relevant_chunk_ids': [relevant[0]]})
+        
+        print("✅ Retrieval metrics tests passed")
+    
+    async def test_retrieval_benchmark(self):
+        """Test the synthetic-corpus retrieval benchmark"""
+        print("\n🧪 Testing retrieval benchmark...")
+        
+        sys.path.insert(0, str(Path(__file__).parent.parent / 'benchmarks'))
+        from retrieval_benchmark import SyntheticCorpus, run_benchmark
+        
+        # The corpus is reproducible from its seed
+        first, second = SyntheticCorpus(50, query_count=5, seed=3), SyntheticCorpus(50, query_count=5, seed=3)
+        self.assertEqual(list(first.documents()), list(second.documents()))
+        self.assertEqual(first.queries(), second.queries())
+        
+        report = await run_benchmark(
+            [300], dimensions=64, index_types=('flat', 'ivf'), quantizations=('float32', 'int8'),
+            query_count=10, top_k=5, nlist=4, nprobe=4
+        )
+        report = json.loads(json.dumps(report))
+        self.assertEqual(len(report['results']), 4)
+        for case in report['results']:
+            self.assertEqual(case['chunks'], 300)
+            self.assertGreater(case['ingest']['chunks_per_second'], 0)
+            self.assertGreater(case['query']['qps'], 0)
+            self.assertEqual(case['recall']['labeled_queries'], 10)
+        
+        flat, flat_int8, ivf, _ = report['results']
+        self.assertEqual(flat['recall']['approximate_recall_at_k'], 1.0)
+        self.assertLess(flat_int8['memory']['index_bytes'], flat['memory']['index_bytes'])
+        # Probing every bucket matches exact search
+        self.assertEqual(ivf['index_type'], 'ivf')
+        self.assertEqual(ivf['recall']['approximate_recall_at_k'], 1.0)
+        self.assertGreater(flat['recall']['mrr'], 0.5)
+        
+        print("✅ Retrieval benchmark tests passed")
+    
     async def test_template_manager(self):
         """Test template management"""
         print("\n🧪 Testing template manager...")
@@ -217,6 +1190,11 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         # Validate server code is generated
         self.assertIn('FastMCP', agent_config['server_code'])
         self.assertIn('@mcp.tool', agent_config['server_code'])
+        compile(agent_config['server_code'], 'server.py', 'exec')
+        
+        # Search filters go to the knowledge base's posting lists, not a post-filter over results
+        self.assertIn('filters=filters', agent_config['server_code'])
+        self.assertNotIn('_matches_filters', agent_config['server_code'])
         
         print("✅ Agent generator tests passed")
     
@@ -359,8 +1337,31 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         
         tests = [
             self.test_conversation_management,
+            self.test_conversation_store,
+            self.test_message_log,
+            self.test_conversation_expiry,
+            self.test_conversation_locking,
+            self.test_conversation_timestamps,
             self.test_rag_processor,
             self.test_knowledge_base_manager,
+            self.test_chunking,
+            self.test_token_chunking,
+            self.test_embedding_provider,
+            self.test_embedding_cache,
+            self.test_streaming_ingestion,
+            self.test_concurrent_ingestion,
+            self.test_document_loaders,
+            self.test_web_ingestion,
+            self.test_incremental_sync,
+            self.test_approximate_index,
+            self.test_quantized_index,
+            self.test_hybrid_retrieval,
+            self.test_filtered_retrieval,
+            self.test_batch_retrieval,
+            self.test_retrieval_cache,
+            self.test_reranking,
+            self.test_retrieval_metrics,
+            self.test_retrieval_benchmark,
             self.test_template_manager,
             self.test_agent_generator,
             self.test_cost_calculator,
@@ -371,15 +1372,18 @@ class TestChatToRAGMCPServer(unittest.TestCase):
         passed = 0
         failed = 0
         
-        for test in tests:
-            try:
-                await test()
-                passed += 1
-            except Exception as e:
-                print(f"❌ {test.__name__} failed: {e}")
-                failed += 1
-                import traceback
-                traceback.print_exc()
+        try:
+            for test in tests:
+                try:
+                    await test()
+                    passed += 1
+                except Exception as e:
+                    print(f"❌ {test.__name__} failed: {e}")
+                    failed += 1
+                    import traceback
+                    traceback.print_exc()
+        finally:
+            self.doCleanups()
         
         print("\n" + "="*60)
         print(f"📊 Test Results: {passed} passed, {failed} failed")